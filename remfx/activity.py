@@ -0,0 +1,126 @@
+import os
+import torch
+import torchaudio
+import numpy as np
+import multiprocessing
+from tqdm import tqdm
+from pathlib import Path
+from typing import Dict, List
+from remfx.utils import available_cpus
+from remfx.manifest import MANIFEST_DIR
+
+# Frames per activity block
+ACTIVITY_HOP = 4096
+# Mean absolute amplitude below which a chunk is rejected as silent
+ENERGY_THRESH = 1e-4
+
+
+def activity_path(root: str, mode: str) -> Path:
+    return Path(root) / MANIFEST_DIR / f"{mode}_activity.npz"
+
+
+def block_activity(audio: np.ndarray, hop: int = ACTIVITY_HOP) -> np.ndarray:
+    """Sum of the channel-mean absolute amplitude over each block of hop
+    frames of a (channels, time) signal.
+    """
+    amplitude = np.abs(audio).mean(0, dtype=np.float64)
+    amplitude = np.pad(amplitude, (0, -len(amplitude) % hop))
+    return amplitude.reshape(-1, hop).sum(1)
+
+
+def _init_activity_worker():
+    torch.set_num_threads(1)
+
+
+def _file_activity(args) -> np.ndarray:
+    audio_file, hop = args
+    audio, _ = torchaudio.load(audio_file)
+    return block_activity(audio.numpy(), hop)
+
+
+def update_activity(
+    path: str, files: List[str], hop: int = ACTIVITY_HOP, num_workers: int = None
+) -> Dict[str, np.ndarray]:
+    """Block activity of every file, stored in an npz at path.
+    Only files that are new or modified since the last update are decoded.
+    """
+    path = Path(path)
+    known = {}
+    if path.exists():
+        stored = np.load(path)
+        if int(stored["hop"]) == hop:
+            bounds = stored["offsets"]
+            for i, (f, mtime) in enumerate(zip(stored["files"], stored["mtimes"])):
+                known[str(f)] = (mtime, stored["blocks"][bounds[i] : bounds[i + 1]])
+
+    mtimes = {f: os.path.getmtime(f) for f in files}
+    activity = {
+        f: known[f][1] for f in files if f in known and known[f][0] == mtimes[f]
+    }
+    missing = [f for f in files if f not in activity]
+    if missing:
+        print(f"Computing activity of {len(missing)} files...")
+        if num_workers is None:
+            num_workers = available_cpus()
+        with multiprocessing.Pool(
+            num_workers, initializer=_init_activity_worker
+        ) as pool:
+            args = [(f, hop) for f in missing]
+            blocks = pool.imap(_file_activity, args, chunksize=4)
+            for f, block in zip(missing, tqdm(blocks, total=len(missing))):
+                activity[f] = block
+
+    if missing or set(known) != set(activity):
+        stored_files = sorted(activity)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}.npz")
+        np.savez(
+            tmp_path,
+            hop=hop,
+            files=np.array(stored_files),
+            mtimes=np.array([mtimes[f] for f in stored_files]),
+            offsets=np.cumsum([0] + [len(activity[f]) for f in stored_files]),
+            blocks=np.concatenate([activity[f] for f in stored_files] + [[]]),
+        )
+        os.replace(tmp_path, path)
+    return activity
+
+
+def valid_spans(
+    blocks: np.ndarray,
+    num_frames: int,
+    chunk_frames: int,
+    hop: int = ACTIVITY_HOP,
+    threshold: float = ENERGY_THRESH,
+) -> np.ndarray:
+    """Chunk starts of a file that are certain to pass the energy check,
+    as (start, length) rows. A start in block b covers at least blocks b+1
+    to b + chunk_frames // hop - 1, whose activity bounds the chunk's.
+    """
+    usable = num_frames - chunk_frames
+    num_covered = chunk_frames // hop - 1
+    if usable <= 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    if num_covered < 1:
+        # Chunks too short to bound, keep every start
+        return np.array([[0, usable]], dtype=np.int64)
+    num_starts = -(-usable // hop)
+    csum = np.concatenate([[0.0], np.cumsum(blocks)])
+    first = np.arange(num_starts) + 1
+    last = np.minimum(first + num_covered, len(blocks))
+    lower = csum[last] - csum[np.minimum(first, last)]
+    valid = lower >= threshold * chunk_frames
+    # Merge runs of valid blocks into spans
+    edges = np.diff(np.concatenate([[0], valid.astype(np.int8), [0]]))
+    run_starts = np.flatnonzero(edges == 1) * hop
+    run_stops = np.minimum(np.flatnonzero(edges == -1) * hop, usable)
+    return np.stack([run_starts, run_stops - run_starts], 1).astype(np.int64)
+
+
+def span_offset(spans: np.ndarray, position: int) -> int:
+    """Start of the position-th valid chunk start of a file."""
+    if spans is None:
+        return position
+    cum = np.cumsum(spans[:, 1])
+    span = int(np.searchsorted(cum, position, side="right"))
+    return int(spans[span, 0]) + position - (int(cum[span - 1]) if span > 0 else 0)
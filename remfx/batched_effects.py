@@ -0,0 +1,353 @@
+import math
+import torch
+import numba
+import numpy as np
+from typing import Dict
+from remfx.effects import (
+    rand,
+    loguniform,
+    RandomPedalboardCompressor,
+    RandomPedalboardDelay,
+    RandomPedalboardChorus,
+    RandomPedalboardDistortion,
+    RandomPedalboardReverb,
+)
+
+# Freeverb tunings of JUCE's Reverb, in samples at 44.1 kHz
+COMB_TUNINGS = np.array([1116, 1188, 1277, 1356, 1422, 1491, 1557, 1617])
+ALLPASS_TUNINGS = np.array([556, 441, 341, 225])
+STEREO_SPREAD = 23
+# Longest chorus delay JUCE's Chorus allocates, in ms
+MAX_CHORUS_DELAY_MS = 50.0
+
+
+@numba.njit(cache=True, parallel=True)
+def compressor_kernel(x, threshold_db, ratio, attack_ms, release_ms, sample_rate):
+    """JUCE's Compressor: peak envelope with attack/release ballistics."""
+    B, C, T = x.shape
+    y = np.empty_like(x)
+    one = np.float32(1.0)
+    for b in numba.prange(B):
+        threshold = np.float32(10.0 ** (threshold_db[b] / 20.0))
+        threshold_inv = one / threshold
+        ratio_inv = np.float32(1.0 / ratio[b])
+        cte_at = np.float32(
+            math.exp(-2.0 * math.pi * 1000.0 / sample_rate / attack_ms[b])
+        )
+        cte_rl = np.float32(
+            math.exp(-2.0 * math.pi * 1000.0 / sample_rate / release_ms[b])
+        )
+        for c in range(C):
+            env = np.float32(0.0)
+            for t in range(T):
+                v = x[b, c, t]
+                level = abs(v)
+                cte = cte_at if level > env else cte_rl
+                env = level + cte * (env - level)
+                if env < threshold:
+                    y[b, c, t] = v
+                else:
+                    gain = np.float32((env * threshold_inv) ** (ratio_inv - one))
+                    y[b, c, t] = gain * v
+    return y
+
+
+@numba.njit(cache=True, parallel=True)
+def delay_kernel(x, delay_samples, feedback, mix):
+    """JUCE's Delay: feedback delay line mixed linearly with the input."""
+    B, C, T = x.shape
+    y = np.empty_like(x)
+    for b in numba.prange(B):
+        line = np.empty(T, dtype=np.float32)
+        d = delay_samples[b]
+        fb = np.float32(feedback[b])
+        wet = np.float32(mix[b])
+        dry = np.float32(1.0) - wet
+        for c in range(C):
+            for t in range(T):
+                delayed = line[t - d] if t >= d else np.float32(0.0)
+                line[t] = x[b, c, t] + fb * delayed
+                y[b, c, t] = dry * x[b, c, t] + wet * delayed
+    return y
+
+
+@numba.njit(cache=True, parallel=True)
+def chorus_kernel(x, rate_hz, depth, centre_delay_ms, feedback, mix, sample_rate):
+    """JUCE's Chorus: sine-modulated, linearly interpolated delay line
+    with feedback, mixed linearly with the input.
+    """
+    B, C, T = x.shape
+    y = np.empty_like(x)
+    sr = np.float32(sample_rate)
+    pi = np.float32(math.pi)
+    two_pi = np.float32(2.0 * math.pi)
+    size = int(math.ceil(MAX_CHORUS_DELAY_MS * sample_rate / 1000.0)) + 2
+    for b in numba.prange(B):
+        line = np.empty(size, dtype=np.float32)
+        delays = np.empty(T, dtype=np.float32)
+        increment = np.float32(two_pi * np.float32(rate_hz[b]) / sr)
+        volume = np.float32(np.float32(depth[b]) * np.float32(0.5))
+        centre = np.float32(centre_delay_ms[b])
+        fb = np.float32(feedback[b])
+        wet = np.float32(mix[b])
+        dry = np.float32(1.0) - wet
+        # The LFO is shared by all channels
+        phase = np.float32(0.0)
+        for t in range(T):
+            lfo = np.float32(math.sin(phase - pi))
+            phase = np.float32(phase + increment)
+            if phase >= two_pi:
+                phase = np.float32(phase - two_pi)
+            delay_ms = np.float32(np.float32(20.0) * volume * lfo + centre)
+            delay_ms = max(np.float32(1.0), delay_ms)
+            delays[t] = np.float32(np.float64(delay_ms) * sample_rate / 1000.0)
+        for c in range(C):
+            line[:] = 0.0
+            write = 0
+            last = np.float32(0.0)
+            for t in range(T):
+                line[write] = np.float32(x[b, c, t] - last)
+                d = delays[t]
+                d_int = int(d)
+                d_frac = np.float32(d - np.float32(d_int))
+                read = write - d_int
+                if read < 0:
+                    read += size
+                v1 = line[read]
+                v2 = line[read - 1 if read > 0 else size - 1]
+                out = np.float32(v1 + d_frac * (v2 - v1))
+                write = write + 1 if write < size - 1 else 0
+                last = np.float32(out * fb)
+                y[b, c, t] = dry * x[b, c, t] + wet * out
+    return y
+
+
+@numba.njit(cache=True)
+def _undenormalise(v):
+    # JUCE_UNDENORMALISE, which also rounds away tiny values
+    v = np.float32(v + np.float32(0.1))
+    return np.float32(v - np.float32(0.1))
+
+
+@numba.njit(cache=True, parallel=True)
+def reverb_kernel(x, room_size, damping, wet_level, dry_level, width, sample_rate):
+    """JUCE's Reverb (Freeverb) on mono or stereo input."""
+    B, C, T = x.shape
+    y = np.empty_like(x)
+    sr = int(sample_rate)
+    num_combs = len(COMB_TUNINGS)
+    num_allpasses = len(ALLPASS_TUNINGS)
+    S = 2 if C == 2 else 1
+    num_filters = S * (num_combs + num_allpasses)
+    # One buffer holds every comb then every allpass filter of each side
+    bounds = np.zeros(num_filters + 1, dtype=np.int64)
+    for s in range(S):
+        for j in range(num_combs):
+            size = sr * (COMB_TUNINGS[j] + s * STEREO_SPREAD) // 44100
+            bounds[s * num_combs + j + 1] = size
+        for j in range(num_allpasses):
+            size = sr * (ALLPASS_TUNINGS[j] + s * STEREO_SPREAD) // 44100
+            bounds[S * num_combs + s * num_allpasses + j + 1] = size
+    bounds = np.cumsum(bounds)
+    one = np.float32(1.0)
+    for b in numba.prange(B):
+        buffer = np.empty(bounds[-1], dtype=np.float32)
+        position = np.empty(num_filters, dtype=np.int64)
+        last = np.empty(num_filters, dtype=np.float32)
+        out = np.empty(2, dtype=np.float32)
+        damp = np.float32(np.float32(damping[b]) * np.float32(0.4))
+        fb = np.float32(np.float32(room_size[b]) * np.float32(0.28) + np.float32(0.7))
+        wet = np.float32(np.float32(wet_level[b]) * np.float32(3.0))
+        wet1 = np.float32(np.float32(0.5) * wet * (one + np.float32(width[b])))
+        wet2 = np.float32(np.float32(0.5) * wet * (one - np.float32(width[b])))
+        dry = np.float32(np.float32(dry_level[b]) * np.float32(2.0))
+        buffer[:] = 0.0
+        position[:] = bounds[:-1]
+        last[:] = 0.0
+        for t in range(T):
+            if S == 1:
+                inp = np.float32(x[b, 0, t] * np.float32(0.015))
+            else:
+                inp = np.float32((x[b, 0, t] + x[b, 1, t]) * np.float32(0.015))
+            for s in range(S):
+                acc = np.float32(0.0)
+                for j in range(num_combs):
+                    k = s * num_combs + j
+                    v = buffer[position[k]]
+                    last[k] = _undenormalise(v * (one - damp) + last[k] * damp)
+                    buffer[position[k]] = _undenormalise(inp + last[k] * fb)
+                    position[k] += 1
+                    if position[k] == bounds[k + 1]:
+                        position[k] = bounds[k]
+                    acc += v
+                for j in range(num_allpasses):
+                    k = S * num_combs + s * num_allpasses + j
+                    v = buffer[position[k]]
+                    buffer[position[k]] = _undenormalise(acc + v * np.float32(0.5))
+                    position[k] += 1
+                    if position[k] == bounds[k + 1]:
+                        position[k] = bounds[k]
+                    acc = np.float32(v - acc)
+                out[s] = acc
+            if S == 1:
+                for c in range(C):
+                    y[b, c, t] = out[0] * wet1 + x[b, c, t] * dry
+            else:
+                y[b, 0, t] = out[0] * wet1 + out[1] * wet2 + x[b, 0, t] * dry
+                y[b, 1, t] = out[1] * wet1 + out[0] * wet2 + x[b, 1, t] * dry
+    return y
+
+
+class BatchedEffect:
+    """Mixin for effects that process a (batch, channels, time) tensor
+    at once, with parameters drawn independently for every example. The
+    kernels process the examples of a batch in parallel on numba's threads.
+    """
+
+    def sample_params(self, batch_size: int) -> Dict[str, np.ndarray]:
+        raise NotImplementedError
+
+    def process(self, x: torch.Tensor, **params: np.ndarray) -> torch.Tensor:
+        raise NotImplementedError
+
+    def forward(self, x: torch.Tensor):
+        if x.ndim == 2:
+            return self.forward(x.unsqueeze(0)).squeeze(0)
+        return self.process(x, **self.sample_params(x.shape[0]))
+
+
+def _run(kernel, x: torch.Tensor, *args) -> torch.Tensor:
+    y = kernel(np.ascontiguousarray(x.numpy(), dtype=np.float32), *args)
+    return torch.from_numpy(y)
+
+
+class BatchedCompressor(BatchedEffect, RandomPedalboardCompressor):
+    def sample_params(self, batch_size: int) -> Dict[str, np.ndarray]:
+        return {
+            "threshold_db": rand(
+                self.min_threshold_db, self.max_threshold_db, batch_size
+            ),
+            "ratio": rand(self.min_ratio, self.max_ratio, batch_size),
+            "attack_ms": rand(self.min_attack_ms, self.max_attack_ms, batch_size),
+            "release_ms": rand(self.min_release_ms, self.max_release_ms, batch_size),
+        }
+
+    def process(self, x, threshold_db, ratio, attack_ms, release_ms):
+        return _run(
+            compressor_kernel,
+            x,
+            np.asarray(threshold_db, dtype=np.float64),
+            np.asarray(ratio, dtype=np.float64),
+            np.asarray(attack_ms, dtype=np.float64),
+            np.asarray(release_ms, dtype=np.float64),
+            float(self.sample_rate),
+        )
+
+
+class BatchedDelay(BatchedEffect, RandomPedalboardDelay):
+    def sample_params(self, batch_size: int) -> Dict[str, np.ndarray]:
+        return {
+            "delay_seconds": loguniform(
+                self.min_delay_seconds, self.max_delay_seconds, batch_size
+            ),
+            "feedback": rand(self.min_feedback, self.max_feedback, batch_size),
+            "mix": rand(self.min_mix, self.max_mix, batch_size),
+        }
+
+    def process(self, x, delay_seconds, feedback, mix):
+        delay_samples = np.asarray(delay_seconds, dtype=np.float64) * self.sample_rate
+        return _run(
+            delay_kernel,
+            x,
+            delay_samples.astype(np.int64),
+            np.asarray(feedback, dtype=np.float64),
+            np.asarray(mix, dtype=np.float64),
+        )
+
+
+class BatchedChorus(BatchedEffect, RandomPedalboardChorus):
+    def sample_params(self, batch_size: int) -> Dict[str, np.ndarray]:
+        return {
+            "rate_hz": rand(self.min_rate_hz, self.max_rate_hz, batch_size),
+            "depth": rand(self.min_depth, self.max_depth, batch_size),
+            "centre_delay_ms": rand(
+                self.min_centre_delay_ms, self.max_centre_delay_ms, batch_size
+            ),
+            "feedback": rand(self.min_feedback, self.max_feedback, batch_size),
+            "mix": rand(self.min_mix, self.max_mix, batch_size),
+        }
+
+    def process(self, x, rate_hz, depth, centre_delay_ms, feedback, mix):
+        return _run(
+            chorus_kernel,
+            x,
+            np.asarray(rate_hz, dtype=np.float64),
+            np.asarray(depth, dtype=np.float64),
+            np.asarray(centre_delay_ms, dtype=np.float64),
+            np.asarray(feedback, dtype=np.float64),
+            np.asarray(mix, dtype=np.float64),
+            float(self.sample_rate),
+        )
+
+
+class BatchedDistortion(BatchedEffect, RandomPedalboardDistortion):
+    def sample_params(self, batch_size: int) -> Dict[str, np.ndarray]:
+        return {"drive_db": rand(self.min_drive_db, self.max_drive_db, batch_size)}
+
+    def process(self, x, drive_db):
+        gain = 10.0 ** (torch.as_tensor(drive_db, dtype=torch.float32) / 20.0)
+        return torch.tanh(gain[:, None, None] * x)
+
+
+class BatchedReverb(BatchedEffect, RandomPedalboardReverb):
+    def sample_params(self, batch_size: int) -> Dict[str, np.ndarray]:
+        return {
+            "room_size": rand(self.min_room_size, self.max_room_size, batch_size),
+            "damping": rand(self.min_damping, self.max_damping, batch_size),
+            "wet_dry": rand(self.min_wet_dry, self.max_wet_dry, batch_size),
+            "width": rand(self.min_width, self.max_width, batch_size),
+        }
+
+    def process(self, x, room_size, damping, wet_dry, width):
+        wet_dry = np.asarray(wet_dry, dtype=np.float64)
+        return _run(
+            reverb_kernel,
+            x,
+            np.asarray(room_size, dtype=np.float64),
+            np.asarray(damping, dtype=np.float64),
+            wet_dry,
+            1 - wet_dry,
+            np.asarray(width, dtype=np.float64),
+            float(self.sample_rate),
+        )
+
+
+BATCHED_EFFECTS = {
+    RandomPedalboardCompressor: BatchedCompressor,
+    RandomPedalboardDelay: BatchedDelay,
+    RandomPedalboardChorus: BatchedChorus,
+    RandomPedalboardDistortion: BatchedDistortion,
+    RandomPedalboardReverb: BatchedReverb,
+}
+
+
+def batched(effect: torch.nn.Module) -> torch.nn.Module:
+    """Batched version of a Pedalboard effect with the same parameter ranges.
+    Effects without one are returned as they are.
+    """
+    if isinstance(effect, BatchedEffect) or type(effect) not in BATCHED_EFFECTS:
+        return effect
+    batched_effect = BATCHED_EFFECTS[type(effect)].__new__(
+        BATCHED_EFFECTS[type(effect)]
+    )
+    batched_effect.__dict__.update(effect.__dict__)
+    return batched_effect
+
+
+def apply_effect(effect: torch.nn.Module, x: torch.Tensor) -> torch.Tensor:
+    """Apply an effect to every example of a (batch, channels, time) tensor,
+    in one call if it is batched.
+    """
+    if isinstance(effect, BatchedEffect):
+        return effect(x)
+    return torch.stack([effect(item) for item in x])
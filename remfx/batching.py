@@ -0,0 +1,49 @@
+import torch
+from typing import Iterator, List, Tuple
+from torch.utils.data import Sampler
+
+
+class LengthBucketSampler(Sampler):
+    """Batches of up to batch_size indices of similar length. Indices are
+    sorted by length and cut into consecutive batches, so cropping every
+    batch to its shortest item (see crop_collate) drops as little audio as
+    possible for a fixed batch order.
+    """
+
+    def __init__(self, lengths: List[int], batch_size: int):
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be at least 1. Got {batch_size}")
+        self.lengths = lengths
+        self.batch_size = batch_size
+        order = sorted(range(len(lengths)), key=lambda i: (lengths[i], i))
+        self.batches = [
+            order[i : i + batch_size] for i in range(0, len(order), batch_size)
+        ]
+
+    def __iter__(self) -> Iterator[List[int]]:
+        return iter(self.batches)
+
+    def __len__(self) -> int:
+        return len(self.batches)
+
+    def cropped(self) -> float:
+        """Fraction of samples dropped by cropping batches to their
+        shortest item.
+        """
+        total = sum(self.lengths)
+        kept = sum(min(self.lengths[i] for i in b) * len(b) for b in self.batches)
+        return 1 - kept / max(total, 1)
+
+
+def crop_collate(
+    items: List[Tuple],
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    """Stack (wet, dry, dry_labels, wet_labels) items of different lengths,
+    cropping audio at the end to the shortest item. Models then run on the
+    whole batch, and no padding changes their output or the metrics.
+    """
+    wet, dry, dry_labels, wet_labels = zip(*items)
+    length = min(x.shape[-1] for x in dry)
+    x = torch.stack([w[..., :length] for w in wet])
+    y = torch.stack([d[..., :length] for d in dry])
+    return x, y, torch.stack(dry_labels), torch.stack(wet_labels)
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import torch
+from pathlib import Path
+from typing import Any, Dict, List
+from remfx.utils import get_audio_info
+
+CACHE_INFO = "cache.json"
+
+
+def effect_config(effect: torch.nn.Module) -> Dict[str, Any]:
+    """Class name and parameter ranges of an effect module."""
+    config = {"class": type(effect).__name__}
+    for name, value in sorted(vars(effect).items()):
+        if name.startswith("_") or name == "training":
+            continue
+        if isinstance(value, (int, float, str, bool, list, tuple)) or value is None:
+            config[name] = value
+    return config
+
+
+def source_digest(file_list: List[List[str]]) -> str:
+    """Hash of every source file's path, mtime and header info."""
+    h = hashlib.sha1()
+    for files in file_list:
+        for f in files:
+            num_frames, sr, num_channels = get_audio_info(f)
+            mtime = os.path.getmtime(f)
+            h.update(f"{f}:{mtime}:{num_frames}:{sr}:{num_channels}\n".encode())
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+def render_key(config: Dict[str, Any]) -> str:
+    """Stable hash of a render configuration."""
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def cache_path(render_root: str, name: str, mode: str, key: str) -> Path:
+    return Path(render_root) / "processed" / name / f"{mode}_{key[:16]}"
+
+
+def touch_cache_info(
+    path: str, key: str, config: Dict[str, Any], root: str, total_chunks: int
+) -> None:
+    """Create or refresh the cache.json of a render, recording its full
+    configuration, source root, requested size and when it was last used.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    info_path = path / CACHE_INFO
+    now = time.time()
+    info = {
+        "key": key,
+        "config": config,
+        "root": str(root),
+        "total_chunks": total_chunks,
+        "created": now,
+    }
+    if info_path.exists():
+        with open(info_path) as f:
+            info["created"] = json.load(f).get("created", now)
+    info["last_used"] = now
+    with open(info_path.with_suffix(f".tmp{os.getpid()}"), "w") as f:
+        json.dump(info, f, indent=2)
+    os.replace(info_path.with_suffix(f".tmp{os.getpid()}"), info_path)
+
+
+def list_cache(render_root: str) -> List[Dict[str, Any]]:
+    """Info of every cached render under render_root, oldest use first."""
+    entries = []
+    for info_path in Path(render_root).glob(f"processed/*/*/{CACHE_INFO}"):
+        with open(info_path) as f:
+            info = json.load(f)
+        info["path"] = str(info_path.parent)
+        info["size"] = sum(
+            p.stat().st_size for p in info_path.parent.rglob("*") if p.is_file()
+        )
+        completed = info_path.parent / "completed.txt"
+        num_completed = 0
+        if completed.exists():
+            with open(completed) as f:
+                num_completed = len({line for line in f if line.strip().isdigit()})
+        info["num_completed"] = num_completed
+        entries.append(info)
+    return sorted(entries, key=lambda info: info["last_used"])
+
+
+def remove_cache_entry(info: Dict[str, Any]) -> None:
+    shutil.rmtree(info["path"])
@@ -9,6 +9,18 @@ from remfx import effects
 ALL_EFFECTS = effects.Pedalboard_Effects
 
 
+class ProducerPoolMonitor(Callback):
+    """Log the queue depth and starvation of a ProducerPoolDataset used
+    for training, to spot when data loading cannot keep up.
+    """
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        dataset = trainer.datamodule.train_dataset
+        if hasattr(dataset, "metrics"):
+            metrics = {f"producers/{k}": float(v) for k, v in dataset.metrics().items()}
+            pl_module.log_dict(metrics, on_step=True, on_epoch=False)
+
+
 class AudioCallback(Callback):
     def __init__(self, sample_rate, log_audio, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -0,0 +1,210 @@
+import os
+import json
+import torch
+import torchaudio
+import numpy as np
+import multiprocessing
+from tqdm import tqdm
+from pathlib import Path
+from typing import List, Tuple
+from remfx.cache import render_key
+from remfx.utils import available_cpus
+from remfx.activity import block_activity
+
+CORPUS_VERSION = 1
+
+
+def corpus_path(corpus_root: str, mode: str, sample_rate: int) -> Path:
+    return Path(corpus_root) / f"{mode}_{sample_rate}"
+
+
+def _init_prepare_worker():
+    torch.set_num_threads(1)
+
+
+def _load_mono_resampled(args: Tuple[str, int]) -> np.ndarray:
+    audio_file, sample_rate = args
+    audio, sr = torchaudio.load(audio_file)
+    # Sum to mono
+    audio = audio.sum(0)
+    if sr != sample_rate:
+        audio = torchaudio.functional.resample(audio, sr, sample_rate)
+    return audio.numpy().astype(np.float32)
+
+
+def prepare_corpus(
+    file_list: List[List[str]],
+    output_dir: str,
+    sample_rate: int,
+    num_workers: int = None,
+) -> None:
+    """Transcode every file to mono at sample_rate and pack them into one
+    contiguous float32 file (audio.f32) with an offset table (index.json).
+    The index is written last, so an interrupted prepare is never loaded.
+    Activity maps of a previous corpus in output_dir are removed.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    flat_files = [f for files in file_list for f in files]
+    if num_workers is None:
+        num_workers = available_cpus()
+
+    entries = []
+    datasets = []
+    offset = 0
+    # Unique per process, as ranks may prepare the same corpus at once
+    tmp_audio = output_dir / f"audio.f32.tmp{os.getpid()}"
+    with open(tmp_audio, "wb") as out, multiprocessing.Pool(
+        num_workers, initializer=_init_prepare_worker
+    ) as pool:
+        args = [(f, sample_rate) for f in flat_files]
+        audio_iter = pool.imap(_load_mono_resampled, args, chunksize=4)
+        for files in file_list:
+            dataset = []
+            for audio_file in tqdm(files):
+                audio = next(audio_iter)
+                out.write(audio.tobytes())
+                dataset.append(len(entries))
+                entries.append(
+                    [audio_file, os.path.getmtime(audio_file), offset, len(audio)]
+                )
+                offset += len(audio)
+            datasets.append(dataset)
+    os.replace(tmp_audio, output_dir / "audio.f32")
+    for path in output_dir.glob("activity_*.npy"):
+        path.unlink(missing_ok=True)
+
+    index = {
+        "version": CORPUS_VERSION,
+        "sample_rate": sample_rate,
+        "num_samples": offset,
+        "files": entries,
+        "datasets": datasets,
+    }
+    tmp_index = output_dir / f"index.json.tmp{os.getpid()}"
+    with open(tmp_index, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_index, output_dir / "index.json")
+
+
+class CorpusStore:
+    """Read-only view of a corpus written by prepare_corpus.
+    Chunks are returned as tensors backed by the memory map, so drawing a
+    chunk involves no decode, resample or copy.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        with open(self.path / "index.json") as f:
+            index = json.load(f)
+        self.sample_rate = index["sample_rate"]
+        self.num_samples = index["num_samples"]
+        self.entries = index["files"]
+        self.datasets = index["datasets"]
+        self._audio = None
+
+    def __getstate__(self):
+        # Each process opens its own map
+        state = self.__dict__.copy()
+        state["_audio"] = None
+        return state
+
+    @property
+    def audio(self) -> np.ndarray:
+        if self._audio is None:
+            # Copy-on-write so tensors are writable without touching the file
+            self._audio = np.memmap(
+                self.path / "audio.f32",
+                dtype=np.float32,
+                mode="c",
+                shape=(self.num_samples,),
+            )
+        return self._audio
+
+    def matches(self, file_list: List[List[str]], sample_rate: int) -> bool:
+        """Whether the store was prepared from these files at this rate."""
+        if sample_rate != self.sample_rate:
+            return False
+        prepared = [
+            [tuple(self.entries[i][:2]) for i in dataset] for dataset in self.datasets
+        ]
+        current = [[(f, os.path.getmtime(f)) for f in files] for files in file_list]
+        return prepared == current
+
+    def weight_files(self, chunk_size: int) -> Tuple[List[List[int]], List[List[int]]]:
+        """Entry ids per dataset and their number of valid chunk starts.
+        Counterpart of remfx.datasets.weight_files for the store.
+        """
+        files_out = []
+        weights_out = []
+        for dataset in self.datasets:
+            kept = [i for i in dataset if self.entries[i][3] > chunk_size]
+            if len(kept) > 0:
+                files_out.append(kept)
+                weights_out.append([self.entries[i][3] - chunk_size for i in kept])
+        return files_out, weights_out
+
+    def activity(self, hop: int) -> List[np.ndarray]:
+        """Block activity of every entry (see remfx.activity), computed on
+        first use and stored with the corpus, keyed on its index.
+        """
+        key = render_key({"files": self.entries, "hop": hop})
+        path = self.path / f"activity_{hop}_{key[:16]}.npy"
+        bounds = np.cumsum([0] + [-(-entry[3] // hop) for entry in self.entries])
+        if path.exists() and len(np.load(path, mmap_mode="r")) != bounds[-1]:
+            print(f"Activity map {path} does not match the corpus, recomputing.")
+            path.unlink(missing_ok=True)
+        if not path.exists():
+            blocks = np.concatenate(
+                [
+                    block_activity(self.audio[offset : offset + length][None], hop)
+                    for _, _, offset, length in self.entries
+                ]
+                + [[]]
+            )
+            tmp_path = path.with_suffix(f".tmp{os.getpid()}.npy")
+            np.save(tmp_path, blocks)
+            os.replace(tmp_path, path)
+        blocks = np.load(path)
+        return [blocks[bounds[i] : bounds[i + 1]] for i in range(len(self.entries))]
+
+    def select_random_chunk(
+        self, entry_idx: int, chunk_size: int, sample_rate: int
+    ) -> torch.Tensor:
+        """Same contract as remfx.utils.select_random_chunk, for an entry id."""
+        if sample_rate != self.sample_rate:
+            raise ValueError(
+                f"Corpus {self.path} was prepared at {self.sample_rate} Hz, "
+                f"not {sample_rate} Hz."
+            )
+        length = self.entries[entry_idx][3]
+        if chunk_size >= length:
+            return None
+        random_start = torch.randint(0, length - chunk_size, (1,)).item()
+        return self.read_chunk(entry_idx, random_start, chunk_size)
+
+    def read_chunk(self, entry_idx: int, start: int, chunk_size: int) -> torch.Tensor:
+        """Chunk of an entry starting at sample start, or None if silent."""
+        offset = self.entries[entry_idx][2] + start
+        chunk = torch.from_numpy(self.audio[offset : offset + chunk_size])
+        # Skip if energy too low
+        if torch.mean(torch.abs(chunk)) < 1e-4:
+            return None
+        return chunk.unsqueeze(0)
+
+
+def load_corpus(
+    corpus_root: str, mode: str, file_list: List[List[str]], sample_rate: int
+) -> CorpusStore:
+    """Open the prepared corpus for a split, preparing it first if it is
+    missing or was built from different source files.
+    """
+    path = corpus_path(corpus_root, mode, sample_rate)
+    if (path / "index.json").exists():
+        store = CorpusStore(path)
+        if store.matches(file_list, sample_rate):
+            return store
+        print(f"Source files changed since {path} was prepared.")
+    print(f"Preparing corpus at {path}...")
+    prepare_corpus(file_list, path, sample_rate)
+    return CorpusStore(path)
@@ -1,25 +1,67 @@
 import os
 import sys
+import math
+import time
 import glob
 import torch
 import shutil
 import torchaudio
 import pytorch_lightning as pl
 import random
+import numpy as np
 from tqdm import tqdm
+from collections import OrderedDict
+from functools import partial
 from pathlib import Path
 from remfx import effects as effect_lib
-from typing import Any, List, Dict
+from typing import Any, List, Dict, Tuple
 from torch.utils.data import Dataset, DataLoader
-from remfx.utils import select_random_chunk
+from remfx.utils import select_random_chunk, slice_chunk, get_audio_info
+from remfx.utils import available_cpus
+from remfx.manifest import manifest_path, update_manifest
+from remfx.corpus import CorpusStore, load_corpus
+from remfx.storage import fix_length, open_store
+from remfx.cache import cache_path, effect_config, render_key, source_digest
+from remfx.cache import touch_cache_info
+from remfx.activity import ACTIVITY_HOP, activity_path, update_activity
+from remfx.activity import span_offset, valid_spans
+from remfx.plan import chunk_rng, draw_start, make_plan, group_by_source
+from remfx.plan import REDRAW_STREAM, seeded
+from remfx.batched_effects import apply_effect, batched
+from remfx.gate import SpectralGate
+from remfx.pairs import load_pair, load_pairs
+from remfx.batching import LengthBucketSampler, crop_collate
+from remfx.loading import PinnedCollate, init_loader_worker
+from remfx.distributed import find_failure, mark_failed, rank_info, rank_range
+from remfx.distributed import wait_until
 import multiprocessing
 from auraloss.freq import MultiResolutionSTFTLoss
 
 
 STFT_THRESH = 1e-3
+# How EffectDataset treats an existing render when render_files=True
+RENDER_MODES = ["resume", "overwrite", "prompt"]
+# Directories of the per-rank stores and failure markers of a
+# distributed render
+RANKS_DIR = "ranks"
+FAILED_DIR = "ranks_failed"
+# Bump when a change to rendering invalidates existing renders
+RENDER_VERSION = 4
 ALL_EFFECTS = effect_lib.Pedalboard_Effects
 
 
+def effect_label(effect: torch.nn.Module) -> int:
+    """Index of an effect in ALL_EFFECTS. Batched versions of an effect
+    (see remfx.batched_effects) share its label.
+    """
+    for label, effect_type in enumerate(ALL_EFFECTS):
+        if isinstance(effect, effect_type):
+            return label
+    raise ValueError(
+        f"Effect {effect} not found in ALL_EFFECTS. Please choose from {ALL_EFFECTS}"
+    )
+
+
 vocalset_splits = {
     "train": [
         "male1",
@@ -56,10 +98,22 @@ idmt_drums_splits = {
 }
 
 
-def locate_files(root: str, mode: str):
-    file_list = []
+# Directory of each starter dataset under the dataset root
+STARTER_DATASET_DIRS = {
+    "VocalSet": "VocalSet1-2",
+    "GuitarSet": "audio_mono-mic",
+    "DSD100": "DSD100/DSD100",
+    "IDMT-SMT-Drums": "IDMT-SMT-DRUMS-V2",
+}
+
+
+def glob_files(root: str, mode: str) -> List[Tuple[str, str, List[str]]]:
+    """Scan the starter datasets under root.
+    Returns (name, dataset_dir, files) for every dataset that was found.
+    """
+    datasets = []
     # ------------------------- VocalSet -------------------------
-    vocalset_dir = os.path.join(root, "VocalSet1-2")
+    vocalset_dir = os.path.join(root, STARTER_DATASET_DIRS["VocalSet"])
     if os.path.isdir(vocalset_dir):
         # find all singer directories
         singer_dirs = glob.glob(os.path.join(vocalset_dir, "data_by_singer", "*"))
@@ -69,10 +123,9 @@ def locate_files(root: str, mode: str):
         files = []
         for singer_dir in singer_dirs:
             files += glob.glob(os.path.join(singer_dir, "**", "**", "*.wav"))
-        print(f"Found {len(files)} files in VocalSet {mode}.")
-        file_list.append(sorted(files))
+        datasets.append(("VocalSet", vocalset_dir, sorted(files)))
     # ------------------------- GuitarSet -------------------------
-    guitarset_dir = os.path.join(root, "audio_mono-mic")
+    guitarset_dir = os.path.join(root, STARTER_DATASET_DIRS["GuitarSet"])
     if os.path.isdir(guitarset_dir):
         files = glob.glob(os.path.join(guitarset_dir, "*.wav"))
         files = [
@@ -80,19 +133,17 @@ def locate_files(root: str, mode: str):
             for f in files
             if os.path.basename(f).split("_")[0] in guitarset_splits[mode]
         ]
-        print(f"Found {len(files)} files in GuitarSet {mode}.")
-        file_list.append(sorted(files))
+        datasets.append(("GuitarSet", guitarset_dir, sorted(files)))
     # ------------------------- DSD100 ---------------------------------
-    dsd_100_dir = os.path.join(root, "DSD100/DSD100")
+    dsd_100_dir = os.path.join(root, STARTER_DATASET_DIRS["DSD100"])
     if os.path.isdir(dsd_100_dir):
         files = glob.glob(
             os.path.join(dsd_100_dir, mode, "**", "*.wav"),
             recursive=True,
         )
-        file_list.append(sorted(files))
-        print(f"Found {len(files)} files in DSD100 {mode}.")
+        datasets.append(("DSD100", dsd_100_dir, sorted(files)))
     # ------------------------- IDMT-SMT-DRUMS -------------------------
-    idmt_smt_drums_dir = os.path.join(root, "IDMT-SMT-DRUMS-V2")
+    idmt_smt_drums_dir = os.path.join(root, STARTER_DATASET_DIRS["IDMT-SMT-Drums"])
     if os.path.isdir(idmt_smt_drums_dir):
         files = glob.glob(os.path.join(idmt_smt_drums_dir, "audio", "*.wav"))
         files = [
@@ -100,106 +151,292 @@ def locate_files(root: str, mode: str):
             for f in files
             if os.path.basename(f).split("_")[0] in idmt_drums_splits[mode]
         ]
-        file_list.append(sorted(files))
-        print(f"Found {len(files)} files in IDMT-SMT-Drums {mode}.")
+        datasets.append(("IDMT-SMT-Drums", idmt_smt_drums_dir, sorted(files)))
+
+    return datasets
 
+
+def locate_files(root: str, mode: str, use_manifest: bool = True):
+    """Return one sorted file list per dataset found under root.
+    With use_manifest, the scan and the file headers are cached in a per-split
+    manifest under root, which is updated incrementally when files change.
+    """
+    if use_manifest:
+        manifest = update_manifest(
+            manifest_path(root, mode),
+            lambda: glob_files(root, mode),
+            [os.path.join(root, d) for d in STARTER_DATASET_DIRS.values()],
+        )
+        datasets = [(d["name"], d["dir"], d["files"]) for d in manifest["datasets"]]
+    else:
+        datasets = glob_files(root, mode)
+    file_list = []
+    for name, _, files in datasets:
+        print(f"Found {len(files)} files in {name} {mode}.")
+        file_list.append(files)
     return file_list
 
 
-def parallel_process_effects(
-    chunk_idx: int,
-    proc_root: str,
-    files: list,
+def weight_files(
+    file_list: List[List[str]], chunk_size: int, sample_rate: int
+) -> Tuple[List[List[str]], List[List[int]]]:
+    """Weight each file by the number of valid chunk start positions.
+    Files too short for a chunk and datasets left empty are dropped, so
+    random draws never pick a file that cannot produce a chunk.
+    """
+    files_out = []
+    weights_out = []
+    for files in file_list:
+        kept_files = []
+        weights = []
+        for f in files:
+            num_frames, sr, _ = get_audio_info(f)
+            usable = num_frames - int(chunk_size * (sr / sample_rate))
+            if usable > 0:
+                kept_files.append(f)
+                weights.append(usable)
+        if len(kept_files) > 0:
+            files_out.append(kept_files)
+            weights_out.append(weights)
+    return files_out, weights_out
+
+
+def select_sources(
+    file_list: List[List[str]],
+    mode: str,
     chunk_size: int,
-    effects: list,
-    effects_to_keep: list,
-    num_kept_effects: tuple,
-    shuffle_kept_effects: bool,
-    effects_to_remove: list,
-    num_removed_effects: tuple,
-    shuffle_removed_effects: bool,
     sample_rate: int,
-    target_lufs_db: float,
+    corpus_root: str = None,
+    activity_root: str = None,
 ):
-    """Note: This function has an issue with random seed. It may not fully randomize the effects."""
+    """Files and weights to draw chunks from, plus the prepared corpus store
+    if corpus_root is set (in which case files are entry ids into the store).
+    With activity_root, chunk starts are restricted to windows that pass the
+    energy check, using the activity map stored under activity_root (or with
+    the corpus). The valid (start, length) spans of each file are returned,
+    and file weights count valid starts.
+    """
+    if corpus_root is None:
+        corpus = None
+        files, file_weights = weight_files(file_list, chunk_size, sample_rate)
+    else:
+        corpus = load_corpus(corpus_root, mode, file_list, sample_rate)
+        files, file_weights = corpus.weight_files(chunk_size)
+    if activity_root is None:
+        return files, file_weights, corpus, None
+
+    if corpus is None:
+        activity = update_activity(
+            activity_path(activity_root, mode), [f for fs in files for f in fs]
+        )
+    else:
+        activity = corpus.activity(ACTIVITY_HOP)
+    files_out = []
+    weights_out = []
+    spans_out = []
+    for dataset_files in files:
+        kept_files = []
+        weights = []
+        spans = []
+        for f in dataset_files:
+            if corpus is None:
+                num_frames, sr, _ = get_audio_info(f)
+                chunk_frames = int(chunk_size * (sr / sample_rate))
+            else:
+                num_frames, chunk_frames = corpus.entries[f][3], chunk_size
+            file_spans = valid_spans(activity[f], num_frames, chunk_frames)
+            if file_spans[:, 1].sum() > 0:
+                kept_files.append(f)
+                weights.append(int(file_spans[:, 1].sum()))
+                spans.append(file_spans)
+        if len(kept_files) > 0:
+            files_out.append(kept_files)
+            weights_out.append(weights)
+            spans_out.append(spans)
+    return files_out, weights_out, corpus, spans_out
+
+
+def read_source_chunks(
+    source,
+    offsets: List[int],
+    chunk_size: int,
+    sample_rate: int,
+    corpus: CorpusStore = None,
+) -> List[torch.Tensor]:
+    """Mono chunks of one source starting at offsets (frames of the file, or
+    samples of a corpus entry). The file is read once, spanning all offsets.
+    Chunks failing the energy check are None.
+    """
+    if corpus is not None:
+        chunks = [corpus.read_chunk(source, offset, chunk_size) for offset in offsets]
+    else:
+        _, sr, _ = get_audio_info(source)
+        start = min(offsets)
+        stop = max(offsets) + int(chunk_size * (sr / sample_rate))
+        audio, sr = torchaudio.load(source, frame_offset=start, num_frames=stop - start)
+        chunks = [
+            slice_chunk(audio, sr, offset - start, chunk_size, sample_rate)
+            for offset in offsets
+        ]
+    # Sum to mono
+    return [None if chunk is None else chunk.sum(0, keepdim=True) for chunk in chunks]
+
+
+def draw_random_chunk(
+    files: List[List[str]],
+    file_weights: List[List[int]],
+    chunk_size: int,
+    sample_rate: int,
+    corpus: CorpusStore = None,
+    spans: List[List[np.ndarray]] = None,
+) -> torch.Tensor:
+    """Pick a random dataset, then a file weighted by usable length, and
+    return a mono chunk from it. Retries until a chunk passes the energy check.
+    With a prepared corpus, files are entry ids into the store. With spans
+    from select_sources, the start is drawn among valid starts, so the first
+    draw passes.
+    """
+    read_chunk = select_random_chunk if corpus is None else corpus.select_random_chunk
     chunk = None
-    random_dataset_choice = random.choice(files)
+    dataset_idx = random.randrange(len(files))
     while chunk is None:
-        random_file_choice = random.choice(random_dataset_choice)
-        chunk = select_random_chunk(random_file_choice, chunk_size, sample_rate)
+        file_idx = random.choices(
+            range(len(files[dataset_idx])), weights=file_weights[dataset_idx]
+        )[0]
+        random_file_choice = files[dataset_idx][file_idx]
+        if spans is None:
+            chunk = read_chunk(random_file_choice, chunk_size, sample_rate)
+        else:
+            start = random.randrange(file_weights[dataset_idx][file_idx])
+            offset = span_offset(spans[dataset_idx][file_idx], start)
+            chunk = read_source_chunks(
+                random_file_choice, [offset], chunk_size, sample_rate, corpus
+            )[0]
 
     # Sum to mono
     if chunk.shape[0] > 1:
         chunk = chunk.sum(0, keepdim=True)
+    return chunk
+
+
+# EffectDataset executing the render plan in a worker, set once per worker
+_render_dataset = None
+
+
+def _init_render_worker(dataset) -> None:
+    global _render_dataset
+    # One intra-op thread per worker avoids oversubscribing the cores
+    torch.set_num_threads(1)
+    _render_dataset = dataset
+
+
+def _render_groups(groups: List[List[Dict]]) -> Tuple[List[int], Dict]:
+    _render_dataset.gate.reset_stats()
+    done = _render_dataset.render_groups(groups)
+    return done, _render_dataset.gate.stats
+
+
+class PlannedChunkMixin:
+    """Rendering of chunks from a plan (see remfx.plan), shared by
+    EffectDataset and ProceduralEffectDataset. A chunk depends only on
+    (seed, mode, chunk index).
+    """
+
+    def plan_chunks(self, chunk_indices: List[int]) -> List[Dict]:
+        """Deterministic source, offset, effects and seed of each chunk."""
+        return make_plan(
+            chunk_indices,
+            self.seed,
+            self.mode,
+            self.file_weights,
+            self.spans,
+            self.effects_to_keep,
+            self.num_kept_effects,
+            self.shuffle_kept_effects,
+            self.effects_to_remove,
+            self.num_removed_effects,
+            self.shuffle_removed_effects,
+            self.fan_out,
+        )
+
+    def render_entry(self, entry: Dict, chunk: torch.Tensor) -> Tuple:
+        """Apply the planned effects of entry to its source chunk, or to a
+        redrawn one if the chunk is None.
+        """
+        if chunk is None:
+            chunk = self.redraw_chunk(entry)
+        # Effect parameters come from the global generators
+        with seeded(entry["seed"]):
+            return self.process_effects(chunk, entry["kept"], entry["removed"])
+
+    def redraw_chunk(self, entry: Dict) -> torch.Tensor:
+        """Replacement for a planned chunk that failed the energy check,
+        drawn from the same dataset with its source chunk's own generator.
+        """
+        rng = chunk_rng(self.seed, self.mode, entry["source_idx"], REDRAW_STREAM)
+        files = self.files[entry["dataset"]]
+        cum_weights = np.cumsum(self.file_weights[entry["dataset"]])
+        chunk = None
+        while chunk is None:
+            file_idx, offset = draw_start(rng, cum_weights)
+            if self.spans is not None:
+                offset = span_offset(self.spans[entry["dataset"]][file_idx], offset)
+            chunk = read_source_chunks(
+                files[file_idx],
+                [offset],
+                self.chunk_size,
+                self.sample_rate,
+                self.corpus,
+            )[0]
+        return chunk
+
+    def process_effects(
+        self, dry: torch.Tensor, kept_names: List[str], removed_names: List[str]
+    ):
+        # Apply kept effects once, only the removed ones are redrawn
+        dry_labels = []
+        for effect in [self.effects[i] for i in kept_names]:
+            # Normalize in-between effects
+            dry = self.normalize(effect(dry))
+            dry_labels.append(effect_label(effect))
+        dry_labels_tensor = torch.zeros(len(ALL_EFFECTS))
+        for label_idx in dry_labels:
+            dry_labels_tensor[label_idx] = 1.0
+        normalized_dry = self.normalize(dry)
 
-    dry = chunk
+        removed_effects = [self.effects[i] for i in removed_names]
+        reference = None
+        while True:
+            # Apply effects_to_remove
+            wet = torch.clone(dry)
+            wet_labels = []
+            stages = []
+            for effect in removed_effects:
+                # Normalize in-between effects
+                wet = self.normalize(effect(wet))
+                wet_labels.append(effect_label(effect))
+                stages.append((wet_labels[-1], wet))
+            normalized_wet = self.normalize(wet)
 
-    # loudness normalization
-    normalize = effect_lib.LoudnessNormalize(sample_rate, target_lufs_db=target_lufs_db)
+            # Check STFT, redraw effect parameters if necessary
+            if len(removed_names) == 0:
+                # No need to check if no effects removed
+                break
+            if reference is None:
+                reference = self.gate.reference(normalized_dry)
+            if self.gate.passes(normalized_wet, reference):
+                break
 
-    # Apply Kept Effects
-    # Shuffle effects if specified
-    if shuffle_kept_effects:
-        effect_indices = torch.randperm(len(effects_to_keep))
-    else:
-        effect_indices = torch.arange(len(effects_to_keep))
-
-    r1 = num_kept_effects[0]
-    r2 = num_kept_effects[1]
-    num_kept_effects = torch.round((r1 - r2) * torch.rand(1) + r2).int()
-    effect_indices = effect_indices[:num_kept_effects]
-    # Index in effect settings
-    effect_names_to_apply = [effects_to_keep[i] for i in effect_indices]
-    effects_to_apply = [effects[i] for i in effect_names_to_apply]
-    # Apply
-    dry_labels = []
-    for effect in effects_to_apply:
-        # Normalize in-between effects
-        dry = normalize(effect(dry))
-        dry_labels.append(ALL_EFFECTS.index(type(effect)))
-
-    # Apply effects_to_remove
-    # Shuffle effects if specified
-    if shuffle_removed_effects:
-        effect_indices = torch.randperm(len(effects_to_remove))
-    else:
-        effect_indices = torch.arange(len(effects_to_remove))
-    wet = torch.clone(dry)
-    r1 = num_removed_effects[0]
-    r2 = num_removed_effects[1]
-    num_removed_effects = torch.round((r1 - r2) * torch.rand(1) + r2).int()
-    effect_indices = effect_indices[:num_removed_effects]
-    # Index in effect settings
-    effect_names_to_apply = [effects_to_remove[i] for i in effect_indices]
-    effects_to_apply = [effects[i] for i in effect_names_to_apply]
-    # Apply
-    wet_labels = []
-    for effect in effects_to_apply:
-        # Normalize in-between effects
-        wet = normalize(effect(wet))
-        wet_labels.append(ALL_EFFECTS.index(type(effect)))
-
-    wet_labels_tensor = torch.zeros(len(ALL_EFFECTS))
-    dry_labels_tensor = torch.zeros(len(ALL_EFFECTS))
-
-    for label_idx in wet_labels:
-        wet_labels_tensor[label_idx] = 1.0
-
-    for label_idx in dry_labels:
-        dry_labels_tensor[label_idx] = 1.0
-
-    # Normalize
-    normalized_dry = normalize(dry)
-    normalized_wet = normalize(wet)
-
-    output_dir = proc_root / str(chunk_idx)
-    output_dir.mkdir(exist_ok=True)
-    torchaudio.save(output_dir / "input.wav", normalized_wet, sample_rate)
-    torchaudio.save(output_dir / "target.wav", normalized_dry, sample_rate)
-    torch.save(dry_labels_tensor, output_dir / "dry_effects.pt")
-    torch.save(wet_labels_tensor, output_dir / "wet_effects.pt")
-
-    # return normalized_dry, normalized_wet, dry_labels_tensor, wet_labels_tensor
+        wet_labels_tensor = torch.zeros(len(ALL_EFFECTS))
+        for label_idx in wet_labels:
+            wet_labels_tensor[label_idx] = 1.0
+        return (
+            normalized_dry,
+            normalized_wet,
+            dry_labels_tensor,
+            wet_labels_tensor,
+            stages,
+        )
 
 
 class DynamicEffectDataset(Dataset):
@@ -220,7 +457,13 @@ class DynamicEffectDataset(Dataset):
         render_root: str = None,
         mode: str = "train",
         parallel: bool = False,
+        corpus_root: str = None,
+        activity_map: bool = True,
+        batched_effects: bool = False,
+        **kwargs,
     ) -> None:
+        # Rendering options of EffectDataset (layout, seed, ...) are accepted
+        # and ignored, so configs can switch between the two classes
         super().__init__()
         self.chunks = []
         self.song_idx = []
@@ -250,50 +493,63 @@ class DynamicEffectDataset(Dataset):
         # self.validate_effect_input()
         # self.proc_root = self.render_root / "processed" / effects_string / self.mode
         self.parallel = parallel
-        self.files = locate_files(self.root, self.mode)
+        # With batched effects, items are dry chunks and their effects are
+        # applied to the whole batch in collate_fn
+        self.batched_effects = batched_effects
+        if batched_effects:
+            self.effects = {name: batched(fx) for name, fx in self.effects.items()}
+            self.collate_fn = self.collate_batch
+        else:
+            self.collate_fn = None
+        self.files, self.file_weights, self.corpus, self.spans = select_sources(
+            locate_files(self.root, self.mode),
+            self.mode,
+            self.chunk_size,
+            self.sample_rate,
+            corpus_root,
+            self.root if activity_map else None,
+        )
 
-    def process_effects(self, dry: torch.Tensor):
-        # Apply Kept Effects
+    def choose_effects(
+        self, effect_names: List[str], num_effects: List[int], shuffle: bool
+    ) -> List[str]:
         # Shuffle effects if specified
-        if self.shuffle_kept_effects:
-            effect_indices = torch.randperm(len(self.effects_to_keep))
+        if shuffle:
+            effect_indices = torch.randperm(len(effect_names))
         else:
-            effect_indices = torch.arange(len(self.effects_to_keep))
-
-        r1 = self.num_kept_effects[0]
-        r2 = self.num_kept_effects[1]
-        num_kept_effects = torch.round((r1 - r2) * torch.rand(1) + r2).int()
-        effect_indices = effect_indices[:num_kept_effects]
-        # Index in effect settings
-        effect_names_to_apply = [self.effects_to_keep[i] for i in effect_indices]
+            effect_indices = torch.arange(len(effect_names))
+        r1 = num_effects[0]
+        r2 = num_effects[1]
+        num = torch.round((r1 - r2) * torch.rand(1) + r2).int()
+        return [effect_names[i] for i in effect_indices[:num]]
+
+    def process_effects(self, dry: torch.Tensor):
+        # Apply Kept Effects
+        effect_names_to_apply = self.choose_effects(
+            self.effects_to_keep, self.num_kept_effects, self.shuffle_kept_effects
+        )
         effects_to_apply = [self.effects[i] for i in effect_names_to_apply]
         # Apply
         dry_labels = []
         for effect in effects_to_apply:
             # Normalize in-between effects
             dry = self.normalize(effect(dry))
-            dry_labels.append(ALL_EFFECTS.index(type(effect)))
+            dry_labels.append(effect_label(effect))
 
         # Apply effects_to_remove
-        # Shuffle effects if specified
-        if self.shuffle_removed_effects:
-            effect_indices = torch.randperm(len(self.effects_to_remove))
-        else:
-            effect_indices = torch.arange(len(self.effects_to_remove))
         wet = torch.clone(dry)
-        r1 = self.num_removed_effects[0]
-        r2 = self.num_removed_effects[1]
-        num_removed_effects = torch.round((r1 - r2) * torch.rand(1) + r2).int()
-        effect_indices = effect_indices[:num_removed_effects]
-        # Index in effect settings
-        effect_names_to_apply = [self.effects_to_remove[i] for i in effect_indices]
+        effect_names_to_apply = self.choose_effects(
+            self.effects_to_remove,
+            self.num_removed_effects,
+            self.shuffle_removed_effects,
+        )
         effects_to_apply = [self.effects[i] for i in effect_names_to_apply]
         # Apply
         wet_labels = []
         for effect in effects_to_apply:
             # Normalize in-between effects
             wet = self.normalize(effect(wet))
-            wet_labels.append(ALL_EFFECTS.index(type(effect)))
+            wet_labels.append(effect_label(effect))
 
         wet_labels_tensor = torch.zeros(len(ALL_EFFECTS))
         dry_labels_tensor = torch.zeros(len(ALL_EFFECTS))
@@ -313,24 +569,164 @@ class DynamicEffectDataset(Dataset):
         return self.total_chunks
 
     def __getitem__(self, _: int):
-        chunk = None
-        random_dataset_choice = random.choice(self.files)
-        while chunk is None:
-            random_file_choice = random.choice(random_dataset_choice)
-            chunk = select_random_chunk(
-                random_file_choice, self.chunk_size, self.sample_rate
+        chunk = draw_random_chunk(
+            self.files,
+            self.file_weights,
+            self.chunk_size,
+            self.sample_rate,
+            self.corpus,
+            self.spans,
+        )
+        if self.batched_effects:
+            kept = self.choose_effects(
+                self.effects_to_keep, self.num_kept_effects, self.shuffle_kept_effects
             )
+            removed = self.choose_effects(
+                self.effects_to_remove,
+                self.num_removed_effects,
+                self.shuffle_removed_effects,
+            )
+            return chunk, kept, removed
+        dry, wet, dry_effects, wet_effects = self.process_effects(chunk)
 
-        # Sum to mono
-        if chunk.shape[0] > 1:
-            chunk = chunk.sum(0, keepdim=True)
+        return wet, dry, dry_effects, wet_effects
 
-        dry, wet, dry_effects, wet_effects = self.process_effects(chunk)
+    def apply_chains(self, x: torch.Tensor, chains: List[List[str]]) -> torch.Tensor:
+        """Apply a chain of effects to each example of x, normalizing after
+        every effect. At each step, the examples using the same effect are
+        processed together.
+        """
+        for step in range(max(map(len, chains), default=0)):
+            names = {chain[step] for chain in chains if len(chain) > step}
+            for name in sorted(names):
+                idx = [
+                    i
+                    for i, chain in enumerate(chains)
+                    if len(chain) > step and chain[step] == name
+                ]
+                x[idx] = self.normalize(apply_effect(self.effects[name], x[idx]))
+        return x
+
+    def collate_batch(self, items: List[Tuple]):
+        """Batch the dry chunks of items and apply their effects, giving the
+        same (wet, dry, dry_effects, wet_effects) batches as process_effects.
+        """
+        chunks, kept, removed = zip(*items)
+        dry = self.apply_chains(torch.stack(chunks), kept)
+        wet = self.apply_chains(dry.clone(), removed)
+        dry_labels = torch.zeros(len(items), len(ALL_EFFECTS))
+        wet_labels = torch.zeros(len(items), len(ALL_EFFECTS))
+        for i, (kept_names, removed_names) in enumerate(zip(kept, removed)):
+            for name in kept_names:
+                dry_labels[i, effect_label(self.effects[name])] = 1.0
+            for name in removed_names:
+                wet_labels[i, effect_label(self.effects[name])] = 1.0
+        return self.normalize(wet), self.normalize(dry), dry_labels, wet_labels
+
+
+class ReplayEffectDataset(DynamicEffectDataset):
+    """DynamicEffectDataset serving most examples from a pool of earlier
+    renders. Item idx uses pool slot idx % pool_size: a filled slot is
+    reused with probability reuse_ratio, otherwise a fresh example is
+    rendered and replaces it. With total_chunks = pool_size, about
+    1 - reuse_ratio of the pool is re-rendered each epoch. The pool is in
+    shared memory, so DataLoader workers share it.
+    """
 
+    def __init__(
+        self,
+        *args,
+        pool_size: int = 1000,
+        reuse_ratio: float = 0.9,
+        **kwargs,
+    ) -> None:
+        if kwargs.get("batched_effects", False):
+            raise ValueError("ReplayEffectDataset does not batch effects")
+        if not 0 <= reuse_ratio <= 1:
+            raise ValueError(f"reuse_ratio must be in [0, 1]. Got {reuse_ratio}")
+        if pool_size < 1:
+            raise ValueError(f"pool_size must be at least 1. Got {pool_size}")
+        super().__init__(*args, **kwargs)
+        self.pool_size = pool_size
+        self.reuse_ratio = reuse_ratio
+        self.wet_pool = torch.zeros(pool_size, 1, self.chunk_size).share_memory_()
+        self.dry_pool = torch.zeros(pool_size, 1, self.chunk_size).share_memory_()
+        self.label_pool = torch.zeros(pool_size, 2, len(ALL_EFFECTS)).share_memory_()
+        self.filled = torch.zeros(pool_size, dtype=torch.bool).share_memory_()
+        # Slots share a few locks, so a slot is never read while written
+        self.locks = [multiprocessing.Lock() for _ in range(min(pool_size, 64))]
+
+    def __getitem__(self, idx: int):
+        slot = idx % self.pool_size
+        lock = self.locks[slot % len(self.locks)]
+        with lock:
+            if self.filled[slot] and torch.rand(1).item() < self.reuse_ratio:
+                return (
+                    self.wet_pool[slot].clone(),
+                    self.dry_pool[slot].clone(),
+                    self.label_pool[slot, 0].clone(),
+                    self.label_pool[slot, 1].clone(),
+                )
+        wet, dry, dry_effects, wet_effects = super().__getitem__(idx)
+        with lock:
+            self.wet_pool[slot] = fix_length(wet, self.chunk_size)
+            self.dry_pool[slot] = fix_length(dry, self.chunk_size)
+            self.label_pool[slot, 0] = dry_effects
+            self.label_pool[slot, 1] = wet_effects
+            self.filled[slot] = True
         return wet, dry, dry_effects, wet_effects
 
 
-class EffectDataset(Dataset):
+class ProceduralEffectDataset(PlannedChunkMixin, DynamicEffectDataset):
+    """Chunks generated on demand instead of rendered to disk. Chunk idx is
+    a function of (seed, mode, idx) only: its source, offset, effects,
+    their order and parameters all come from its plan, so it equals chunk
+    idx of an EffectDataset with the same settings. The last cache_size
+    chunks are kept in memory.
+    """
+
+    def __init__(
+        self,
+        *args,
+        seed: int = None,
+        fan_out: int = 1,
+        cache_size: int = 64,
+        **kwargs,
+    ) -> None:
+        if kwargs.get("batched_effects", False):
+            raise ValueError("ProceduralEffectDataset does not batch effects")
+        if fan_out < 1:
+            raise ValueError(f"fan_out must be at least 1. Got {fan_out}")
+        super().__init__(*args, **kwargs)
+        self.seed = torch.initial_seed() if seed is None else seed
+        self.fan_out = fan_out
+        self.mrstft = MultiResolutionSTFTLoss(sample_rate=self.sample_rate)
+        self.gate = SpectralGate(self.mrstft, STFT_THRESH)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def __getitem__(self, idx: int):
+        if idx in self.cache:
+            self.cache.move_to_end(idx)
+            return self.cache[idx]
+        entry = self.plan_chunks([idx])[0]
+        chunk = read_source_chunks(
+            self.files[entry["dataset"]][entry["file"]],
+            [entry["offset"]],
+            self.chunk_size,
+            self.sample_rate,
+            self.corpus,
+        )[0]
+        dry, wet, dry_effects, wet_effects, _ = self.render_entry(entry, chunk)
+        item = (wet, dry, dry_effects, wet_effects)
+        if self.cache_size > 0:
+            self.cache[idx] = item
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return item
+
+
+class EffectDataset(PlannedChunkMixin, Dataset):
     def __init__(
         self,
         root: str,
@@ -348,6 +744,19 @@ class EffectDataset(Dataset):
         render_root: str = None,
         mode: str = "train",
         parallel: bool = False,
+        corpus_root: str = None,
+        activity_map: bool = True,
+        layout: str = "dir",
+        shard_size: int = 1000,
+        render_mode: str = "resume",
+        seed: int = None,
+        render_workers: int = None,
+        fan_out: int = 1,
+        store_stages: bool = False,
+        audio_format: str = "float32",
+        render_rank: int = None,
+        render_world_size: int = None,
+        render_timeout: float = 1800,
     ):
         super().__init__()
         self.chunks = []
@@ -364,6 +773,7 @@ class EffectDataset(Dataset):
         self.effects_to_remove = [] if effects_to_remove is None else effects_to_remove
         self.normalize = effect_lib.LoudnessNormalize(sample_rate, target_lufs_db=-20)
         self.mrstft = MultiResolutionSTFTLoss(sample_rate=sample_rate)
+        self.gate = SpectralGate(self.mrstft, STFT_THRESH)
         self.effects = effect_modules
         self.shuffle_kept_effects = shuffle_kept_effects
         self.shuffle_removed_effects = shuffle_removed_effects
@@ -377,14 +787,73 @@ class EffectDataset(Dataset):
             + [str(x) for x in num_removed_effects]
         )
         self.validate_effect_input()
-        self.proc_root = self.render_root / "processed" / effects_string / self.mode
         self.parallel = parallel
+        self.seed = torch.initial_seed() if seed is None else seed
+        if fan_out < 1:
+            raise ValueError(f"fan_out must be at least 1. Got {fan_out}")
+        self.fan_out = fan_out
+        self.store_stages = store_stages
+
+        file_list = locate_files(self.root, self.mode)
+        self.files, self.file_weights, self.corpus, self.spans = select_sources(
+            file_list,
+            self.mode,
+            self.chunk_size,
+            self.sample_rate,
+            corpus_root,
+            self.root if activity_map else None,
+        )
 
-        self.files = locate_files(self.root, self.mode)
+        # Renders are keyed on everything that affects their content, so
+        # matching renders are shared and incompatible ones never reused
+        self.render_config = {
+            "version": RENDER_VERSION,
+            "effects": {
+                name: effect_config(self.effects[name])
+                for name in sorted(set(self.effects_to_keep + self.effects_to_remove))
+            },
+            "effects_to_keep": list(self.effects_to_keep),
+            "effects_to_remove": list(self.effects_to_remove),
+            "num_kept_effects": list(self.num_kept_effects),
+            "num_removed_effects": list(self.num_removed_effects),
+            "shuffle_kept_effects": self.shuffle_kept_effects,
+            "shuffle_removed_effects": self.shuffle_removed_effects,
+            "sample_rate": self.sample_rate,
+            "chunk_size": self.chunk_size,
+            "mode": self.mode,
+            "seed": self.seed,
+            "sources": source_digest(file_list),
+            "corpus": corpus_root is not None,
+            "activity_hop": ACTIVITY_HOP if activity_map else None,
+        }
+        if fan_out > 1:
+            # Only keyed when used, so existing renders keep their keys
+            self.render_config["fan_out"] = fan_out
+        if store_stages:
+            self.render_config["store_stages"] = True
+        if audio_format != "float32":
+            self.render_config["audio_format"] = audio_format
+        self.render_key = render_key(self.render_config)
+        self.proc_root = cache_path(
+            self.render_root, effects_string, self.mode, self.render_key
+        )
+        legacy_proc_root = self.render_root / "processed" / effects_string / self.mode
+        if not (render_files or self.proc_root.exists()) and legacy_proc_root.exists():
+            print(f"Using unkeyed render at {legacy_proc_root}.")
+            self.proc_root = legacy_proc_root
 
+        if render_mode not in RENDER_MODES:
+            raise ValueError(
+                f"Unknown render_mode {render_mode}. Please choose from {RENDER_MODES}"
+            )
+        # Ranks render disjoint parts of the dataset (see render_distributed)
+        self.rank, self.world_size = rank_info(render_rank, render_world_size)
+        self.render_timeout = render_timeout
+        if self.world_size > 1 and render_files and render_mode != "resume":
+            raise ValueError("Distributed rendering requires render_mode=resume")
         if self.proc_root.exists() and len(list(self.proc_root.iterdir())) > 0:
             print("Found processed files.")
-            if render_files:
+            if render_files and render_mode == "prompt":
                 re_render = input(
                     "WARNING: By default, will re-render files.\n"
                     "Set render_files=False to skip re-rendering.\n"
@@ -393,65 +862,45 @@ class EffectDataset(Dataset):
                 if re_render != "y":
                     sys.exit()
                 shutil.rmtree(self.proc_root)
+            elif render_files and render_mode == "overwrite":
+                print("Removing processed files.")
+                shutil.rmtree(self.proc_root)
+
+        self.layout = layout
+        self.shard_size = shard_size
+        self.num_stages = max(0, num_removed_effects[1] - 1) if store_stages else 0
+        self.audio_format = audio_format
+        self.store = self.open_chunk_store(self.proc_root)
+        # An existing packed store is used whatever the layout setting
+        self.layout = self.store.layout
+        keyed = self.proc_root != legacy_proc_root
+        if keyed and (render_files or self.proc_root.exists()):
+            touch_cache_info(
+                self.proc_root,
+                self.render_key,
+                self.render_config,
+                self.root,
+                self.total_chunks,
+            )
 
+        # Store index of each item, which skips missing chunks of an
+        # incomplete render that is not resumed
+        self.indices = list(range(self.total_chunks))
         print("Total datasets:", len(self.files))
         print("Processing files...")
-        if render_files:
+        if render_files and self.world_size > 1:
+            self.render_distributed(render_workers)
+        elif render_files:
             # Split audio file into chunks, resample, then apply random effects
-            self.proc_root.mkdir(parents=True, exist_ok=True)
-
-            if self.parallel:
-                items = [
-                    (
-                        chunk_idx,
-                        self.proc_root,
-                        self.files,
-                        self.chunk_size,
-                        self.effects,
-                        self.effects_to_keep,
-                        self.num_kept_effects,
-                        self.shuffle_kept_effects,
-                        self.effects_to_remove,
-                        self.num_removed_effects,
-                        self.shuffle_removed_effects,
-                        self.sample_rate,
-                        -20.0,
-                    )
-                    for chunk_idx in range(self.total_chunks)
-                ]
-                with multiprocessing.Pool(processes=32) as pool:
-                    pool.starmap(parallel_process_effects, items)
-                print(f"Done proccessing {self.total_chunks}", flush=True)
-            else:
-                for num_chunk in tqdm(range(self.total_chunks)):
-                    chunk = None
-                    random_dataset_choice = random.choice(self.files)
-                    while chunk is None:
-                        try:
-                            random_file_choice = random.choice(random_dataset_choice)
-                        except IndexError:
-                            print("IndexError")
-                            print(random_dataset_choice)
-                            print(random_file_choice)
-                            raise IndexError
-                        chunk = select_random_chunk(
-                            random_file_choice, self.chunk_size, self.sample_rate
-                        )
-                    # Sum to mono
-                    if chunk.shape[0] > 1:
-                        chunk = chunk.sum(0, keepdim=True)
-
-                    dry, wet, dry_effects, wet_effects = self.process_effects(chunk)
-                    output_dir = self.proc_root / str(num_chunk)
-                    output_dir.mkdir(exist_ok=True)
-                    torchaudio.save(output_dir / "input.wav", wet, self.sample_rate)
-                    torchaudio.save(output_dir / "target.wav", dry, self.sample_rate)
-                    torch.save(dry_effects, output_dir / "dry_effects.pt")
-                    torch.save(wet_effects, output_dir / "wet_effects.pt")
-
-            print("Finished rendering")
+            self.store.allocate(self.total_chunks)
+            # Chunks left by an interrupted distributed render
+            self.merge_rank_stores()
+            completed = self.store.completed()
+            missing = [i for i in range(self.total_chunks) if i not in completed]
+            self.render_missing(missing, render_workers)
         else:
-            self.total_chunks = len(list(self.proc_root.iterdir()))
+            self.indices = self.store.chunk_indices()
+            self.total_chunks = len(self.indices)
 
         print("Total chunks:", self.total_chunks)
 
@@ -459,21 +908,203 @@ class EffectDataset(Dataset):
         return self.total_chunks
 
     def __getitem__(self, idx):
-        input_file = self.proc_root / str(idx) / "input.wav"
-        target_file = self.proc_root / str(idx) / "target.wav"
-        dry_effect_names = torch.load(self.proc_root / str(idx) / "dry_effects.pt")
-        wet_effect_names = torch.load(self.proc_root / str(idx) / "wet_effects.pt")
-        input, sr = torchaudio.load(input_file)
-        target, sr = torchaudio.load(target_file)
-        return (input, target, dry_effect_names, wet_effect_names)
+        return self.store.read(self.indices[idx])
+
+    def render_missing(self, missing: List[int], render_workers: int = None):
+        print(f"Rendering {len(missing)} of {self.total_chunks} chunks")
+
+        start_time = time.time()
+        self.gate.reset_stats()
+        groups = group_by_source(self.plan_chunks(missing))
+        if self.parallel:
+            self.render_parallel(groups, render_workers)
+        else:
+            # Same thread count as the workers, so output does not
+            # depend on whether rendering is parallel
+            num_threads = torch.get_num_threads()
+            torch.set_num_threads(1)
+            with tqdm(total=len(missing)) as pbar:
+                for group in groups:
+                    done = self.render_groups([group])
+                    self.store.mark_completed(done)
+                    pbar.update(len(done))
+            torch.set_num_threads(num_threads)
+        elapsed = time.time() - start_time
+        print(
+            f"Rendered {len(missing)} chunks in {elapsed:.1f}s "
+            f"({len(missing) / max(elapsed, 1e-9):.2f} chunks/sec)",
+            flush=True,
+        )
+        print(self.gate.summary())
+        print("Finished rendering")
+
+    def open_chunk_store(self, proc_root: Path):
+        return open_store(
+            proc_root,
+            self.sample_rate,
+            self.chunk_size,
+            len(ALL_EFFECTS),
+            layout=self.layout,
+            shard_size=self.shard_size,
+            num_stages=self.num_stages,
+            audio_format=self.audio_format,
+        )
+
+    def rank_stores(self) -> List:
+        rank_root = self.proc_root / RANKS_DIR
+        if not rank_root.exists():
+            return []
+        return [self.open_chunk_store(path) for path in sorted(rank_root.iterdir())]
+
+    def merge_rank_stores(self) -> None:
+        """Move the chunks of every rank's store into the main store and
+        remove the rank stores. The main store must be allocated.
+        """
+        for rank_store in self.rank_stores():
+            done = sorted(i for i in rank_store.completed() if i < self.total_chunks)
+            print(f"Merging {len(done)} chunks from {rank_store.proc_root}")
+            self.store.merge(rank_store, done)
+            shutil.rmtree(rank_store.proc_root)
+        try:
+            (self.proc_root / RANKS_DIR).rmdir()
+        except OSError:
+            # Missing, or a rank started a store since
+            pass
+
+    def render_distributed(self, render_workers: int = None) -> None:
+        """Render the missing chunks of this rank's index range into its own
+        store under proc_root/ranks, which holds them at their index.
+        Rank 0 then waits for every chunk to be in a store and merges them
+        into the main store, while the other ranks wait for the merge. The
+        shared filesystem is the only coordination: a rank that fails writes
+        a marker to proc_root/ranks_failed, which stops the waiting ranks,
+        and waiting stops with a TimeoutError after render_timeout seconds
+        without progress, e.g. if a rank was killed.
+        """
+        start_time = time.time()
+        failed_dir = self.proc_root / FAILED_DIR
+        try:
+            self.render_rank_range(render_workers, start_time)
+        except Exception as error:
+            mark_failed(failed_dir, self.rank, error)
+            raise
+
+    def render_rank_range(self, render_workers: int, start_time: float) -> None:
+        completed = self.store.completed()
+        if completed.issuperset(range(self.total_chunks)):
+            return
+        align = self.shard_size if self.store.layout == "packed" else 1
+        begin, end = rank_range(self.total_chunks, self.rank, self.world_size, align)
+        print(
+            f"Rank {self.rank} of {self.world_size} renders chunks {begin}-{end}",
+            flush=True,
+        )
+        if begin < end:
+            rank_store = self.open_chunk_store(
+                self.proc_root / RANKS_DIR / f"{begin:08d}-{end:08d}"
+            )
+            rank_store.allocate(end)
+            done = completed | rank_store.completed()
+            missing = [i for i in range(begin, end) if i not in done]
+            main_store = self.store
+            self.store = rank_store
+            self.render_missing(missing, render_workers)
+            self.store = main_store
+
+        def num_rendered() -> int:
+            done = set(completed)
+            for store in self.rank_stores():
+                done |= store.completed()
+            return len(done & set(range(self.total_chunks)))
+
+        def num_merged() -> int:
+            return len(self.store.completed() & set(range(self.total_chunks)))
+
+        def failure():
+            return find_failure(self.proc_root / FAILED_DIR, start_time)
+
+        if self.rank == 0:
+            wait_until(
+                num_rendered,
+                self.total_chunks,
+                "all ranks to render",
+                failure,
+                self.render_timeout,
+            )
+            self.store.allocate(self.total_chunks)
+            self.merge_rank_stores()
+        else:
+            wait_until(
+                num_merged,
+                self.total_chunks,
+                "rank 0 to merge the renders",
+                failure,
+                self.render_timeout,
+            )
+            # Reopen to see the store allocated by rank 0
+            self.store = self.open_chunk_store(self.proc_root)
+
+    def render_groups(self, groups: List[List[Dict]]) -> List[int]:
+        """Render and write planned chunks grouped by source file, reading
+        each source once and each chunk once for all of its variants.
+        Returns the rendered chunk indices.
+        """
+        done = []
+        for group in groups:
+            source = self.files[group[0]["dataset"]][group[0]["file"]]
+            offsets = sorted({entry["offset"] for entry in group})
+            chunks = read_source_chunks(
+                source, offsets, self.chunk_size, self.sample_rate, self.corpus
+            )
+            chunks = dict(zip(offsets, chunks))
+            redrawn = {}
+            for entry in group:
+                chunk = chunks[entry["offset"]]
+                if chunk is None:
+                    if entry["source_idx"] not in redrawn:
+                        redrawn[entry["source_idx"]] = self.redraw_chunk(entry)
+                    chunk = redrawn[entry["source_idx"]]
+                self.render_chunk(entry, chunk)
+                done.append(entry["chunk_idx"])
+        return done
+
+    def render_chunk(self, entry: Dict, chunk: torch.Tensor) -> None:
+        dry, wet, dry_effects, wet_effects, stages = self.render_entry(entry, chunk)
+        self.store.write(
+            entry["chunk_idx"],
+            wet,
+            dry,
+            dry_effects,
+            wet_effects,
+            stages if self.store_stages else None,
+        )
+
+    def render_parallel(self, groups: List[List[Dict]], num_workers: int = None):
+        """Render planned chunk groups with a process pool. The dataset is
+        sent once per worker, and groups are dispatched in batches.
+        """
+        if num_workers is None:
+            num_workers = available_cpus()
+        num_chunks = sum(len(group) for group in groups)
+        # A few batches per worker keeps the load balanced
+        batch_size = max(1, min(64, num_chunks // (4 * num_workers)))
+        batches = [[]]
+        for group in groups:
+            if sum(len(g) for g in batches[-1]) >= batch_size:
+                batches.append([])
+            batches[-1].append(group)
+        print(f"Rendering with {num_workers} workers")
+        with multiprocessing.Pool(
+            num_workers, initializer=_init_render_worker, initargs=(self,)
+        ) as pool, tqdm(total=num_chunks) as pbar:
+            for done, stats in pool.imap_unordered(_render_groups, batches):
+                self.store.mark_completed(done)
+                self.gate.merge_stats(stats)
+                pbar.update(len(done))
 
     def validate_effect_input(self):
         for effect in self.effects.values():
-            if type(effect) not in ALL_EFFECTS:
-                raise ValueError(
-                    f"Effect {effect} not found in ALL_EFFECTS. "
-                    f"Please choose from {ALL_EFFECTS}"
-                )
+            effect_label(effect)
         for effect in self.effects_to_keep:
             if effect not in self.effects.keys():
                 raise ValueError(
@@ -518,101 +1149,116 @@ class EffectDataset(Dataset):
             f"Apply remove effects: {rem_fx} ({num_rem_str}, chosen {rem_str}) -> Wet\n"
         )
 
-    def process_effects(self, dry: torch.Tensor):
-        # Apply Kept Effects
-        # Shuffle effects if specified
-        if self.shuffle_kept_effects:
-            effect_indices = torch.randperm(len(self.effects_to_keep))
-        else:
-            effect_indices = torch.arange(len(self.effects_to_keep))
-
-        r1 = self.num_kept_effects[0]
-        r2 = self.num_kept_effects[1]
-        num_kept_effects = torch.round((r1 - r2) * torch.rand(1) + r2).int()
-        effect_indices = effect_indices[:num_kept_effects]
-        # Index in effect settings
-        effect_names_to_apply = [self.effects_to_keep[i] for i in effect_indices]
-        effects_to_apply = [self.effects[i] for i in effect_names_to_apply]
-        # stft comparison
-        stft = 0
-        while stft < STFT_THRESH:
-            # Apply
-            dry_labels = []
-            for effect in effects_to_apply:
-                # Normalize in-between effects
-                dry = self.normalize(effect(dry))
-                dry_labels.append(ALL_EFFECTS.index(type(effect)))
-
-            # Apply effects_to_remove
-            # Shuffle effects if specified
-            if self.shuffle_removed_effects:
-                effect_indices = torch.randperm(len(self.effects_to_remove))
-            else:
-                effect_indices = torch.arange(len(self.effects_to_remove))
-            wet = torch.clone(dry)
-            r1 = self.num_removed_effects[0]
-            r2 = self.num_removed_effects[1]
-            num_removed_effects = torch.round((r1 - r2) * torch.rand(1) + r2).int()
-            effect_indices = effect_indices[:num_removed_effects]
-            # Index in effect settings
-            effect_names_to_apply = [self.effects_to_remove[i] for i in effect_indices]
-            effects_to_apply = [self.effects[i] for i in effect_names_to_apply]
-            # Apply
-            wet_labels = []
-            for effect in effects_to_apply:
-                # Normalize in-between effects
-                wet = self.normalize(effect(wet))
-                wet_labels.append(ALL_EFFECTS.index(type(effect)))
-
-            wet_labels_tensor = torch.zeros(len(ALL_EFFECTS))
-            dry_labels_tensor = torch.zeros(len(ALL_EFFECTS))
 
-            for label_idx in wet_labels:
-                wet_labels_tensor[label_idx] = 1.0
+class EffectStageDataset(Dataset):
+    """Before/after pairs of one effect, taken from every step of the
+    removed chains of an EffectDataset rendered with store_stages=True.
+    Items match EffectDataset's: the audio after and before the effect,
+    the dry labels (kept effects and removed effects applied before it)
+    and the wet label of the effect alone. Built from config with a nested
+    dataset, as in +exp={effect}_stages.
+    """
 
-            for label_idx in dry_labels:
-                dry_labels_tensor[label_idx] = 1.0
+    def __init__(self, dataset: EffectDataset, effect: str, **kwargs):
+        # Options of the dataset config this replaces are accepted and ignored
+        super().__init__()
+        if not dataset.store_stages:
+            raise ValueError("EffectStageDataset needs store_stages=True")
+        if effect not in dataset.effects_to_remove:
+            raise ValueError(
+                f"Effect {effect} is never removed. "
+                f"Please choose from {dataset.effects_to_remove}"
+            )
+        self.store = dataset.store
+        self.label = effect_label(dataset.effects[effect])
+        self.pairs = []
+        for idx in dataset.indices:
+            for step, label in enumerate(self.store.stage_effects(idx)):
+                if label == self.label:
+                    self.pairs.append((idx, step))
+        print(f"Found {len(self.pairs)} {effect} stages")
 
-            # Normalize
-            normalized_dry = self.normalize(dry)
-            normalized_wet = self.normalize(wet)
+    def __len__(self):
+        return len(self.pairs)
 
-            # Check STFT, pick different effects if necessary
-            if num_removed_effects == 0:
-                # No need to check if no effects removed
-                break
-            stft = self.mrstft(normalized_wet.unsqueeze(0), normalized_dry.unsqueeze(0))
-        return normalized_dry, normalized_wet, dry_labels_tensor, wet_labels_tensor
+    def __getitem__(self, i: int):
+        idx, step = self.pairs[i]
+        after, before, dry_labels = self.store.read_stage(idx, step)
+        dry_labels = dry_labels.clone()
+        wet_labels = torch.zeros(len(ALL_EFFECTS))
+        for label in self.store.stage_effects(idx)[:step]:
+            dry_labels[label] = 1.0
+        wet_labels[self.label] = 1.0
+        return after, before, dry_labels, wet_labels
 
 
 class InferenceDataset(Dataset):
-    def __init__(self, root: str, sample_rate: int, **kwargs):
+    """Pairs of effected/ and clean/ files, resampled to sample_rate and
+    summed to mono. With cache_root, the prepared pairs are stored once in
+    a memory-mapped file under cache_root and reused by later runs until a
+    file changes. Otherwise the last cache_size pairs are kept in memory.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        sample_rate: int,
+        cache_root: str = None,
+        cache_size: int = 0,
+        **kwargs,
+    ):
         self.root = Path(root)
         self.sample_rate = sample_rate
         self.clean_paths = sorted(list(self.root.glob("clean/*.wav")))
         self.effected_paths = sorted(list(self.root.glob("effected/*.wav")))
+        self.store = None
+        if cache_root is not None:
+            self.store = load_pairs(
+                cache_root,
+                self.root,
+                list(zip(self.clean_paths, self.effected_paths)),
+                sample_rate,
+            )
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
 
     def __len__(self) -> int:
         return len(self.clean_paths)
 
-    def __getitem__(self, idx: int) -> torch.Tensor:
+    def lengths(self) -> List[int]:
+        """Length of every item at sample_rate, read from the file headers."""
+        if self.store is not None:
+            return [entry[5] for entry in self.store.entries]
+        lengths = []
+        for clean_path in self.clean_paths:
+            num_frames, sr, _ = get_audio_info(clean_path)
+            lengths.append(math.ceil(num_frames * self.sample_rate / sr))
+        return lengths
+
+    def load(self, idx: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        if self.store is not None:
+            return self.store[idx]
         clean_path = self.clean_paths[idx]
         effected_path = self.effected_paths[idx]
-        clean_audio, sr = torchaudio.load(clean_path)
-        clean = torchaudio.functional.resample(clean_audio, sr, self.sample_rate)
-        effected_audio, sr = torchaudio.load(effected_path)
-        effected = torchaudio.functional.resample(effected_audio, sr, self.sample_rate)
-
-        # Sum to mono
-        clean = torch.sum(clean, dim=0, keepdim=True)
-        effected = torch.sum(effected, dim=0, keepdim=True)
-
-        # Pad or trim effected to clean
-        if effected.shape[1] > clean.shape[1]:
-            effected = effected[:, : clean.shape[1]]
-        elif effected.shape[1] < clean.shape[1]:
-            pad_size = clean.shape[1] - effected.shape[1]
-            effected = torch.nn.functional.pad(effected, (0, pad_size))
+        if self.cache_size == 0:
+            return load_pair(clean_path, effected_path, self.sample_rate)
+        key = (
+            clean_path,
+            os.path.getmtime(clean_path),
+            effected_path,
+            os.path.getmtime(effected_path),
+        )
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        pair = load_pair(clean_path, effected_path, self.sample_rate)
+        self.cache[key] = pair
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return pair
+
+    def __getitem__(self, idx: int) -> torch.Tensor:
+        effected, clean = self.load(idx)
 
         dry_labels_tensor = torch.zeros(len(ALL_EFFECTS))
         wet_labels_tensor = torch.ones(len(ALL_EFFECTS))
@@ -631,6 +1277,11 @@ class EffectDatamodule(pl.LightningDataModule):
         test_batch_size: int,
         num_workers: int,
         pin_memory: bool = False,
+        bucket_by_length: bool = False,
+        persistent_workers: bool = False,
+        prefetch_factor: int = 2,
+        worker_threads: int = 1,
+        pinned_batches: bool = False,
         **kwargs: int,
     ) -> None:
         super().__init__()
@@ -641,33 +1292,87 @@ class EffectDatamodule(pl.LightningDataModule):
         self.test_batch_size = test_batch_size
         self.num_workers = num_workers
         self.pin_memory = pin_memory
+        # Batch test items of different lengths (see remfx.batching)
+        self.bucket_by_length = bucket_by_length
+        # Keep workers, and the effect modules they built, across epochs
+        self.persistent_workers = persistent_workers
+        self.prefetch_factor = prefetch_factor
+        self.worker_threads = worker_threads
+        # Collate straight into pinned buffers (see remfx.loading)
+        if pinned_batches and num_workers > 0:
+            raise ValueError("pinned_batches requires num_workers=0")
+        self.pinned_batches = pinned_batches
 
     def setup(self, stage: Any = None) -> None:
         pass
 
+    def teardown(self, stage: Any = None) -> None:
+        # Stop the producers of the stage's ProducerPoolDatasets
+        datasets = {
+            "fit": [self.train_dataset, self.val_dataset],
+            "validate": [self.val_dataset],
+            "test": [self.test_dataset],
+        }.get(stage, [self.train_dataset, self.val_dataset, self.test_dataset])
+        for dataset in datasets:
+            if hasattr(dataset, "close"):
+                dataset.close()
+
+    def loader_kwargs(self) -> Dict[str, Any]:
+        kwargs = {
+            "num_workers": self.num_workers,
+            "pin_memory": self.pin_memory and not self.pinned_batches,
+        }
+        if self.num_workers > 0:
+            kwargs["persistent_workers"] = self.persistent_workers
+            kwargs["prefetch_factor"] = self.prefetch_factor
+            kwargs["worker_init_fn"] = partial(
+                init_loader_worker, num_threads=self.worker_threads
+            )
+        return kwargs
+
+    def collate_fn(self, dataset: Dataset):
+        collate_fn = getattr(dataset, "collate_fn", None)
+        if self.pinned_batches:
+            return PinnedCollate(collate_fn)
+        return collate_fn
+
     def train_dataloader(self) -> DataLoader:
         return DataLoader(
             dataset=self.train_dataset,
+            collate_fn=self.collate_fn(self.train_dataset),
             batch_size=self.train_batch_size,
-            num_workers=self.num_workers,
-            pin_memory=self.pin_memory,
             shuffle=True,
+            **self.loader_kwargs(),
         )
 
     def val_dataloader(self) -> DataLoader:
         return DataLoader(
             dataset=self.val_dataset,
+            collate_fn=self.collate_fn(self.val_dataset),
             batch_size=self.train_batch_size,
-            num_workers=self.num_workers,
-            pin_memory=self.pin_memory,
             shuffle=False,
+            **self.loader_kwargs(),
         )
 
     def test_dataloader(self) -> DataLoader:
+        if self.bucket_by_length:
+            # Cropped batches change shape, so they are pinned by the loader
+            kwargs = self.loader_kwargs()
+            kwargs["pin_memory"] = self.pin_memory
+            sampler = LengthBucketSampler(
+                self.test_dataset.lengths(), self.test_batch_size
+            )
+            print(f"Length buckets crop {sampler.cropped():.1%} of the test audio")
+            return DataLoader(
+                dataset=self.test_dataset,
+                collate_fn=crop_collate,
+                batch_sampler=sampler,
+                **kwargs,
+            )
         return DataLoader(
             dataset=self.test_dataset,
+            collate_fn=self.collate_fn(self.test_dataset),
             batch_size=self.test_batch_size,
-            num_workers=self.num_workers,
-            pin_memory=self.pin_memory,
             shuffle=False,
+            **self.loader_kwargs(),
         )
@@ -0,0 +1,96 @@
+import os
+import time
+import traceback
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+# Environment variables giving (rank, world size), by launcher
+RANK_ENV = [("RANK", "WORLD_SIZE"), ("SLURM_PROCID", "SLURM_NTASKS")]
+
+
+def rank_info(rank: int = None, world_size: int = None) -> Tuple[int, int]:
+    """Rank and world size of this process, as given or set by torchrun
+    or SLURM. A single process is rank 0 of 1.
+    """
+    if rank is None and world_size is None:
+        for rank_var, size_var in RANK_ENV:
+            if rank_var in os.environ and size_var in os.environ:
+                rank = int(os.environ[rank_var])
+                world_size = int(os.environ[size_var])
+                break
+    rank = 0 if rank is None else rank
+    world_size = 1 if world_size is None else world_size
+    if not 0 <= rank < world_size:
+        raise ValueError(f"Rank {rank} is not in a world of size {world_size}")
+    return rank, world_size
+
+
+def rank_range(
+    total: int, rank: int, world_size: int, align: int = 1
+) -> Tuple[int, int]:
+    """[begin, end) of the indices of range(total) owned by rank. Ranges are
+    contiguous, disjoint, cover range(total) and start at multiples of
+    align, so whole shards of align indices belong to one rank.
+    """
+    num_blocks = -(-total // align)
+    begin = num_blocks * rank // world_size * align
+    end = num_blocks * (rank + 1) // world_size * align
+    return min(begin, total), min(end, total)
+
+
+def mark_failed(failed_dir: Path, rank: int, error: BaseException) -> None:
+    """Record that rank failed, so the ranks waiting on it stop."""
+    failed_dir.mkdir(parents=True, exist_ok=True)
+    path = failed_dir / f"rank_{rank}.txt"
+    with open(path.with_suffix(f".tmp{os.getpid()}"), "w") as f:
+        lines = traceback.format_exception(type(error), error, error.__traceback__)
+        f.write("".join(lines))
+    os.replace(path.with_suffix(f".tmp{os.getpid()}"), path)
+
+
+def find_failure(failed_dir: Path, since: float) -> Optional[str]:
+    """Failure recorded by any rank after since, which leaves out markers
+    of earlier runs.
+    """
+    if not failed_dir.exists():
+        return None
+    for path in sorted(failed_dir.glob("rank_*.txt")):
+        if path.stat().st_mtime >= since:
+            return f"{path.stem} failed:\n{path.read_text()}"
+    return None
+
+
+def wait_until(
+    progress: Callable[[], int],
+    total: int,
+    what: str,
+    failed: Callable[[], Optional[str]] = lambda: None,
+    timeout: float = None,
+    poll: float = 10.0,
+) -> None:
+    """Poll progress every poll seconds until it reaches total. Raises
+    RuntimeError if failed reports a failure, and TimeoutError if progress
+    does not increase for timeout seconds, e.g. as a rank was killed.
+    """
+    start = last_change = time.time()
+    best = -1
+    while True:
+        failure = failed()
+        if failure is not None:
+            raise RuntimeError(f"Stopped waiting for {what}. {failure}")
+        count = progress()
+        if count >= total:
+            return
+        now = time.time()
+        if count > best:
+            best, last_change = count, now
+        elif timeout is not None and now - last_change > timeout:
+            raise TimeoutError(
+                f"No progress waiting for {what} in {timeout:.0f}s "
+                f"({count} of {total} done)"
+            )
+        print(
+            f"Waiting for {what}: {count} of {total} ({now - start:.0f}s)",
+            flush=True,
+        )
+        time.sleep(poll)
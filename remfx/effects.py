@@ -1,4 +1,6 @@
+import os
 import torch
+import numba
 import torchaudio
 import numpy as np
 import scipy.signal
@@ -8,8 +10,8 @@ from torchvision.transforms import Compose, RandomApply
 
 
 from typing import List
+from functools import lru_cache
 from pedalboard import (
-    Pedalboard,
     Chorus,
     Reverb,
     Compressor,
@@ -21,17 +23,39 @@ from pedalboard import (
 
 __all__ = []
 
+# Pedalboard plugins reused across calls, one instance per type and process
+_plugin_pool = {}
 
-def loguniform(low=0, high=1):
-    return scipy.stats.loguniform.rvs(low, high)
 
+def loguniform(low=0, high=1, size=None):
+    return scipy.stats.loguniform.rvs(low, high, size=size)
 
-def rand(low=0, high=1):
-    return (torch.rand(1).numpy()[0] * (high - low)) + low
 
+def rand(low=0, high=1, size=None):
+    if size is None:
+        return (torch.rand(1).numpy()[0] * (high - low)) + low
+    return (torch.rand(size).numpy() * (high - low)) + low
 
-def randint(low=0, high=1):
-    return torch.randint(low, high + 1, (1,)).numpy()[0]
+
+def randint(low=0, high=1, size=None):
+    if size is None:
+        return torch.randint(low, high + 1, (1,)).numpy()[0]
+    return torch.randint(low, high + 1, (size,)).numpy()
+
+
+def pooled_plugin(plugin_type, **params):
+    """Instance of a Pedalboard plugin type from this process's pool, set to
+    params. Plugins reset their state when called, so the output matches
+    that of a new instance. Not for plugins that ramp to new parameter
+    values, such as Reverb.
+    """
+    key = (os.getpid(), plugin_type)
+    if key not in _plugin_pool:
+        _plugin_pool[key] = plugin_type()
+    plugin = _plugin_pool[key]
+    for name, value in params.items():
+        setattr(plugin, name, value)
+    return plugin
 
 
 def biqaud(
@@ -91,6 +115,95 @@ def biqaud(
     return b, a
 
 
+def parametric_eq_sos(
+    sample_rate: float,
+    low_shelf_gain_db: np.ndarray,
+    low_shelf_cutoff_freq: np.ndarray,
+    low_shelf_q_factor: np.ndarray,
+    band_gains_db: np.ndarray,
+    band_cutoff_freqs: np.ndarray,
+    band_q_factors: np.ndarray,
+    high_shelf_gain_db: np.ndarray,
+    high_shelf_cutoff_freq: np.ndarray,
+    high_shelf_q_factor: np.ndarray,
+) -> np.ndarray:
+    """Second-order sections of a batch of parametric EQs, designed at once.
+    Shelf parameters have shape (batch,) and band parameters (batch, bands).
+    Returns: sos (np.ndarray): (batch, bands + 2, 6) as [b0, b1, b2, a0, a1, a2],
+        ordered low-shelf -> band 1 -> ... -> band N -> high-shelf.
+    """
+
+    def sections(gain_db, cutoff_freq, q_factor, filter_type):
+        b, a = biqaud(
+            np.asarray(gain_db, dtype=np.float64),
+            np.asarray(cutoff_freq, dtype=np.float64),
+            np.asarray(q_factor, dtype=np.float64),
+            sample_rate,
+            filter_type,
+        )
+        return np.moveaxis(np.concatenate([b, a]), 0, -1)
+
+    low_shelf = sections(
+        low_shelf_gain_db, low_shelf_cutoff_freq, low_shelf_q_factor, "low_shelf"
+    )
+    bands = sections(band_gains_db, band_cutoff_freqs, band_q_factors, "peaking")
+    high_shelf = sections(
+        high_shelf_gain_db, high_shelf_cutoff_freq, high_shelf_q_factor, "high_shelf"
+    )
+    return np.concatenate([low_shelf[:, None], bands, high_shelf[:, None]], axis=1)
+
+
+@numba.njit(cache=True)
+def sosfilt_batch(sos: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """Filter each batch item with its own cascade of second-order sections.
+    Args:
+        sos (np.ndarray): (batch, sections, 6), normalized so a0 = 1.
+        x (np.ndarray): (batch, chs, seq_len). All channels of an item share
+            its filter.
+    Returns:
+        y (np.ndarray): Filtered float64 signals of the same shape.
+    """
+    batch_size, num_channels, seq_len = x.shape
+    num_sections = sos.shape[1]
+    num_rows = batch_size * num_channels
+    coefs = np.empty((num_sections, 5, num_rows))
+    for n in range(batch_size):
+        for ch in range(num_channels):
+            for k in range(num_sections):
+                # a0 = 1 is dropped
+                coefs[k, :3, n * num_channels + ch] = sos[n, k, :3]
+                coefs[k, 3:, n * num_channels + ch] = sos[n, k, 4:]
+    x = np.ascontiguousarray(x).reshape(num_rows, seq_len)
+    y = np.empty((num_rows, seq_len))
+    z0 = np.zeros((num_sections, num_rows))
+    z1 = np.zeros((num_sections, num_rows))
+    # Time-major tiles, so each step updates all rows with SIMD
+    tile_size = 256
+    tile = np.empty((tile_size, num_rows))
+    for start in range(0, seq_len, tile_size):
+        length = min(tile_size, seq_len - start)
+        for r in range(num_rows):
+            for t in range(length):
+                tile[t, r] = x[r, start + t]
+        for t in range(length):
+            v = tile[t]
+            for k in range(num_sections):
+                c = coefs[k]
+                zk0 = z0[k]
+                zk1 = z1[k]
+                # Transposed direct form II, like scipy.signal.lfilter
+                for r in range(num_rows):
+                    vr = v[r]
+                    out = c[0, r] * vr + zk0[r]
+                    zk0[r] = c[1, r] * vr - c[3, r] * out + zk1[r]
+                    zk1[r] = c[2, r] * vr - c[4, r] * out
+                    v[r] = out
+        for r in range(num_rows):
+            for t in range(length):
+                y[r, start + t] = tile[t, r]
+    return y.reshape(batch_size, num_channels, seq_len)
+
+
 def parametric_eq(
     x: np.ndarray,
     sample_rate: float,
@@ -113,41 +226,22 @@ def parametric_eq(
         len(band_gains_db) == len(band_cutoff_freqs) == len(band_q_factors)
     )  # must define for all bands
 
-    # -------- apply low-shelf filter --------
-    b, a = biqaud(
-        low_shelf_gain_db,
-        low_shelf_cutoff_freq,
-        low_shelf_q_factor,
-        sample_rate,
-        "low_shelf",
-    )
-    x = scipy.signal.lfilter(b, a, x)
-
-    # -------- apply peaking filters --------
-    for gain_db, cutoff_freq, q_factor in zip(
-        band_gains_db, band_cutoff_freqs, band_q_factors
-    ):
-        b, a = biqaud(
-            gain_db,
-            cutoff_freq,
-            q_factor,
-            sample_rate,
-            "peaking",
-        )
-        x = scipy.signal.lfilter(b, a, x)
-
-    # -------- apply high-shelf filter --------
-    b, a = biqaud(
-        high_shelf_gain_db,
-        high_shelf_cutoff_freq,
-        high_shelf_q_factor,
+    sos = parametric_eq_sos(
         sample_rate,
-        "high_shelf",
+        [low_shelf_gain_db],
+        [low_shelf_cutoff_freq],
+        [low_shelf_q_factor],
+        [band_gains_db],
+        [band_cutoff_freqs],
+        [band_q_factors],
+        [high_shelf_gain_db],
+        [high_shelf_cutoff_freq],
+        [high_shelf_q_factor],
     )
-    sos5 = np.concatenate((b, a))
-    x = scipy.signal.lfilter(b, a, x)
+    x = np.asarray(x)
+    y = sosfilt_batch(sos, x.reshape(1, -1, x.shape[-1]))
 
-    return x.astype(dtype)
+    return y.reshape(x.shape).astype(dtype)
 
 
 class RandomParametricEQ(torch.nn.Module):
@@ -175,43 +269,52 @@ class RandomParametricEQ(torch.nn.Module):
     def forward(self, x: torch.Tensor):
         """
         Args:
-            x: (torch.Tensor): Array of audio samples with shape (chs, seq_leq).
-                The filter will be applied the final dimension, and by default the same
-                filter will be applied to all channels.
+            x: (torch.Tensor): Array of audio samples with shape (chs, seq_leq),
+                or a batch of shape (batch, chs, seq_len) where each item gets
+                its own random EQ. The filter will be applied the final dimension,
+                and by default the same filter will be applied to all channels.
         """
-        low_shelf_gain_db = rand(self.min_gain_db, self.max_gain_db)
-        low_shelf_cutoff_freq = loguniform(20.0, 200.0)
-        low_shelf_q_factor = rand(self.min_q_factor, self.max_q_factor)
+        batched = x.ndim == 3
+        if not batched:
+            x = x.unsqueeze(0)
+        batch_size = x.shape[0]
 
-        high_shelf_gain_db = rand(self.min_gain_db, self.max_gain_db)
-        high_shelf_cutoff_freq = loguniform(8000.0, 16000.0)
-        high_shelf_q_factor = rand(self.min_q_factor, self.max_q_factor)
+        low_shelf_gain_db = rand(self.min_gain_db, self.max_gain_db, batch_size)
+        low_shelf_cutoff_freq = loguniform(20.0, 200.0, batch_size)
+        low_shelf_q_factor = rand(self.min_q_factor, self.max_q_factor, batch_size)
+
+        high_shelf_gain_db = rand(self.min_gain_db, self.max_gain_db, batch_size)
+        high_shelf_cutoff_freq = loguniform(8000.0, 16000.0, batch_size)
+        high_shelf_q_factor = rand(self.min_q_factor, self.max_q_factor, batch_size)
 
         band_gain_dbs = []
         band_cutoff_freqs = []
         band_q_factors = []
         for _ in range(self.num_bands):
-            band_gain_dbs.append(rand(self.min_gain_db, self.max_gain_db))
+            band_gain_dbs.append(rand(self.min_gain_db, self.max_gain_db, batch_size))
             band_cutoff_freqs.append(
-                loguniform(self.min_cutoff_freq, self.max_cutoff_freq)
+                loguniform(self.min_cutoff_freq, self.max_cutoff_freq, batch_size)
+            )
+            band_q_factors.append(
+                rand(self.min_q_factor, self.max_q_factor, batch_size)
             )
-            band_q_factors.append(rand(self.min_q_factor, self.max_q_factor))
 
-        y = parametric_eq(
-            x.numpy(),
+        sos = parametric_eq_sos(
             self.sample_rate,
             low_shelf_gain_db=low_shelf_gain_db,
             low_shelf_cutoff_freq=low_shelf_cutoff_freq,
             low_shelf_q_factor=low_shelf_q_factor,
-            band_gains_db=band_gain_dbs,
-            band_cutoff_freqs=band_cutoff_freqs,
-            band_q_factors=band_q_factors,
+            band_gains_db=np.stack(band_gain_dbs, -1),
+            band_cutoff_freqs=np.stack(band_cutoff_freqs, -1),
+            band_q_factors=np.stack(band_q_factors, -1),
             high_shelf_gain_db=high_shelf_gain_db,
             high_shelf_cutoff_freq=high_shelf_cutoff_freq,
             high_shelf_q_factor=high_shelf_q_factor,
         )
+        y = sosfilt_batch(np.ascontiguousarray(sos), x.numpy())
+        y = torch.from_numpy(y.astype(np.float32))
 
-        return torch.from_numpy(y)
+        return y if batched else y.squeeze(0)
 
 
 def stereo_widener(x: torch.Tensor, width: torch.Tensor):
@@ -318,24 +421,20 @@ class RandomPedalboardCompressor(torch.nn.Module):
         self.min_release_ms = min_release_ms
         self.max_release_ms = max_release_ms
 
-    def forward(self, x: torch.Tensor):
-        board = Pedalboard()
-        threshold_db = rand(self.min_threshold_db, self.max_threshold_db)
-        ratio = rand(self.min_ratio, self.max_ratio)
-        attack_ms = rand(self.min_attack_ms, self.max_attack_ms)
-        release_ms = rand(self.min_release_ms, self.max_release_ms)
-
-        board.append(
-            Compressor(
-                threshold_db=threshold_db,
-                ratio=ratio,
-                attack_ms=attack_ms,
-                release_ms=release_ms,
-            )
-        )
+    def sample_params(self):
+        return {
+            "threshold_db": rand(self.min_threshold_db, self.max_threshold_db),
+            "ratio": rand(self.min_ratio, self.max_ratio),
+            "attack_ms": rand(self.min_attack_ms, self.max_attack_ms),
+            "release_ms": rand(self.min_release_ms, self.max_release_ms),
+        }
+
+    def process(self, x: torch.Tensor, **params):
+        plugin = pooled_plugin(Compressor, **params)
+        return torch.from_numpy(plugin(x.numpy(), self.sample_rate))
 
-        # process audio using the pedalboard
-        return torch.from_numpy(board(x.numpy(), self.sample_rate))
+    def forward(self, x: torch.Tensor):
+        return self.process(x, **self.sample_params())
 
 
 class RandomPedalboardDelay(torch.nn.Module):
@@ -343,7 +442,7 @@ class RandomPedalboardDelay(torch.nn.Module):
         self,
         sample_rate: float,
         min_delay_seconds: float = 0.1,
-        max_delay_sconds: float = 1.0,
+        max_delay_seconds: float = 1.0,
         min_feedback: float = 0.05,
         max_feedback: float = 0.6,
         min_mix: float = 0.0,
@@ -352,19 +451,25 @@ class RandomPedalboardDelay(torch.nn.Module):
         super().__init__()
         self.sample_rate = sample_rate
         self.min_delay_seconds = min_delay_seconds
-        self.max_delay_seconds = max_delay_sconds
+        self.max_delay_seconds = max_delay_seconds
         self.min_feedback = min_feedback
         self.max_feedback = max_feedback
         self.min_mix = min_mix
         self.max_mix = max_mix
 
+    def sample_params(self):
+        return {
+            "delay_seconds": loguniform(self.min_delay_seconds, self.max_delay_seconds),
+            "feedback": rand(self.min_feedback, self.max_feedback),
+            "mix": rand(self.min_mix, self.max_mix),
+        }
+
+    def process(self, x: torch.Tensor, **params):
+        plugin = pooled_plugin(Delay, **params)
+        return torch.from_numpy(plugin(x.numpy(), self.sample_rate))
+
     def forward(self, x: torch.Tensor):
-        board = Pedalboard()
-        delay_seconds = loguniform(self.min_delay_seconds, self.max_delay_seconds)
-        feedback = rand(self.min_feedback, self.max_feedback)
-        mix = rand(self.min_mix, self.max_mix)
-        board.append(Delay(delay_seconds=delay_seconds, feedback=feedback, mix=mix))
-        return torch.from_numpy(board(x.numpy(), self.sample_rate))
+        return self.process(x, **self.sample_params())
 
 
 class RandomPedalboardChorus(torch.nn.Module):
@@ -395,24 +500,21 @@ class RandomPedalboardChorus(torch.nn.Module):
         self.min_mix = min_mix
         self.max_mix = max_mix
 
+    def sample_params(self):
+        return {
+            "rate_hz": rand(self.min_rate_hz, self.max_rate_hz),
+            "depth": rand(self.min_depth, self.max_depth),
+            "centre_delay_ms": rand(self.min_centre_delay_ms, self.max_centre_delay_ms),
+            "feedback": rand(self.min_feedback, self.max_feedback),
+            "mix": rand(self.min_mix, self.max_mix),
+        }
+
+    def process(self, x: torch.Tensor, **params):
+        plugin = pooled_plugin(Chorus, **params)
+        return torch.from_numpy(plugin(x.numpy(), self.sample_rate))
+
     def forward(self, x: torch.Tensor):
-        board = Pedalboard()
-        rate_hz = rand(self.min_rate_hz, self.max_rate_hz)
-        depth = rand(self.min_depth, self.max_depth)
-        centre_delay_ms = rand(self.min_centre_delay_ms, self.max_centre_delay_ms)
-        feedback = rand(self.min_feedback, self.max_feedback)
-        mix = rand(self.min_mix, self.max_mix)
-        board.append(
-            Chorus(
-                rate_hz=rate_hz,
-                depth=depth,
-                centre_delay_ms=centre_delay_ms,
-                feedback=feedback,
-                mix=mix,
-            )
-        )
-        # process audio using the pedalboard
-        return torch.from_numpy(board(x.numpy(), self.sample_rate))
+        return self.process(x, **self.sample_params())
 
 
 class RandomPedalboardPhaser(torch.nn.Module):
@@ -443,26 +545,23 @@ class RandomPedalboardPhaser(torch.nn.Module):
         self.min_mix = min_mix
         self.max_mix = max_mix
 
+    def sample_params(self):
+        return {
+            "rate_hz": rand(self.min_rate_hz, self.max_rate_hz),
+            "depth": rand(self.min_depth, self.max_depth),
+            "centre_frequency_hz": rand(
+                self.min_centre_frequency_hz, self.min_centre_frequency_hz
+            ),
+            "feedback": rand(self.min_feedback, self.max_feedback),
+            "mix": rand(self.min_mix, self.max_mix),
+        }
+
+    def process(self, x: torch.Tensor, **params):
+        plugin = pooled_plugin(Phaser, **params)
+        return torch.from_numpy(plugin(x.numpy(), self.sample_rate))
+
     def forward(self, x: torch.Tensor):
-        board = Pedalboard()
-        rate_hz = rand(self.min_rate_hz, self.max_rate_hz)
-        depth = rand(self.min_depth, self.max_depth)
-        centre_frequency_hz = rand(
-            self.min_centre_frequency_hz, self.min_centre_frequency_hz
-        )
-        feedback = rand(self.min_feedback, self.max_feedback)
-        mix = rand(self.min_mix, self.max_mix)
-        board.append(
-            Phaser(
-                rate_hz=rate_hz,
-                depth=depth,
-                centre_frequency_hz=centre_frequency_hz,
-                feedback=feedback,
-                mix=mix,
-            )
-        )
-        # process audio using the pedalboard
-        return torch.from_numpy(board(x.numpy(), self.sample_rate))
+        return self.process(x, **self.sample_params())
 
 
 class RandomPedalboardLimiter(torch.nn.Module):
@@ -481,17 +580,18 @@ class RandomPedalboardLimiter(torch.nn.Module):
         self.min_release_ms = min_release_ms
         self.max_release_ms = max_release_ms
 
+    def sample_params(self):
+        return {
+            "threshold_db": rand(self.min_threshold_db, self.max_threshold_db),
+            "release_ms": rand(self.min_release_ms, self.max_release_ms),
+        }
+
+    def process(self, x: torch.Tensor, **params):
+        plugin = pooled_plugin(Limiter, **params)
+        return torch.from_numpy(plugin(x.numpy(), self.sample_rate))
+
     def forward(self, x: torch.Tensor):
-        board = Pedalboard()
-        threshold_db = rand(self.min_threshold_db, self.max_threshold_db)
-        release_ms = rand(self.min_release_ms, self.max_release_ms)
-        board.append(
-            Limiter(
-                threshold_db=threshold_db,
-                release_ms=release_ms,
-            )
-        )
-        return torch.from_numpy(board(x.numpy(), self.sample_rate))
+        return self.process(x, **self.sample_params())
 
 
 class RandomPedalboardDistortion(torch.nn.Module):
@@ -506,11 +606,15 @@ class RandomPedalboardDistortion(torch.nn.Module):
         self.min_drive_db = min_drive_db
         self.max_drive_db = max_drive_db
 
+    def sample_params(self):
+        return {"drive_db": rand(self.min_drive_db, self.max_drive_db)}
+
+    def process(self, x: torch.Tensor, **params):
+        plugin = pooled_plugin(Distortion, **params)
+        return torch.from_numpy(plugin(x.numpy(), self.sample_rate))
+
     def forward(self, x: torch.Tensor):
-        board = Pedalboard()
-        drive_db = rand(self.min_drive_db, self.max_drive_db)
-        board.append(Distortion(drive_db=drive_db))
-        return torch.from_numpy(board(x.numpy(), self.sample_rate))
+        return self.process(x, **self.sample_params())
 
 
 class RandomSoxReverb(torch.nn.Module):
@@ -596,37 +700,128 @@ class RandomPedalboardReverb(torch.nn.Module):
         self.min_width = min_width
         self.max_width = max_width
 
-    def forward(self, x: torch.Tensor):
-        board = Pedalboard()
-        room_size = rand(self.min_room_size, self.max_room_size)
-        damping = rand(self.min_damping, self.max_damping)
-        wet_dry = rand(self.min_wet_dry, self.max_wet_dry)
-        width = rand(self.min_width, self.max_width)
+    def sample_params(self):
+        return {
+            "room_size": rand(self.min_room_size, self.max_room_size),
+            "damping": rand(self.min_damping, self.max_damping),
+            "wet_dry": rand(self.min_wet_dry, self.max_wet_dry),
+            "width": rand(self.min_width, self.max_width),
+        }
+
+    def process(self, x: torch.Tensor, room_size, damping, wet_dry, width):
+        # Not pooled, as settling its 10 ms parameter ramp costs more than
+        # constructing a new one
+        plugin = Reverb(
+            room_size=room_size,
+            damping=damping,
+            wet_level=wet_dry,
+            dry_level=(1 - wet_dry),
+            width=width,
+        )
+        return torch.from_numpy(plugin(x.numpy(), self.sample_rate))
 
-        board.append(
-            Reverb(
-                room_size=room_size,
-                damping=damping,
-                wet_level=wet_dry,
-                dry_level=(1 - wet_dry),
-                width=width,
+    def forward(self, x: torch.Tensor):
+        return self.process(x, **self.sample_params())
+
+
+def k_weighting(sample_rate: float) -> List[pyln.IIRfilter]:
+    """Filter stages of the K-weighting used by pyloudnorm's Meter."""
+    return [
+        pyln.IIRfilter(4.0, 1 / np.sqrt(2), 1500.0, sample_rate, "high_shelf"),
+        pyln.IIRfilter(0.0, 0.5, 38.0, sample_rate, "high_pass"),
+    ]
+
+
+@lru_cache(maxsize=32)
+def _gating_blocks(num_samples: int, sample_rate: float, block_size: float):
+    # Same bounds as pyloudnorm.Meter.integrated_loudness (75% overlap)
+    step = 0.25
+    T = num_samples / sample_rate
+    num_blocks = int(np.round(((T - block_size) / (block_size * step)))) + 1
+    lower = [int(block_size * (j * step) * sample_rate) for j in range(num_blocks)]
+    upper = [int(block_size * (j * step + 1) * sample_rate) for j in range(num_blocks)]
+    # The last block may run past the end and is truncated
+    lower = torch.tensor(lower).clamp(max=num_samples)
+    upper = torch.tensor(upper).clamp(max=num_samples)
+    return lower, upper
+
+
+def integrated_loudness(
+    x: torch.Tensor, sample_rate: float, block_size: float = 0.400
+) -> torch.Tensor:
+    """Integrated gated loudness (ITU-R BS.1770-4) in dB LUFS of a
+    (..., channels, time) tensor, with one value per leading index.
+    Torch counterpart of pyloudnorm.Meter.integrated_loudness, which it
+    matches within 1e-4 LU (see scripts/bench_loudness.py).
+    """
+    num_channels, num_samples = x.shape[-2:]
+    if num_samples < block_size * sample_rate:
+        raise ValueError("Audio must have length greater than the block size.")
+    # Apply frequency weighting filters
+    stages = k_weighting(sample_rate)
+    if x.is_cuda:
+        y = x.double()
+        for stage in stages:
+            b = torch.from_numpy(stage.b).to(y)
+            a = torch.from_numpy(stage.a).to(y)
+            y = stage.passband_gain * torchaudio.functional.lfilter(
+                y, a, b, clamp=False
             )
+    else:
+        # scipy's cascade is several times faster than torchaudio's lfilter
+        # on CPU, and filters in float64 like pyloudnorm
+        sos = np.stack(
+            [
+                np.concatenate([stage.passband_gain * stage.b, stage.a])
+                for stage in stages
+            ]
         )
+        y = torch.from_numpy(scipy.signal.sosfilt(sos, x.numpy(), axis=-1))
+
+    # Mean square of each gating block, from the running energy
+    lower, upper = _gating_blocks(num_samples, sample_rate, block_size)
+    lower, upper = lower.to(y.device), upper.to(y.device)
+    energy = torch.cumsum(y.square_(), -1)
+    z = energy[..., upper - 1] - torch.where(
+        lower > 0, energy[..., (lower - 1).clamp(min=0)], 0.0
+    )
+    z = z / (block_size * sample_rate)
+    G = torch.tensor([1.0, 1.0, 1.0, 1.41, 1.41]).to(z)[:num_channels]
+    G = G.unsqueeze(-1)
+    block_loudness = -0.691 + 10.0 * torch.log10((G * z).sum(-2))
+
+    def gated_mean(gate):
+        # Mean over gated blocks, nan if none
+        gate = gate.unsqueeze(-2).to(z.dtype)
+        return (z * gate).sum(-1) / gate.sum(-1)
 
-        return torch.from_numpy(board(x.numpy(), self.sample_rate))
+    # Absolute threshold, then relative threshold (-10 LU)
+    z_avg = gated_mean(block_loudness >= -70.0)
+    gamma_r = -0.691 + 10.0 * torch.log10((G.squeeze(-1) * z_avg).sum(-1)) - 10.0
+    gate = (block_loudness > gamma_r.unsqueeze(-1)) & (block_loudness > -70.0)
+    z_avg = torch.nan_to_num(gated_mean(gate))
+    return -0.691 + 10.0 * torch.log10((G.squeeze(-1) * z_avg).sum(-1))
 
 
 class LoudnessNormalize(torch.nn.Module):
     def __init__(self, sample_rate: float, target_lufs_db: float = -32.0) -> None:
         super().__init__()
-        self.meter = pyln.Meter(sample_rate)
+        self.sample_rate = sample_rate
         self.target_lufs_db = target_lufs_db
 
     def forward(self, x: torch.Tensor):
-        x_lufs_db = self.meter.integrated_loudness(x.permute(1, 0).numpy())
-        delta_lufs_db = torch.tensor([self.target_lufs_db - x_lufs_db]).float()
+        """Normalize a (channels, time) or (batch, channels, time) tensor.
+        Outputs are marked, so normalizing one again to the same target
+        returns it unchanged instead of measuring it again.
+        """
+        if getattr(x, "_normalized", None) == (self.target_lufs_db, x._version):
+            return x
+        x_lufs_db = integrated_loudness(x, self.sample_rate)
+        delta_lufs_db = (self.target_lufs_db - x_lufs_db).float()
         gain_lin = 10.0 ** (delta_lufs_db.clamp(-120, 40.0) / 20.0)
-        return gain_lin * x
+        y = gain_lin[..., None, None] * x
+        y._normalized = (self.target_lufs_db, y._version)
+        return y
 
 
 class RandomAudioEffectsChannel(torch.nn.Module):
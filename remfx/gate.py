@@ -0,0 +1,123 @@
+import math
+import time
+import torch
+from typing import Dict
+from auraloss.freq import MultiResolutionSTFTLoss
+
+
+def stft_cost(loss) -> float:
+    """Relative cost of the STFT of one resolution of a MultiResolutionSTFTLoss."""
+    return loss.fft_size * math.log2(loss.fft_size) / loss.hop_size
+
+
+def overlap_gain(loss) -> float:
+    """Upper bound of the energy of the STFT of a signal relative to its
+    own energy, for the centered, reflect-padded STFT of auraloss.
+    """
+    window = loss.window.double() ** 2
+    hop = loss.hop_size
+    overlap = max(window[r::hop].sum().item() for r in range(min(hop, len(window))))
+    # Reflect padding at most triples the energy of the padded signal
+    return 3 * loss.fft_size * overlap
+
+
+class SpectralGate:
+    """Tells whether a wet signal differs enough from its dry signal, i.e.
+    whether MultiResolutionSTFTLoss(wet, dry) >= threshold, more cheaply:
+    the dry spectra are computed once per dry signal, an upper bound of the
+    loss from the energy of wet - dry rejects near no-ops without any STFT,
+    and resolutions are computed cheapest first, accepting as soon as the
+    partial loss reaches the threshold.
+    """
+
+    def __init__(self, mrstft: MultiResolutionSTFTLoss, threshold: float):
+        for loss in mrstft.stft_losses:
+            if (
+                loss.w_lin_mag
+                or loss.w_phs
+                or loss.scale is not None
+                or loss.perceptual_weighting
+                or loss.scale_invariance
+                or loss.reduction != "mean"
+                or loss.mag_distance != "L1"
+            ):
+                raise ValueError(
+                    "SpectralGate only supports spectral convergence and "
+                    "L1 log magnitude STFT losses"
+                )
+        self.mrstft = mrstft
+        self.threshold = threshold
+        self.losses = list(mrstft.stft_losses)
+        self.order = sorted(
+            range(len(self.losses)), key=lambda i: stft_cost(self.losses[i])
+        )
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.stats = {"checked": 0, "rejected": 0, "prechecked": 0, "seconds": 0.0}
+
+    def magnitude(self, loss, x: torch.Tensor) -> torch.Tensor:
+        loss.window = loss.window.to(x.device)
+        return loss.stft(x.reshape(-1, x.shape[-1]))[0]
+
+    def reference(self, dry: torch.Tensor) -> Dict:
+        """Spectra of a dry signal, shared by every check against it."""
+        start = time.perf_counter()
+        mags = [self.magnitude(loss, dry) for loss in self.losses]
+        # Both terms of each resolution are Lipschitz in the STFT of
+        # wet - dry, whose norm is bounded by its energy
+        bound = 0.0
+        for loss, mag in zip(self.losses, mags):
+            gain = math.sqrt(overlap_gain(loss))
+            sc = loss.w_sc * gain / max(torch.linalg.norm(mag).item(), 1e-30)
+            log_mag = loss.w_log_mag * gain / math.sqrt(mag.numel() * loss.eps)
+            bound += (sc + log_mag) / len(self.losses)
+        self.stats["seconds"] += time.perf_counter() - start
+        return {"dry": dry, "mags": mags, "bound": bound}
+
+    def resolution_loss(self, i: int, wet: torch.Tensor, reference: Dict):
+        loss = self.losses[i]
+        x_mag = self.magnitude(loss, wet)
+        y_mag = reference["mags"][i]
+        sc = torch.linalg.norm(y_mag - x_mag) / torch.linalg.norm(y_mag)
+        log_mag = torch.nn.functional.l1_loss(torch.log(x_mag), torch.log(y_mag))
+        return loss.w_sc * sc + loss.w_log_mag * log_mag
+
+    def passes(self, wet: torch.Tensor, reference: Dict) -> bool:
+        start = time.perf_counter()
+        self.stats["checked"] += 1
+        passed = None
+        difference = torch.linalg.norm(wet - reference["dry"]).item()
+        if reference["bound"] * difference < self.threshold:
+            self.stats["prechecked"] += 1
+            passed = False
+        else:
+            # Every term is non-negative, so a partial loss reaching the
+            # threshold accepts
+            losses = {}
+            for i in self.order:
+                losses[i] = self.resolution_loss(i, wet, reference)
+                if sum(losses.values()) / len(self.losses) >= self.threshold:
+                    passed = True
+                    break
+            if passed is None:
+                total = sum(losses[i] for i in range(len(self.losses)))
+                passed = bool(total / len(self.losses) >= self.threshold)
+        if not passed:
+            self.stats["rejected"] += 1
+        self.stats["seconds"] += time.perf_counter() - start
+        return passed
+
+    def merge_stats(self, stats: Dict) -> None:
+        for key, value in stats.items():
+            self.stats[key] += value
+
+    def summary(self) -> str:
+        checked = max(self.stats["checked"], 1)
+        return (
+            f"Quality gate rejected {self.stats['rejected']} of "
+            f"{self.stats['checked']} wet signals "
+            f"({100 * self.stats['rejected'] / checked:.1f}%, "
+            f"{self.stats['prechecked']} by the energy pre-check) "
+            f"in {self.stats['seconds']:.1f}s"
+        )
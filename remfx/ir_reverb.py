@@ -0,0 +1,251 @@
+import os
+import torch
+import numpy as np
+from pathlib import Path
+from typing import Dict, List
+from remfx.cache import render_key
+from remfx.effects import rand, RandomPedalboardReverb
+from remfx.batched_effects import BatchedEffect, reverb_kernel
+
+# Where impulse response banks are stored if no bank_root is given
+DEFAULT_BANK_ROOT = "~/.cache/remfx/ir_banks"
+# Samples of an impulse response further than this below its peak are trimmed
+TAIL_DB = 80.0
+
+
+def impulse_responses(
+    room_sizes: np.ndarray, dampings: np.ndarray, sample_rate: float, length: int
+) -> np.ndarray:
+    """Wet output of the mono Freeverb for a unit impulse, at unit wet gain,
+    for every (room_size, damping) pair. Returns (rooms, dampings, length).
+    """
+    room_grid, damping_grid = np.meshgrid(room_sizes, dampings, indexing="ij")
+    num_irs = room_grid.size
+    impulse = np.zeros((num_irs, 1, length), dtype=np.float32)
+    impulse[:, 0, 0] = 1.0
+    ones = np.ones(num_irs)
+    irs = reverb_kernel(
+        impulse,
+        room_grid.ravel(),
+        damping_grid.ravel(),
+        ones / 3,  # wet_level is scaled by 3
+        0 * ones,
+        ones,
+        float(sample_rate),
+    )
+    return irs[:, 0].reshape(len(room_sizes), len(dampings), length)
+
+
+def trim_tail(ir: np.ndarray, tail_db: float = TAIL_DB) -> np.ndarray:
+    peak = np.abs(ir).max()
+    audible = np.flatnonzero(np.abs(ir) > peak * 10 ** (-tail_db / 20))
+    return ir[: audible[-1] + 1] if len(audible) else ir[:1]
+
+
+def ir_bank_path(bank_root: str, config: Dict) -> Path:
+    return Path(bank_root).expanduser() / f"ir_bank_{render_key(config)[:16]}.npz"
+
+
+def load_ir_bank(bank_root: str, config: Dict) -> Dict[str, np.ndarray]:
+    """Impulse response bank described by config, built and stored on
+    first use. IRs are trimmed and stored as float16 with a float32 scale.
+    """
+    path = ir_bank_path(bank_root, config)
+    if not path.exists():
+        print(f"Building impulse response bank {path}...")
+        room_sizes = np.linspace(*config["room_sizes"])
+        dampings = np.linspace(*config["dampings"])
+        length = int(config["ir_seconds"] * config["sample_rate"])
+        irs = impulse_responses(room_sizes, dampings, config["sample_rate"], length)
+        irs = [trim_tail(ir, config["tail_db"]) for ir in irs.reshape(-1, length)]
+        scales = np.array([np.abs(ir).max() for ir in irs], dtype=np.float32)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}.npz")
+        np.savez(
+            tmp_path,
+            room_sizes=room_sizes,
+            dampings=dampings,
+            scales=scales,
+            offsets=np.cumsum([0] + [len(ir) for ir in irs]),
+            samples=np.concatenate(
+                [ir / scale for ir, scale in zip(irs, scales)]
+            ).astype(np.float16),
+        )
+        os.replace(tmp_path, path)
+    with np.load(path) as bank:
+        return dict(bank)
+
+
+def partitioned_convolve(
+    x: torch.Tensor, h: torch.Tensor, block_size: int
+) -> torch.Tensor:
+    """First T samples of the convolution of each (channels, T) example of x
+    with its impulse response in h (batch, length), by uniformly
+    partitioned FFT convolution.
+    """
+    B, C, T = x.shape
+    num_blocks = -(-T // block_size)
+    num_parts = min(-(-h.shape[-1] // block_size), num_blocks)
+    n_fft = 2 * block_size
+    x = torch.nn.functional.pad(x, (0, num_blocks * block_size - T))
+    X = torch.fft.rfft(x.reshape(B, C, num_blocks, block_size), n=n_fft)
+    h = torch.nn.functional.pad(h, (0, num_parts * block_size - h.shape[-1]))
+    H = torch.fft.rfft(
+        h[:, : num_parts * block_size].reshape(B, num_parts, -1), n=n_fft
+    )
+    # Block m of the output sums block m - k of the input times partition k
+    Y = torch.zeros_like(X)
+    for k in range(num_parts):
+        Y[:, :, k:] += X[:, :, : num_blocks - k] * H[:, None, k, None]
+    y = torch.fft.irfft(Y, n=n_fft)
+    out = y[..., :block_size].clone()
+    out[:, :, 1:] += y[:, :, :-1, block_size:]
+    return out.reshape(B, C, -1)[..., :T]
+
+
+class ConvolutionReverb(BatchedEffect, RandomPedalboardReverb):
+    """Reverb by FFT convolution with impulse responses of Freeverb, the
+    algorithm of RandomPedalboardReverb. IRs are precomputed on a grid
+    spanning the room size and damping ranges, and either interpolated or
+    taken from the nearest grid point. Pre-delay shifts the IR. On stereo
+    input, width scales the side of the wet signal's mid/side split, as
+    stereo Freeverb mixes its two sides. Mono input gets the wet gain of
+    mono Freeverb.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float,
+        min_room_size: float = 0.0,
+        max_room_size: float = 1.0,
+        min_damping: float = 0.0,
+        max_damping: float = 1.0,
+        min_wet_dry: float = 0.0,
+        max_wet_dry: float = 0.7,
+        min_width: float = 0.0,
+        max_width: float = 1.0,
+        min_pre_delay_ms: float = 0.0,
+        max_pre_delay_ms: float = 0.0,
+        num_room_sizes: int = 8,
+        num_dampings: int = 8,
+        ir_seconds: float = 6.0,
+        interpolate: bool = True,
+        block_size: int = 65536,
+        bank_root: str = None,
+    ) -> None:
+        super().__init__(
+            sample_rate,
+            min_room_size,
+            max_room_size,
+            min_damping,
+            max_damping,
+            min_wet_dry,
+            max_wet_dry,
+            min_width,
+            max_width,
+        )
+        self.min_pre_delay_ms = min_pre_delay_ms
+        self.max_pre_delay_ms = max_pre_delay_ms
+        self.num_room_sizes = num_room_sizes
+        self.num_dampings = num_dampings
+        self.ir_seconds = ir_seconds
+        self.interpolate = interpolate
+        self.block_size = block_size
+        # Not part of the effect's config, so not used in render keys
+        self._bank_root = DEFAULT_BANK_ROOT if bank_root is None else bank_root
+        self._bank = None
+        self._irs = None
+
+    @property
+    def bank(self) -> Dict[str, np.ndarray]:
+        if self._bank is None:
+            config = {
+                "sample_rate": self.sample_rate,
+                "room_sizes": [
+                    self.min_room_size,
+                    self.max_room_size,
+                    self.num_room_sizes,
+                ],
+                "dampings": [self.min_damping, self.max_damping, self.num_dampings],
+                "ir_seconds": self.ir_seconds,
+                "tail_db": TAIL_DB,
+            }
+            self._bank = load_ir_bank(self._bank_root, config)
+        return self._bank
+
+    def get_ir(self, idx: int) -> np.ndarray:
+        if self._irs is None:
+            # Decoded once, so drawing an IR is only a weighted sum
+            bank = self.bank
+            samples = np.split(bank["samples"], bank["offsets"][1:-1])
+            self._irs = [
+                ir.astype(np.float32) * scale
+                for ir, scale in zip(samples, bank["scales"])
+            ]
+        return self._irs[idx]
+
+    def grid_weights(self, value: float, grid: np.ndarray) -> List:
+        """Grid indices and weights that interpolate value, or the nearest
+        grid index if not interpolating.
+        """
+        if len(grid) == 1:
+            return [(0, 1.0)]
+        position = np.clip(
+            (value - grid[0]) / (grid[-1] - grid[0]) * (len(grid) - 1),
+            0,
+            len(grid) - 1,
+        )
+        if not self.interpolate:
+            return [(int(np.round(position)), 1.0)]
+        lower = min(int(position), len(grid) - 2)
+        frac = position - lower
+        return [(lower, 1 - frac), (lower + 1, frac)]
+
+    def make_ir(self, room_size: float, damping: float) -> np.ndarray:
+        num_dampings = len(self.bank["dampings"])
+        parts = []
+        for i, room_weight in self.grid_weights(room_size, self.bank["room_sizes"]):
+            for j, damp_weight in self.grid_weights(damping, self.bank["dampings"]):
+                if room_weight * damp_weight > 0:
+                    parts.append(
+                        (room_weight * damp_weight, self.get_ir(i * num_dampings + j))
+                    )
+        ir = np.zeros(max(len(part) for _, part in parts), dtype=np.float32)
+        for weight, part in parts:
+            ir[: len(part)] += weight * part
+        return ir
+
+    def sample_params(self, batch_size: int) -> Dict[str, np.ndarray]:
+        return {
+            "room_size": rand(self.min_room_size, self.max_room_size, batch_size),
+            "damping": rand(self.min_damping, self.max_damping, batch_size),
+            "wet_dry": rand(self.min_wet_dry, self.max_wet_dry, batch_size),
+            "width": rand(self.min_width, self.max_width, batch_size),
+            "pre_delay_ms": rand(
+                self.min_pre_delay_ms, self.max_pre_delay_ms, batch_size
+            ),
+        }
+
+    def process(self, x, room_size, damping, wet_dry, width, pre_delay_ms):
+        B, C, T = x.shape
+        irs = [self.make_ir(r, d) for r, d in zip(room_size, damping)]
+        pre_delays = (np.asarray(pre_delay_ms) * self.sample_rate / 1000).astype(int)
+        length = min(T, max(len(ir) + d for ir, d in zip(irs, pre_delays)))
+        h = torch.zeros(B, length, device=x.device)
+        for b, (ir, d) in enumerate(zip(irs, pre_delays)):
+            ir = ir[: max(0, length - d)]
+            h[b, d : d + len(ir)] = torch.from_numpy(ir)
+        wet = partitioned_convolve(x, h, self.block_size)
+        # Gains of JUCE's Reverb with dry_level = 1 - wet_level
+        wet_dry = torch.as_tensor(wet_dry, dtype=torch.float32, device=x.device)
+        width = torch.as_tensor(width, dtype=torch.float32, device=x.device)
+        if C == 2:
+            # (1 + width) / 2 * own side + (1 - width) / 2 * other side
+            mid = 0.5 * (wet[:, 0] + wet[:, 1])
+            side = 0.5 * width[:, None] * (wet[:, 0] - wet[:, 1])
+            wet = torch.stack([mid + side, mid - side], dim=1)
+        else:
+            wet = 0.5 * (1 + width[:, None, None]) * wet
+        wet_gain = 3 * wet_dry
+        dry_gain = 2 * (1 - wet_dry)
+        return dry_gain[:, None, None] * x + wet_gain[:, None, None] * wet
@@ -0,0 +1,81 @@
+import random
+import numba
+import torch
+import numpy as np
+from typing import Callable, Dict, List, Sequence, Tuple
+from torch.utils.data import get_worker_info
+from torch.utils.data._utils.collate import default_collate
+
+
+def init_loader_worker(worker_id: int, num_threads: int = 1) -> None:
+    """DataLoader worker_init_fn. Limits the worker's torch and numba
+    threads, e.g. of the batched effects, and seeds numpy and random from
+    the worker's torch seed, which the DataLoader already sets per worker
+    and epoch. Without it, forked workers draw the same effect parameters
+    from the inherited numpy state.
+    """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+        numba.set_num_threads(min(num_threads, numba.config.NUMBA_NUM_THREADS))
+    seed = torch.initial_seed()
+    np.random.seed(seed % 2**32)
+    random.seed(seed)
+
+
+class PinnedCollate:
+    """Collate function writing batches of tensors into pre-allocated
+    pinned buffers, so the host-to-device copy can start without the
+    DataLoader's extra copy into pinned memory. Items are stacked straight
+    into the buffers, or the batches of collate_fn copied into them.
+
+    Buffers are reused every num_buffers batches of the same shapes, so a
+    batch must have been moved to the device before then. As pinned memory
+    cannot be passed between processes, the loader must run in the main
+    process (num_workers=0), e.g. in front of a ProducerPoolDataset.
+    """
+
+    def __init__(self, collate_fn: Callable = None, num_buffers: int = 2):
+        if num_buffers < 1:
+            raise ValueError(f"num_buffers must be at least 1. Got {num_buffers}")
+        self.collate_fn = collate_fn
+        self.num_buffers = num_buffers
+        self.buffers: Dict[Tuple, List[Tuple[torch.Tensor, ...]]] = {}
+        self.steps: Dict[Tuple, int] = {}
+
+    def next_buffers(
+        self, shapes: Sequence[torch.Size], dtypes: Sequence[torch.dtype]
+    ) -> Tuple[torch.Tensor, ...]:
+        key = (tuple(shapes), tuple(dtypes))
+        if key not in self.buffers:
+            self.buffers[key] = [
+                tuple(
+                    torch.empty(shape, dtype=dtype).pin_memory()
+                    for shape, dtype in zip(shapes, dtypes)
+                )
+                for _ in range(self.num_buffers)
+            ]
+            self.steps[key] = 0
+        step = self.steps[key]
+        self.steps[key] = step + 1
+        return self.buffers[key][step % self.num_buffers]
+
+    def __call__(self, items: List[Tuple]) -> Tuple[torch.Tensor, ...]:
+        if get_worker_info() is not None:
+            raise RuntimeError("PinnedCollate must run in the main process")
+        if self.collate_fn is not None:
+            batch = self.collate_fn(items)
+            buffers = self.next_buffers(
+                [x.shape for x in batch], [x.dtype for x in batch]
+            )
+            for buffer, x in zip(buffers, batch):
+                buffer.copy_(x)
+            return buffers
+        fields = list(zip(*items))
+        if not all(isinstance(x, torch.Tensor) for x in items[0]):
+            return default_collate(items)
+        buffers = self.next_buffers(
+            [(len(items),) + x[0].shape for x in fields], [x[0].dtype for x in fields]
+        )
+        for buffer, field in zip(buffers, fields):
+            torch.stack(field, out=buffer)
+        return buffers
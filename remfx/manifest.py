@@ -0,0 +1,122 @@
+import os
+import json
+import torchaudio
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+from remfx.utils import register_audio_info
+
+MANIFEST_VERSION = 1
+MANIFEST_DIR = "remfx_manifest"
+
+
+def manifest_path(root: str, mode: str) -> Path:
+    return Path(root) / MANIFEST_DIR / f"{mode}.json"
+
+
+def load_manifest(path: str) -> Dict:
+    """Load a manifest, returning an empty one if missing or outdated."""
+    empty = {"version": MANIFEST_VERSION, "datasets": [], "files": {}}
+    if not os.path.isfile(path):
+        return empty
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return empty
+    if manifest.get("version") != MANIFEST_VERSION:
+        return empty
+    return manifest
+
+
+def save_manifest(manifest: Dict, path: str) -> None:
+    path = Path(path)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        # Atomic so concurrent readers never see a partial manifest
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"WARNING: Could not write manifest {path}: {e}")
+
+
+def _dir_mtimes(files: List[str], dataset_dir: str) -> Dict[str, float]:
+    """Mtimes of dataset_dir and every directory containing a file below it.
+    A directory's mtime changes when entries are added, removed or renamed,
+    so matching mtimes mean a re-glob would return the same files.
+    """
+    dirs = {dataset_dir}
+    for f in files:
+        d = os.path.dirname(f)
+        while d.startswith(dataset_dir) and d not in dirs:
+            dirs.add(d)
+            d = os.path.dirname(d)
+    return {d: os.path.getmtime(d) for d in sorted(dirs) if os.path.isdir(d)}
+
+
+def _is_fresh(dataset: Dict) -> bool:
+    for d, mtime in dataset["dirs"].items():
+        if not os.path.isdir(d) or os.path.getmtime(d) != mtime:
+            return False
+    return True
+
+
+def update_manifest(
+    path: str,
+    glob_datasets: Callable[[], List[Tuple[str, str, List[str]]]],
+    dataset_dirs: List[str] = (),
+) -> Dict:
+    """Incrementally update the manifest at path.
+    glob_datasets returns (name, dataset_dir, files) for every dataset and
+    is only called when a dataset directory changed since the last scan, or
+    when one of the expected dataset_dirs appeared or disappeared.
+    Header info is only probed for new or modified files.
+    """
+    manifest = load_manifest(path)
+    changed = False
+    datasets = manifest["datasets"]
+    present = [d for d in dataset_dirs if os.path.isdir(d)]
+    if (
+        not datasets
+        or manifest.get("present") != present
+        or not all(_is_fresh(d) for d in datasets)
+    ):
+        datasets = [
+            {"name": name, "dir": d, "files": files, "dirs": _dir_mtimes(files, d)}
+            for name, d, files in glob_datasets()
+        ]
+        changed = True
+
+    old_entries = manifest["files"]
+    entries = {}
+    for dataset in datasets:
+        for f in dataset["files"]:
+            mtime = os.path.getmtime(f)
+            entry = old_entries.get(f)
+            if entry is None or entry["mtime"] != mtime:
+                info = torchaudio.info(f)
+                entry = {
+                    "num_frames": info.num_frames,
+                    "sample_rate": info.sample_rate,
+                    "num_channels": info.num_channels,
+                    "mtime": mtime,
+                }
+                changed = True
+            entries[f] = entry
+    if len(entries) != len(old_entries):
+        changed = True
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "datasets": datasets,
+        "present": present,
+        "files": entries,
+    }
+    if changed:
+        save_manifest(manifest, path)
+    for f, entry in entries.items():
+        register_audio_info(
+            f, entry["num_frames"], entry["sample_rate"], entry["num_channels"]
+        )
+    return manifest
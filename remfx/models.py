@@ -88,20 +88,25 @@ class RemFXChainInference(pl.LightningModule):
                 print("Detected effects:", effects_present_name[0])
                 print("Removing effects...")
 
-        output = []
-        with torch.no_grad():
-            for i, (elem, effects_list) in enumerate(zip(x, effects_present)):
-                elem = elem.unsqueeze(0)  # Add batch dim
-                # Get the correct effect by search for names in effects_order
-                effect_list_names = [effect.__name__ for effect in effects_list]
-                effects = [
-                    effect for effect in effects_order if effect in effect_list_names
-                ]
+        # Group the examples that go through the same chain of models
+        chains = {}
+        for i, effects_list in enumerate(effects_present):
+            # Get the correct effect by search for names in effects_order
+            effect_list_names = [effect.__name__ for effect in effects_list]
+            effects = tuple(
+                effect for effect in effects_order if effect in effect_list_names
+            )
+            chains.setdefault(effects, []).append(i)
 
+        output = [None] * len(x)
+        with torch.no_grad():
+            for effects, idx in chains.items():
+                elems = x[idx]
                 for effect in effects:
                     # Sample the model
-                    elem = self.model[effect].model.sample(elem)
-                output.append(elem.squeeze(0))
+                    elems = self.model[effect].model.sample(elems)
+                for i, elem in zip(idx, elems):
+                    output[i] = elem
         output = torch.stack(output)
 
         loss = self.mrstftloss(output, y) + self.l1loss(output, y) * 100
@@ -114,9 +119,10 @@ class RemFXChainInference(pl.LightningModule):
             random.shuffle(self.effect_order)
         loss, output = self.forward(batch, batch_idx, order=self.effect_order)
         # Crop target to match output
+        target = y
         if output.shape[-1] < y.shape[-1]:
-            y = causal_crop(y, output.shape[-1])
-        self.log("test_loss", loss)
+            target = causal_crop(y, output.shape[-1])
+        self.log("test_loss", loss, batch_size=len(x))
         # Metric logging
         with torch.no_grad():
             for metric in self.metrics:
@@ -127,12 +133,13 @@ class RemFXChainInference(pl.LightningModule):
                     negate = 1
                 self.log(
                     f"test_{metric}",  # + "".join(self.effect_order).replace("RandomPedalboard", ""),
-                    negate * self.metrics[metric](output, y),
+                    negate * self.metrics[metric](output, target),
                     on_step=False,
                     on_epoch=True,
                     logger=True,
                     prog_bar=True,
                     sync_dist=True,
+                    batch_size=len(x),
                 )
                 self.log(
                     f"Input_{metric}",
@@ -142,6 +149,7 @@ class RemFXChainInference(pl.LightningModule):
                     logger=True,
                     prog_bar=True,
                     sync_dist=True,
+                    batch_size=len(x),
                 )
         return loss
 
@@ -222,7 +230,7 @@ class RemFX(pl.LightningModule):
         target = y
         if output.shape[-1] < y.shape[-1]:
             target = causal_crop(y, output.shape[-1])
-        self.log(f"{mode}_loss", loss)
+        self.log(f"{mode}_loss", loss, batch_size=len(x))
         # Metric logging
         with torch.no_grad():
             for metric in self.metrics:
@@ -242,6 +250,7 @@ class RemFX(pl.LightningModule):
                     logger=True,
                     prog_bar=True,
                     sync_dist=True,
+                    batch_size=len(x),
                 )
 
                 self.log(
@@ -252,6 +261,7 @@ class RemFX(pl.LightningModule):
                     logger=True,
                     prog_bar=True,
                     sync_dist=True,
+                    batch_size=len(x),
                 )
         return loss
 
@@ -0,0 +1,145 @@
+import os
+import json
+import hashlib
+import torch
+import torchaudio
+import numpy as np
+from tqdm import tqdm
+from pathlib import Path
+from typing import List, Tuple
+
+PAIRS_VERSION = 1
+
+
+def pairs_path(cache_root: str, root: str, sample_rate: int) -> Path:
+    digest = hashlib.sha1(str(Path(root).resolve()).encode()).hexdigest()
+    return Path(cache_root) / "inference" / f"{digest[:16]}_{sample_rate}"
+
+
+def load_pair(
+    clean_path: str, effected_path: str, sample_rate: int
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Mono (effected, clean) pair at sample_rate, with effected padded or
+    trimmed to the length of clean.
+    """
+    clean_audio, sr = torchaudio.load(clean_path)
+    clean = torchaudio.functional.resample(clean_audio, sr, sample_rate)
+    effected_audio, sr = torchaudio.load(effected_path)
+    effected = torchaudio.functional.resample(effected_audio, sr, sample_rate)
+
+    # Sum to mono
+    clean = torch.sum(clean, dim=0, keepdim=True)
+    effected = torch.sum(effected, dim=0, keepdim=True)
+
+    # Pad or trim effected to clean
+    if effected.shape[1] > clean.shape[1]:
+        effected = effected[:, : clean.shape[1]]
+    elif effected.shape[1] < clean.shape[1]:
+        pad_size = clean.shape[1] - effected.shape[1]
+        effected = torch.nn.functional.pad(effected, (0, pad_size))
+    return effected, clean
+
+
+def _pair_keys(pairs: List[Tuple[str, str]]) -> List[List]:
+    return [
+        [str(c), os.path.getmtime(c), str(e), os.path.getmtime(e)] for c, e in pairs
+    ]
+
+
+def prepare_pairs(
+    pairs: List[Tuple[str, str]], output_dir: str, sample_rate: int
+) -> None:
+    """Write every prepared (effected, clean) pair to one contiguous float32
+    file (audio.f32), effected then clean, with an offset table
+    (index.json). The index is written last, so an interrupted prepare is
+    never loaded.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    entries = []
+    offset = 0
+    tmp_audio = output_dir / "audio.f32.tmp"
+    with open(tmp_audio, "wb") as out:
+        for key, (clean_path, effected_path) in zip(_pair_keys(pairs), tqdm(pairs)):
+            effected, clean = load_pair(clean_path, effected_path, sample_rate)
+            out.write(effected.numpy().astype(np.float32).tobytes())
+            out.write(clean.numpy().astype(np.float32).tobytes())
+            length = clean.shape[1]
+            entries.append(key + [offset, length])
+            offset += 2 * length
+    os.replace(tmp_audio, output_dir / "audio.f32")
+
+    index = {
+        "version": PAIRS_VERSION,
+        "sample_rate": sample_rate,
+        "num_samples": offset,
+        "pairs": entries,
+    }
+    with open(output_dir / "index.json.tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(output_dir / "index.json.tmp", output_dir / "index.json")
+
+
+class PairStore:
+    """Read-only view of pairs written by prepare_pairs. Pairs are returned
+    as tensors backed by the memory map, so reading one involves no decode,
+    resample or copy.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        with open(self.path / "index.json") as f:
+            index = json.load(f)
+        self.sample_rate = index["sample_rate"]
+        self.num_samples = index["num_samples"]
+        self.entries = index["pairs"]
+        self._audio = None
+
+    def __getstate__(self):
+        # Each process opens its own map
+        state = self.__dict__.copy()
+        state["_audio"] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def audio(self) -> np.ndarray:
+        if self._audio is None:
+            # Copy-on-write so tensors are writable without touching the file
+            self._audio = np.memmap(
+                self.path / "audio.f32",
+                dtype=np.float32,
+                mode="c",
+                shape=(self.num_samples,),
+            )
+        return self._audio
+
+    def matches(self, pairs: List[Tuple[str, str]], sample_rate: int) -> bool:
+        """Whether the store was prepared from these files at this rate."""
+        if sample_rate != self.sample_rate:
+            return False
+        return [entry[:4] for entry in self.entries] == _pair_keys(pairs)
+
+    def __getitem__(self, idx: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        offset, length = self.entries[idx][4:]
+        pair = torch.from_numpy(self.audio[offset : offset + 2 * length])
+        return pair[:length].unsqueeze(0), pair[length:].unsqueeze(0)
+
+
+def load_pairs(
+    cache_root: str, root: str, pairs: List[Tuple[str, str]], sample_rate: int
+) -> PairStore:
+    """Open the prepared pairs of an inference folder, preparing them first
+    if they are missing or any file changed since.
+    """
+    path = pairs_path(cache_root, root, sample_rate)
+    if (path / "index.json").exists():
+        store = PairStore(path)
+        if store.matches(pairs, sample_rate):
+            return store
+        print(f"Inference files changed since {path} was prepared.")
+    print(f"Preparing inference pairs at {path}...")
+    prepare_pairs(pairs, path, sample_rate)
+    return PairStore(path)
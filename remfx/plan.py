@@ -0,0 +1,127 @@
+import zlib
+import torch
+import random
+import numpy as np
+from contextlib import contextmanager
+from itertools import groupby
+from typing import Dict, List, Tuple
+from remfx.activity import span_offset
+
+# Extra generator streams of a chunk, see chunk_rng
+REDRAW_STREAM = 1
+VARIANT_STREAM = 2
+
+
+def chunk_rng(seed: int, mode: str, chunk_idx: int, *stream: int):
+    """Random generator of one chunk of a split.
+    It depends only on (seed, mode, chunk_idx), so a chunk gets the same
+    draws whichever process renders it and in whatever order.
+    """
+    return np.random.default_rng([seed, zlib.crc32(mode.encode()), chunk_idx, *stream])
+
+
+@contextmanager
+def seeded(seed: int):
+    """Seed the global torch, numpy and random generators that effect
+    parameters are drawn from, and restore their states on exit.
+    """
+    states = torch.random.get_rng_state(), np.random.get_state(), random.getstate()
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    random.seed(seed)
+    try:
+        yield
+    finally:
+        torch.random.set_rng_state(states[0])
+        np.random.set_state(states[1])
+        random.setstate(states[2])
+
+
+def choose_effects(
+    rng: np.random.Generator,
+    effect_names: List[str],
+    num_effects: List[int],
+    shuffle: bool,
+) -> List[str]:
+    """Pick between num_effects[0] and num_effects[1] of effect_names,
+    in random order if shuffle.
+    """
+    if shuffle:
+        effect_indices = rng.permutation(len(effect_names))
+    else:
+        effect_indices = np.arange(len(effect_names))
+    r1, r2 = num_effects
+    num = int(np.round((r1 - r2) * rng.random() + r2))
+    return [effect_names[i] for i in effect_indices[:num]]
+
+
+def draw_start(rng: np.random.Generator, cum_weights: np.ndarray) -> Tuple[int, int]:
+    """Pick a chunk start uniformly among all valid starts of a dataset's
+    files, given the cumulative file weights. Returns (file_idx, offset).
+    """
+    position = int(rng.integers(cum_weights[-1]))
+    file_idx = int(np.searchsorted(cum_weights, position, side="right"))
+    offset = position - (int(cum_weights[file_idx - 1]) if file_idx > 0 else 0)
+    return file_idx, offset
+
+
+def make_plan(
+    chunk_indices: List[int],
+    seed: int,
+    mode: str,
+    file_weights: List[List[int]],
+    spans: List[List[np.ndarray]],
+    effects_to_keep: List[str],
+    num_kept_effects: List[int],
+    shuffle_kept_effects: bool,
+    effects_to_remove: List[str],
+    num_removed_effects: List[int],
+    shuffle_removed_effects: bool,
+    fan_out: int = 1,
+) -> List[Dict]:
+    """Source, offset, effects and effect seed of every chunk.
+    Offsets are in frames of the source file (samples of a corpus entry).
+    With spans (see remfx.activity), offsets are drawn among valid starts.
+    With fan_out K, chunks iK to iK + K - 1 are variants of source chunk i:
+    they share its source and offset, and draw their effects independently.
+    """
+    cum_weights = [np.cumsum(weights) for weights in file_weights]
+    plan = []
+    for chunk_idx in chunk_indices:
+        source_idx, variant = divmod(chunk_idx, fan_out)
+        rng = chunk_rng(seed, mode, source_idx)
+        dataset_idx = int(rng.integers(len(cum_weights)))
+        file_idx, offset = draw_start(rng, cum_weights[dataset_idx])
+        if spans is not None:
+            offset = span_offset(spans[dataset_idx][file_idx], offset)
+        if fan_out > 1:
+            rng = chunk_rng(seed, mode, source_idx, VARIANT_STREAM, variant)
+        kept = choose_effects(
+            rng, effects_to_keep, num_kept_effects, shuffle_kept_effects
+        )
+        removed = choose_effects(
+            rng, effects_to_remove, num_removed_effects, shuffle_removed_effects
+        )
+        plan.append(
+            {
+                "chunk_idx": chunk_idx,
+                "source_idx": source_idx,
+                "dataset": dataset_idx,
+                "file": file_idx,
+                "offset": offset,
+                "kept": kept,
+                "removed": removed,
+                "seed": int(rng.integers(2**31)),
+            }
+        )
+    return plan
+
+
+def group_by_source(plan: List[Dict]) -> List[List[Dict]]:
+    """Split a plan into one group per source file, ordered by offset."""
+
+    def source(entry):
+        return (entry["dataset"], entry["file"])
+
+    entries = sorted(plan, key=lambda entry: (source(entry), entry["offset"]))
+    return [list(group) for _, group in groupby(entries, key=source)]
@@ -0,0 +1,161 @@
+import time
+import queue
+import torch
+import random
+import numpy as np
+import multiprocessing
+from typing import Dict, Tuple
+from torch.utils.data import Dataset
+from remfx.storage import fix_length
+from remfx.effects import Pedalboard_Effects
+
+
+class SharedRingBuffer:
+    """Fixed slots of (wet, dry, dry_labels, wet_labels) examples in shared
+    memory. Slot indices cycle through a queue of free slots, filled by
+    producers, and a queue of ready slots, emptied by consumers. Producers
+    block while every slot is ready but not yet consumed.
+    """
+
+    def __init__(self, capacity: int, chunk_size: int, num_effects: int, ctx):
+        self.capacity = capacity
+        self.chunk_size = chunk_size
+        self.wet = torch.zeros(capacity, 1, chunk_size).share_memory_()
+        self.dry = torch.zeros(capacity, 1, chunk_size).share_memory_()
+        self.labels = torch.zeros(capacity, 2, num_effects).share_memory_()
+        self.free = ctx.Queue()
+        self.ready = ctx.Queue()
+        for slot in range(capacity):
+            self.free.put(slot)
+        self.produced = ctx.Value("q", 0)
+        self.consumed = ctx.Value("q", 0)
+        self.starved = ctx.Value("q", 0)
+        self.wait_seconds = ctx.Value("d", 0.0)
+
+    def put(self, slot: int, item: Tuple[torch.Tensor, ...]) -> None:
+        wet, dry, dry_labels, wet_labels = item
+        self.wet[slot] = fix_length(wet, self.chunk_size)
+        self.dry[slot] = fix_length(dry, self.chunk_size)
+        self.labels[slot, 0] = dry_labels
+        self.labels[slot, 1] = wet_labels
+        with self.produced.get_lock():
+            self.produced.value += 1
+        self.ready.put(slot)
+
+    def get(self, timeout: float = None) -> Tuple[torch.Tensor, ...]:
+        starved = self.depth() == 0
+        start = time.perf_counter()
+        slot = self.ready.get(timeout=timeout)
+        item = (
+            self.wet[slot].clone(),
+            self.dry[slot].clone(),
+            self.labels[slot, 0].clone(),
+            self.labels[slot, 1].clone(),
+        )
+        with self.consumed.get_lock():
+            self.consumed.value += 1
+        self.free.put(slot)
+        with self.wait_seconds.get_lock():
+            self.wait_seconds.value += time.perf_counter() - start
+        if starved:
+            with self.starved.get_lock():
+                self.starved.value += 1
+        return item
+
+    def depth(self) -> int:
+        """Examples produced and not yet consumed."""
+        return self.produced.value - self.consumed.value
+
+
+def _produce(dataset: Dataset, buffer: SharedRingBuffer, seed: int) -> None:
+    # Each producer draws its own examples
+    torch.set_num_threads(1)
+    torch.manual_seed(seed)
+    np.random.seed(seed % 2**32)
+    random.seed(seed)
+    while True:
+        slot = buffer.free.get()
+        if slot is None:
+            return
+        buffer.put(slot, dataset[0])
+
+
+class ProducerPoolDataset(Dataset):
+    """Examples of a DynamicEffectDataset rendered by a pool of producer
+    processes, independently of the DataLoader workers. Producers fill a
+    SharedRingBuffer of capacity examples and items are taken from it in
+    the order they were produced, so indices are ignored.
+    """
+
+    def __init__(
+        self,
+        dataset: Dataset,
+        num_producers: int = 4,
+        capacity: int = 64,
+        timeout: float = 600.0,
+        seed: int = None,
+        **kwargs,
+    ) -> None:
+        # Options of the dataset config this replaces are accepted and ignored
+        super().__init__()
+        if getattr(dataset, "batched_effects", False):
+            raise ValueError("ProducerPoolDataset needs batched_effects=False")
+        if num_producers < 1:
+            raise ValueError(f"num_producers must be at least 1. Got {num_producers}")
+        self.dataset = dataset
+        self.num_producers = num_producers
+        self.timeout = timeout
+        seed = torch.initial_seed() if seed is None else seed
+        ctx = multiprocessing.get_context()
+        self.buffer = SharedRingBuffer(
+            capacity, dataset.chunk_size, len(Pedalboard_Effects), ctx
+        )
+        self.producers = [
+            ctx.Process(
+                target=_produce, args=(dataset, self.buffer, seed + i), daemon=True
+            )
+            for i in range(num_producers)
+        ]
+        for producer in self.producers:
+            producer.start()
+        print(f"Started {num_producers} producers with {capacity} slots")
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, _: int):
+        try:
+            return self.buffer.get(self.timeout)
+        except queue.Empty as e:
+            raise RuntimeError(
+                f"No example produced in {self.timeout}s, are the producers alive?"
+            ) from e
+
+    def metrics(self) -> Dict[str, float]:
+        """Producer count, queue depth and consumer starvation so far."""
+        return {
+            "producers": self.num_producers,
+            "producers_alive": sum(p.is_alive() for p in self.producers),
+            "queue_depth": self.buffer.depth(),
+            "queue_capacity": self.buffer.capacity,
+            "produced": self.buffer.produced.value,
+            "consumed": self.buffer.consumed.value,
+            "starved": self.buffer.starved.value,
+            "wait_seconds": self.buffer.wait_seconds.value,
+        }
+
+    def close(self) -> None:
+        """Stop the producers. Called by EffectDatamodule.teardown."""
+        for _ in self.producers:
+            self.buffer.free.put(None)
+        for producer in self.producers:
+            producer.join(timeout=10)
+            if producer.is_alive():
+                producer.terminate()
+        self.producers = []
+
+    def __getstate__(self):
+        # Processes stay with their parent, DataLoader workers only consume
+        state = self.__dict__.copy()
+        state["producers"] = []
+        return state
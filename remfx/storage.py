@@ -0,0 +1,470 @@
+import os
+import json
+import shutil
+import torch
+import torchaudio
+import numpy as np
+from pathlib import Path
+from typing import Iterable, List, Set, Tuple
+
+LAYOUTS = ["dir", "packed"]
+COMPLETED_LOG = "completed.txt"
+# Sample formats of stored audio. Integer formats clip at full scale
+AUDIO_FORMATS = ["float32", "float16", "int16", "flac"]
+# Formats each layout can store: shards must be fixed-size and memory-mapped,
+# while WAV and FLAC files cannot hold float16
+LAYOUT_FORMATS = {
+    "dir": ["float32", "int16", "flac"],
+    "packed": ["float32", "float16", "int16"],
+}
+INT16_SCALE = 32767
+
+
+def fix_length(x: torch.Tensor, length: int) -> torch.Tensor:
+    """Pad or trim the last dimension to length."""
+    if x.shape[-1] > length:
+        return x[..., :length]
+    if x.shape[-1] < length:
+        return torch.nn.functional.pad(x, (0, length - x.shape[-1]))
+    return x
+
+
+class ChunkStore:
+    """Common bookkeeping of rendered chunk stores.
+    Indices of fully written chunks are appended to completed.txt, so an
+    interrupted render can be resumed by rendering only the missing ones.
+    Stores can also hold the stages of a chunk's removed effect chain: the
+    label of each removed effect in order, and the audio after each of them
+    but the last, which is the input.
+    """
+
+    proc_root: Path
+
+    @property
+    def log_path(self) -> Path:
+        return self.proc_root / COMPLETED_LOG
+
+    def _completed_without_log(self) -> Set[int]:
+        # Without a log nothing is known to be complete
+        return set()
+
+    def completed(self) -> Set[int]:
+        if not self.log_path.exists():
+            return self._completed_without_log()
+        with open(self.log_path) as f:
+            # A crash may leave a partial last line
+            return {int(line) for line in f if line.strip().isdigit()}
+
+    def mark_completed(self, indices: Iterable[int]) -> None:
+        with open(self.log_path, "a") as f:
+            f.writelines(f"{idx}\n" for idx in indices)
+
+    def chunk_indices(self) -> List[int]:
+        """Sorted indices of the completed chunks, which may have gaps if a
+        render was interrupted.
+        """
+        indices = sorted(self.completed())
+        if indices != list(range(len(indices))):
+            print(
+                f"WARNING: {self.proc_root} is incomplete. Using its "
+                f"{len(indices)} completed chunks. "
+                "Set render_files=True to render the missing chunks."
+            )
+        return indices
+
+
+class ChunkDirStore(ChunkStore):
+    """One directory per chunk holding input.wav, target.wav,
+    dry_effects.pt and wet_effects.pt. Stages are stored as
+    stage_effects.pt and stage_0.wav, stage_1.wav, ...
+    """
+
+    layout = "dir"
+
+    def __init__(self, proc_root: str, sample_rate: int, audio_format: str = "float32"):
+        self.proc_root = Path(proc_root)
+        self.sample_rate = sample_rate
+        self.audio_format = audio_format
+        # int16 is 16-bit PCM WAV, flac 16-bit FLAC
+        self.ext = "flac" if audio_format == "flac" else "wav"
+        self.save_kwargs = {}
+        if audio_format == "int16":
+            self.save_kwargs = {"encoding": "PCM_S", "bits_per_sample": 16}
+        elif audio_format == "flac":
+            self.save_kwargs = {"format": "flac", "bits_per_sample": 16}
+        self.files = [
+            f"input.{self.ext}",
+            f"target.{self.ext}",
+            "dry_effects.pt",
+            "wet_effects.pt",
+        ]
+
+    def save(self, path: Path, audio: torch.Tensor) -> None:
+        torchaudio.save(path, audio, self.sample_rate, **self.save_kwargs)
+
+    def allocate(self, num_chunks: int) -> None:
+        self.proc_root.mkdir(parents=True, exist_ok=True)
+        if not self.log_path.exists():
+            # Renders from before the log existed
+            self.mark_completed(sorted(self._completed_without_log()))
+
+    def _completed_without_log(self) -> Set[int]:
+        if not self.proc_root.exists():
+            return set()
+        return {
+            int(p.name)
+            for p in self.proc_root.iterdir()
+            if p.name.isdigit() and all((p / f).exists() for f in self.files)
+        }
+
+    def write(
+        self,
+        idx: int,
+        wet: torch.Tensor,
+        dry: torch.Tensor,
+        dry_labels: torch.Tensor,
+        wet_labels: torch.Tensor,
+        stages: List[Tuple[int, torch.Tensor]] = None,
+    ) -> None:
+        output_dir = self.proc_root / str(idx)
+        output_dir.mkdir(exist_ok=True)
+        self.save(output_dir / f"input.{self.ext}", wet)
+        self.save(output_dir / f"target.{self.ext}", dry)
+        torch.save(dry_labels, output_dir / "dry_effects.pt")
+        torch.save(wet_labels, output_dir / "wet_effects.pt")
+        if stages is not None:
+            for step, (_, audio) in enumerate(stages[:-1]):
+                self.save(output_dir / f"stage_{step}.{self.ext}", audio)
+            stage_effects = torch.tensor([label for label, _ in stages])
+            torch.save(stage_effects, output_dir / "stage_effects.pt")
+
+    def read(self, idx: int) -> Tuple[torch.Tensor, ...]:
+        input_file = self.proc_root / str(idx) / f"input.{self.ext}"
+        target_file = self.proc_root / str(idx) / f"target.{self.ext}"
+        dry_effect_names = torch.load(self.proc_root / str(idx) / "dry_effects.pt")
+        wet_effect_names = torch.load(self.proc_root / str(idx) / "wet_effects.pt")
+        input, sr = torchaudio.load(input_file)
+        target, sr = torchaudio.load(target_file)
+        return (input, target, dry_effect_names, wet_effect_names)
+
+    def stage_effects(self, idx: int) -> List[int]:
+        path = self.proc_root / str(idx) / "stage_effects.pt"
+        return torch.load(path).tolist() if path.exists() else []
+
+    def merge(self, src: "ChunkDirStore", indices: List[int]) -> None:
+        """Move the completed chunks indices of src into this store."""
+        if src.audio_format != self.audio_format:
+            raise ValueError(f"Cannot merge {src.proc_root} into {self.proc_root}")
+        self.proc_root.mkdir(parents=True, exist_ok=True)
+        for idx in indices:
+            output_dir = self.proc_root / str(idx)
+            if output_dir.exists():
+                shutil.rmtree(output_dir)
+            os.replace(src.proc_root / str(idx), output_dir)
+        self.mark_completed(indices)
+
+    def read_stage(self, idx: int, step: int) -> Tuple[torch.Tensor, ...]:
+        """Audio after and before the step-th removed effect, and the
+        dry labels of the chunk.
+        """
+        chunk_dir = self.proc_root / str(idx)
+        num_steps = len(self.stage_effects(idx))
+        after = "input" if step == num_steps - 1 else f"stage_{step}"
+        before = "target" if step == 0 else f"stage_{step - 1}"
+        after = f"{after}.{self.ext}"
+        before = f"{before}.{self.ext}"
+        after, sr = torchaudio.load(chunk_dir / after)
+        before, sr = torchaudio.load(chunk_dir / before)
+        return after, before, torch.load(chunk_dir / "dry_effects.pt")
+
+
+class PackedChunkStore(ChunkStore):
+    """Fixed-size memory-mapped shards of shard_size chunks.
+    Input and target audio live in shard_XXXXX.input.f32 and
+    shard_XXXXX.target.f32, each of shape (shard_size, 1, chunk_size).
+    Dry and wet labels of all chunks live in a single labels.npy matrix of
+    shape (num_chunks, 2, num_effects). Reads are slices of the maps, so
+    no file is opened per sample. With num_stages > 0, stage audio lives
+    in shard_XXXXX.stage0.f32, ... and stage labels in stage_effects.npy of
+    shape (num_chunks, num_stages + 1), padded with -1. With audio_format
+    float16 or int16, shards hold that type instead (.f16, .i16) and are
+    decoded to float32 on read.
+    """
+
+    layout = "packed"
+
+    def __init__(
+        self,
+        proc_root: str,
+        sample_rate: int,
+        chunk_size: int = None,
+        num_effects: int = None,
+        shard_size: int = 1000,
+        num_stages: int = 0,
+        audio_format: str = "float32",
+    ):
+        self.proc_root = Path(proc_root)
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.num_effects = num_effects
+        self.shard_size = shard_size
+        self.num_stages = num_stages
+        self.audio_format = audio_format
+        self.capacity = 0
+        if self.meta_path.exists():
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            self.chunk_size = meta["chunk_size"]
+            self.num_effects = meta["num_effects"]
+            self.shard_size = meta["shard_size"]
+            self.num_stages = meta.get("num_stages", 0)
+            self.audio_format = meta.get("audio_format", "float32")
+            self.capacity = meta["num_chunks"]
+        self._maps = {}
+
+    @property
+    def meta_path(self) -> Path:
+        return self.proc_root / "meta.json"
+
+    @staticmethod
+    def exists(proc_root: str) -> bool:
+        return (Path(proc_root) / "meta.json").exists()
+
+    def __getstate__(self):
+        # Each process opens its own maps
+        state = self.__dict__.copy()
+        state["_maps"] = {}
+        return state
+
+    @property
+    def dtype(self) -> type:
+        return {"float32": np.float32, "float16": np.float16, "int16": np.int16}[
+            self.audio_format
+        ]
+
+    def _shard_path(self, shard: int, kind: str) -> Path:
+        suffix = {"float32": "f32", "float16": "f16", "int16": "i16"}[self.audio_format]
+        return self.proc_root / f"shard_{shard:05d}.{kind}.{suffix}"
+
+    def encode(self, x: torch.Tensor) -> np.ndarray:
+        x = fix_length(x, self.chunk_size).numpy()
+        if self.audio_format == "int16":
+            x = np.clip(np.round(x * INT16_SCALE), -INT16_SCALE - 1, INT16_SCALE)
+        return x.astype(self.dtype)
+
+    def decode(self, x: np.ndarray) -> torch.Tensor:
+        if self.audio_format == "float32":
+            # Rows of copy-on-write maps are writable without copying
+            return torch.from_numpy(x)
+        if self.audio_format == "int16":
+            return torch.from_numpy(x.astype(np.float32) / INT16_SCALE)
+        return torch.from_numpy(x.astype(np.float32))
+
+    def _shard_shape(self) -> Tuple[int, int, int]:
+        return (self.shard_size, 1, self.chunk_size)
+
+    def allocate(self, num_chunks: int) -> None:
+        """Create shard files and the label matrix for num_chunks chunks.
+        Existing chunks are kept, so a render can grow. Must run in one
+        process before any worker writes.
+        """
+        self.proc_root.mkdir(parents=True, exist_ok=True)
+        num_chunks = max(num_chunks, self.capacity)
+        num_shards = -(-num_chunks // self.shard_size)
+        itemsize = np.dtype(self.dtype).itemsize
+        shard_bytes = int(np.prod(self._shard_shape())) * itemsize
+        kinds = ["input", "target"] + [f"stage{k}" for k in range(self.num_stages)]
+        for shard in range(num_shards):
+            for kind in kinds:
+                path = self._shard_path(shard, kind)
+                if not path.exists():
+                    # Sparse file, zero-filled on read
+                    with open(path, "wb") as f:
+                        f.truncate(shard_bytes)
+        self._grow_npy("labels.npy", (num_chunks, 2, self.num_effects), np.float32)
+        if self.num_stages > 0:
+            self._grow_npy(
+                "stage_effects.npy", (num_chunks, self.num_stages + 1), np.int8, -1
+            )
+        self.capacity = num_chunks
+        self._maps = {}
+        with open(self.meta_path, "w") as f:
+            json.dump(
+                {
+                    "layout": self.layout,
+                    "chunk_size": self.chunk_size,
+                    "num_effects": self.num_effects,
+                    "shard_size": self.shard_size,
+                    "num_stages": self.num_stages,
+                    "audio_format": self.audio_format,
+                    "num_chunks": num_chunks,
+                },
+                f,
+            )
+
+    def _grow_npy(self, name: str, shape: Tuple[int, ...], dtype, fill=0) -> None:
+        """Create the npy matrix name with shape, keeping existing rows."""
+        path = self.proc_root / name
+        if shape[0] <= self.capacity and path.exists():
+            return
+        old = np.load(path) if path.exists() and self.capacity > 0 else None
+        matrix = np.lib.format.open_memmap(
+            path.with_suffix(".tmp.npy"), mode="w+", dtype=dtype, shape=shape
+        )
+        matrix[:] = fill
+        if old is not None:
+            matrix[: len(old)] = old
+        matrix.flush()
+        del matrix
+        os.replace(path.with_suffix(".tmp.npy"), path)
+
+    def _map(self, key, mode: str) -> np.ndarray:
+        if key not in self._maps:
+            if key in ["labels", "stage_effects"]:
+                self._maps[key] = np.load(self.proc_root / f"{key}.npy", mmap_mode=mode)
+            else:
+                shard, kind = key
+                self._maps[key] = np.memmap(
+                    self._shard_path(shard, kind),
+                    dtype=self.dtype,
+                    mode=mode,
+                    shape=self._shard_shape(),
+                )
+        return self._maps[key]
+
+    def write(
+        self,
+        idx: int,
+        wet: torch.Tensor,
+        dry: torch.Tensor,
+        dry_labels: torch.Tensor,
+        wet_labels: torch.Tensor,
+        stages: List[Tuple[int, torch.Tensor]] = None,
+    ) -> None:
+        shard, row = divmod(idx, self.shard_size)
+        inputs = self._map((shard, "input"), "r+")
+        targets = self._map((shard, "target"), "r+")
+        labels = self._map("labels", "r+")
+        inputs[row] = self.encode(wet)
+        targets[row] = self.encode(dry)
+        labels[idx, 0] = dry_labels.numpy()
+        labels[idx, 1] = wet_labels.numpy()
+        inputs.flush()
+        targets.flush()
+        labels.flush()
+        if stages is not None and self.num_stages > 0:
+            for step, (_, audio) in enumerate(stages[:-1]):
+                stage = self._map((shard, f"stage{step}"), "r+")
+                stage[row] = self.encode(audio)
+                stage.flush()
+            stage_effects = self._map("stage_effects", "r+")
+            stage_effects[idx] = -1
+            stage_effects[idx, : len(stages)] = [label for label, _ in stages]
+            stage_effects.flush()
+
+    def read(self, idx: int) -> Tuple[torch.Tensor, ...]:
+        shard, row = divmod(idx, self.shard_size)
+        input = self.decode(self._map((shard, "input"), "c")[row])
+        target = self.decode(self._map((shard, "target"), "c")[row])
+        labels = self._map("labels", "c")
+        dry_effect_names = torch.from_numpy(labels[idx, 0])
+        wet_effect_names = torch.from_numpy(labels[idx, 1])
+        return (input, target, dry_effect_names, wet_effect_names)
+
+    def stage_effects(self, idx: int) -> List[int]:
+        if self.num_stages == 0:
+            return []
+        stage_effects = self._map("stage_effects", "r")[idx]
+        return [int(label) for label in stage_effects if label >= 0]
+
+    def merge(self, src: "PackedChunkStore", indices: List[int]) -> None:
+        """Move the completed chunks indices of src, which holds them at the
+        same index, into this store. Shards whose rows are all merged are
+        moved as files, other rows are copied. Must run in one process,
+        after allocate.
+        """
+        if (
+            src.audio_format != self.audio_format
+            or src.shard_size != self.shard_size
+            or src.chunk_size != self.chunk_size
+            or src.num_stages != self.num_stages
+        ):
+            raise ValueError(f"Cannot merge {src.proc_root} into {self.proc_root}")
+        kinds = ["input", "target"] + [f"stage{k}" for k in range(self.num_stages)]
+        shards = {}
+        for idx in indices:
+            shards.setdefault(idx // self.shard_size, []).append(idx)
+        self._maps = {}
+        for shard, shard_indices in shards.items():
+            num_rows = min(self.shard_size, self.capacity - shard * self.shard_size)
+            if len(set(shard_indices)) == num_rows:
+                for kind in kinds:
+                    os.replace(
+                        src._shard_path(shard, kind), self._shard_path(shard, kind)
+                    )
+                continue
+            for kind in kinds:
+                rows = [idx - shard * self.shard_size for idx in shard_indices]
+                dst_map = self._map((shard, kind), "r+")
+                dst_map[rows] = src._map((shard, kind), "r")[rows]
+                dst_map.flush()
+        self._maps = {}
+        for key in ["labels"] + (["stage_effects"] if self.num_stages > 0 else []):
+            dst_map = self._map(key, "r+")
+            dst_map[indices] = src._map(key, "r")[indices]
+            dst_map.flush()
+        self._maps = {}
+        self.mark_completed(indices)
+
+    def read_stage(self, idx: int, step: int) -> Tuple[torch.Tensor, ...]:
+        """Audio after and before the step-th removed effect, and the
+        dry labels of the chunk.
+        """
+        shard, row = divmod(idx, self.shard_size)
+        num_steps = len(self.stage_effects(idx))
+        after = "input" if step == num_steps - 1 else f"stage{step}"
+        before = "target" if step == 0 else f"stage{step - 1}"
+        after = self.decode(self._map((shard, after), "c")[row])
+        before = self.decode(self._map((shard, before), "c")[row])
+        dry_labels = torch.from_numpy(self._map("labels", "c")[idx, 0])
+        return after, before, dry_labels
+
+
+def open_store(
+    proc_root: str,
+    sample_rate: int,
+    chunk_size: int,
+    num_effects: int,
+    layout: str = "dir",
+    shard_size: int = 1000,
+    num_stages: int = 0,
+    audio_format: str = "float32",
+):
+    """Open the chunk store at proc_root.
+    An existing packed store is detected from its meta.json, along with
+    its audio format.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout {layout}. Please choose from {LAYOUTS}")
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(
+            f"Unknown audio_format {audio_format}. Please choose from {AUDIO_FORMATS}"
+        )
+    if PackedChunkStore.exists(proc_root):
+        layout = "packed"
+    if audio_format not in LAYOUT_FORMATS[layout]:
+        raise ValueError(
+            f"The {layout} layout cannot store {audio_format} audio. "
+            f"Please choose from {LAYOUT_FORMATS[layout]}"
+        )
+    if layout == "packed":
+        return PackedChunkStore(
+            proc_root,
+            sample_rate,
+            chunk_size,
+            num_effects,
+            shard_size,
+            num_stages,
+            audio_format,
+        )
+    return ChunkDirStore(proc_root, sample_rate, audio_format)
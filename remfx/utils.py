@@ -1,5 +1,6 @@
+import os
 import logging
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 import pytorch_lightning as pl
 from omegaconf import DictConfig
 from pytorch_lightning.utilities import rank_zero_only
@@ -33,6 +34,14 @@ def get_logger(name=__name__) -> logging.Logger:
 log = get_logger(__name__)
 
 
+def available_cpus() -> int:
+    """Number of cores this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
 @rank_zero_only
 def log_hyperparameters(
     config: DictConfig,
@@ -117,17 +126,63 @@ def create_sequential_chunks(
     return chunks
 
 
+# Per-process cache of (num_frames, sample_rate, num_channels) keyed by path
+_audio_info_cache: Dict[str, Tuple[int, int, int]] = {}
+
+
+def get_audio_info(audio_file: str) -> Tuple[int, int, int]:
+    """Return (num_frames, sample_rate, num_channels) of an audio file.
+    Only the header is read, and the result is cached per path.
+    """
+    audio_file = str(audio_file)
+    if audio_file not in _audio_info_cache:
+        info = torchaudio.info(audio_file)
+        _audio_info_cache[audio_file] = (
+            info.num_frames,
+            info.sample_rate,
+            info.num_channels,
+        )
+    return _audio_info_cache[audio_file]
+
+
+def register_audio_info(
+    audio_file: str, num_frames: int, sample_rate: int, num_channels: int
+) -> None:
+    """Seed the audio info cache, e.g. from a corpus manifest."""
+    _audio_info_cache[str(audio_file)] = (num_frames, sample_rate, num_channels)
+
+
 def select_random_chunk(
     audio_file: str, chunk_size: int, sample_rate: int
 ) -> List[torch.Tensor]:
-    """Select random chunk of size chunk_size (samples) from an audio file."""
-    audio, sr = torchaudio.load(audio_file)
+    """Select random chunk of size chunk_size (samples) from an audio file.
+    The offset is chosen from the cached file length, so only the frames of
+    the chunk itself are decoded.
+    """
+    num_frames, sr, _ = get_audio_info(audio_file)
     new_chunk_size = int(chunk_size * (sr / sample_rate))
-    if new_chunk_size >= audio.shape[-1]:
+    if new_chunk_size >= num_frames:
         return None
-    max_len = audio.shape[-1] - new_chunk_size
+    max_len = num_frames - new_chunk_size
     random_start = torch.randint(0, max_len, (1,)).item()
-    chunk = audio[:, random_start : random_start + new_chunk_size]
+    chunk, sr = torchaudio.load(
+        audio_file, frame_offset=random_start, num_frames=new_chunk_size
+    )
+    return slice_chunk(chunk, sr, 0, chunk_size, sample_rate)
+
+
+def slice_chunk(
+    audio: torch.Tensor, sr: int, start: int, chunk_size: int, sample_rate: int
+) -> torch.Tensor:
+    """Chunk of size chunk_size (samples at sample_rate) starting at frame
+    start of audio (at sr), resampled to sample_rate.
+    Returns None if audio is too short or the chunk is silent.
+    """
+    new_chunk_size = int(chunk_size * (sr / sample_rate))
+    chunk = audio[:, start : start + new_chunk_size]
+    # Header may overestimate the length (e.g. truncated files)
+    if chunk.shape[-1] < new_chunk_size:
+        return None
     # Skip if energy too low
     if torch.mean(torch.abs(chunk)) < 1e-4:
         return None
@@ -0,0 +1,83 @@
+import os
+import time
+import argparse
+import tempfile
+import torch
+import torchaudio
+from remfx.utils import select_random_chunk
+
+
+def select_random_chunk_full_decode(
+    audio_file: str, chunk_size: int, sample_rate: int
+) -> torch.Tensor:
+    """Previous implementation: decode the whole file, then slice."""
+    audio, sr = torchaudio.load(audio_file)
+    new_chunk_size = int(chunk_size * (sr / sample_rate))
+    if new_chunk_size >= audio.shape[-1]:
+        return None
+    max_len = audio.shape[-1] - new_chunk_size
+    random_start = torch.randint(0, max_len, (1,)).item()
+    chunk = audio[:, random_start : random_start + new_chunk_size]
+    if torch.mean(torch.abs(chunk)) < 1e-4:
+        return None
+    return torchaudio.functional.resample(chunk, sr, sample_rate)
+
+
+def make_long_files(output_dir: str, num_files: int, seconds: float, sr: int):
+    files = []
+    for i in range(num_files):
+        audio = 0.1 * torch.randn(2, int(seconds * sr))
+        path = os.path.join(output_dir, f"long_{i}.wav")
+        torchaudio.save(path, audio, sr)
+        files.append(path)
+    return files
+
+
+def benchmark(fn, files, chunk_size, sample_rate, num_draws):
+    torch.manual_seed(0)
+    start = time.perf_counter()
+    for i in range(num_draws):
+        fn(files[i % len(files)], chunk_size, sample_rate)
+    return (time.perf_counter() - start) / num_draws
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare full-file decoding against seek-based chunk reads."
+    )
+    parser.add_argument("files", nargs="*", help="Audio files to read from.")
+    parser.add_argument("--num_files", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=240.0)
+    parser.add_argument("--file_sample_rate", type=int, default=44100)
+    parser.add_argument("--sample_rate", type=int, default=48000)
+    parser.add_argument("--chunk_size", type=int, default=262144)
+    parser.add_argument("--num_draws", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = args.files
+        if not files:
+            print(
+                f"Writing {args.num_files} synthetic files of {args.seconds}s "
+                f"at {args.file_sample_rate} Hz..."
+            )
+            files = make_long_files(
+                tmp_dir, args.num_files, args.seconds, args.file_sample_rate
+            )
+        full = benchmark(
+            select_random_chunk_full_decode,
+            files,
+            args.chunk_size,
+            args.sample_rate,
+            args.num_draws,
+        )
+        seek = benchmark(
+            select_random_chunk,
+            files,
+            args.chunk_size,
+            args.sample_rate,
+            args.num_draws,
+        )
+    print(f"Full decode: {1000 * full:.1f} ms/chunk")
+    print(f"Seek read:   {1000 * seek:.1f} ms/chunk")
+    print(f"Speedup:     {full / seek:.1f}x")
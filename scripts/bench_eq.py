@@ -0,0 +1,100 @@
+import time
+import argparse
+import torch
+import numpy as np
+import scipy.signal
+from remfx.effects import RandomParametricEQ, biqaud, parametric_eq, rand, loguniform
+
+
+def parametric_eq_per_band(
+    x: np.ndarray,
+    sample_rate: float,
+    low_shelf_gain_db: float,
+    low_shelf_cutoff_freq: float,
+    low_shelf_q_factor: float,
+    band_gains_db: list,
+    band_cutoff_freqs: list,
+    band_q_factors: list,
+    high_shelf_gain_db: float,
+    high_shelf_cutoff_freq: float,
+    high_shelf_q_factor: float,
+):
+    """Previous implementation: one design and one lfilter pass per band."""
+    b, a = biqaud(
+        low_shelf_gain_db,
+        low_shelf_cutoff_freq,
+        low_shelf_q_factor,
+        sample_rate,
+        "low_shelf",
+    )
+    x = scipy.signal.lfilter(b, a, x)
+    for gain_db, cutoff_freq, q_factor in zip(
+        band_gains_db, band_cutoff_freqs, band_q_factors
+    ):
+        b, a = biqaud(gain_db, cutoff_freq, q_factor, sample_rate, "peaking")
+        x = scipy.signal.lfilter(b, a, x)
+    b, a = biqaud(
+        high_shelf_gain_db,
+        high_shelf_cutoff_freq,
+        high_shelf_q_factor,
+        sample_rate,
+        "high_shelf",
+    )
+    x = scipy.signal.lfilter(b, a, x)
+    return x.astype(np.float32)
+
+
+def random_settings(eq: RandomParametricEQ) -> dict:
+    return {
+        "low_shelf_gain_db": rand(eq.min_gain_db, eq.max_gain_db),
+        "low_shelf_cutoff_freq": loguniform(20.0, 200.0),
+        "low_shelf_q_factor": rand(eq.min_q_factor, eq.max_q_factor),
+        "band_gains_db": [rand(eq.min_gain_db, eq.max_gain_db)] * eq.num_bands,
+        "band_cutoff_freqs": [loguniform(eq.min_cutoff_freq, eq.max_cutoff_freq)]
+        * eq.num_bands,
+        "band_q_factors": [rand(eq.min_q_factor, eq.max_q_factor)] * eq.num_bands,
+        "high_shelf_gain_db": rand(eq.min_gain_db, eq.max_gain_db),
+        "high_shelf_cutoff_freq": loguniform(8000.0, 16000.0),
+        "high_shelf_q_factor": rand(eq.min_q_factor, eq.max_q_factor),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the per-band EQ against the batched SOS cascade."
+    )
+    parser.add_argument("--sample_rate", type=int, default=48000)
+    parser.add_argument("--chunk_size", type=int, default=262144)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--num_channels", type=int, default=2)
+    parser.add_argument("--num_repeats", type=int, default=3)
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+    torch.manual_seed(0)
+    np.random.seed(0)
+
+    eq = RandomParametricEQ(args.sample_rate)
+    x = 0.1 * torch.randn(args.batch_size, args.num_channels, args.chunk_size)
+
+    max_diff = 0.0
+    for item in x:
+        settings = random_settings(eq)
+        reference = parametric_eq_per_band(item.numpy(), args.sample_rate, **settings)
+        cascade = parametric_eq(item.numpy(), args.sample_rate, **settings)
+        max_diff = max(max_diff, float(np.abs(reference - cascade).max()))
+    print(f"Max difference to per-band lfilter: {max_diff:.2e}")
+
+    # Compile before timing
+    eq(x[:1])
+    start = time.perf_counter()
+    for _ in range(args.num_repeats):
+        for item in x:
+            parametric_eq_per_band(item.numpy(), args.sample_rate, **settings)
+    per_band = (time.perf_counter() - start) / (args.num_repeats * args.batch_size)
+    start = time.perf_counter()
+    for _ in range(args.num_repeats):
+        eq(x)
+    batched = (time.perf_counter() - start) / (args.num_repeats * args.batch_size)
+    print(f"Per-band lfilter: {1000 * per_band:.1f} ms/example")
+    print(f"Batched cascade:  {1000 * batched:.1f} ms/example")
+    print(f"Speedup:          {per_band / batched:.1f}x")
@@ -0,0 +1,76 @@
+import time
+import argparse
+import torch
+import numpy as np
+from auraloss.freq import MultiResolutionSTFTLoss
+from remfx import effects
+from remfx.datasets import STFT_THRESH
+from remfx.gate import SpectralGate
+
+
+def make_pairs(num_pairs: int, sample_rate: int, chunk_size: int):
+    """Normalized (dry, wet) pairs: wet is a random effect of dry, a tiny
+    perturbation of it, or dry itself.
+    """
+    normalize = effects.LoudnessNormalize(sample_rate, target_lufs_db=-20)
+    modules = [
+        effects.RandomPedalboardDistortion(sample_rate),
+        effects.RandomPedalboardCompressor(sample_rate),
+        effects.RandomPedalboardReverb(sample_rate),
+        effects.RandomPedalboardChorus(sample_rate),
+        effects.RandomPedalboardDelay(sample_rate),
+    ]
+    pairs = []
+    for i in range(num_pairs):
+        dry = normalize(0.1 * torch.randn(1, chunk_size))
+        if i % 7 == 0:
+            wet = dry.clone()
+        elif i % 7 == 1:
+            wet = dry + 1e-4 * torch.randn_like(dry) * dry.abs().max()
+        else:
+            wet = normalize(modules[i % len(modules)](dry))
+        pairs.append((dry, wet))
+    return pairs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the SpectralGate decisions and time against the MRSTFT."
+    )
+    parser.add_argument("--sample_rate", type=int, default=48000)
+    parser.add_argument("--chunk_size", type=int, default=262144)
+    parser.add_argument("--num_pairs", type=int, default=35)
+    parser.add_argument("--retries", type=int, default=3)
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+    torch.manual_seed(0)
+    np.random.seed(0)
+
+    mrstft = MultiResolutionSTFTLoss(sample_rate=args.sample_rate)
+    gate = SpectralGate(mrstft, STFT_THRESH)
+    pairs = make_pairs(args.num_pairs, args.sample_rate, args.chunk_size)
+
+    # Each dry signal is checked against several wet draws, as on retries
+    start = time.perf_counter()
+    expected = []
+    for dry, wet in pairs:
+        for _ in range(args.retries):
+            loss = mrstft(wet.unsqueeze(0), dry.unsqueeze(0))
+            expected.append(bool(loss >= STFT_THRESH))
+    mrstft_time = time.perf_counter() - start
+    start = time.perf_counter()
+    decisions = []
+    for dry, wet in pairs:
+        reference = gate.reference(dry)
+        for _ in range(args.retries):
+            decisions.append(gate.passes(wet, reference))
+    gate_time = time.perf_counter() - start
+
+    mismatches = sum(a != b for a, b in zip(expected, decisions))
+    print(f"Decisions differing from the MRSTFT: {mismatches} of {len(expected)}")
+    assert mismatches == 0
+    print(gate.summary())
+    n = len(expected)
+    print(f"MRSTFT:        {1000 * mrstft_time / n:.1f} ms/check")
+    print(f"SpectralGate:  {1000 * gate_time / n:.1f} ms/check")
+    print(f"Speedup:       {mrstft_time / gate_time:.1f}x")
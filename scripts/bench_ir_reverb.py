@@ -0,0 +1,88 @@
+import time
+import argparse
+import tempfile
+import torch
+import numpy as np
+from remfx.effects import RandomPedalboardReverb
+from remfx.batched_effects import BatchedReverb
+from remfx.ir_reverb import ConvolutionReverb
+
+
+def benchmark(fn, num_repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(num_repeats):
+        fn()
+    return (time.perf_counter() - start) / num_repeats
+
+
+def relative_error(y: torch.Tensor, reference: torch.Tensor) -> float:
+    return float((y - reference).pow(2).sum() / reference.pow(2).sum())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the IR bank convolution reverb against Freeverb."
+    )
+    parser.add_argument("--sample_rate", type=int, default=48000)
+    parser.add_argument("--chunk_size", type=int, default=262144)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--num_repeats", type=int, default=3)
+    parser.add_argument("--bank_root", type=str, default=None)
+    parser.add_argument("--block_size", type=int, default=65536)
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+    torch.manual_seed(0)
+    np.random.seed(0)
+    bank_root = tempfile.mkdtemp() if args.bank_root is None else args.bank_root
+
+    ranges = dict(min_room_size=0.3, min_damping=0.2, min_wet_dry=0.2, min_width=0.2)
+    pedalboard = RandomPedalboardReverb(args.sample_rate, **ranges)
+    freeverb = BatchedReverb(args.sample_rate, **ranges)
+    conv = ConvolutionReverb(
+        args.sample_rate, **ranges, bank_root=bank_root, block_size=args.block_size
+    )
+    nearest = ConvolutionReverb(
+        args.sample_rate,
+        **ranges,
+        bank_root=bank_root,
+        block_size=args.block_size,
+        interpolate=False,
+    )
+    start = time.perf_counter()
+    conv.bank
+    print(f"Bank ready in {time.perf_counter() - start:.2f}s")
+
+    n = args.batch_size
+    x = 0.1 * torch.randn(n, 1, args.chunk_size)
+    grid = {
+        "room_size": conv.bank["room_sizes"][
+            np.arange(n) % len(conv.bank["room_sizes"])
+        ],
+        "damping": conv.bank["dampings"][
+            (3 * np.arange(n)) % len(conv.bank["dampings"])
+        ],
+        "wet_dry": np.full(n, 0.4),
+        "width": np.full(n, 0.7),
+    }
+    reference = freeverb.process(x, **grid)
+    y = conv.process(x, pre_delay_ms=np.zeros(n), **grid)
+    print(f"Relative error at grid points:       {relative_error(y, reference):.2e}")
+    params = conv.sample_params(n)
+    params["pre_delay_ms"][:] = 0
+    y = conv.process(x, **params)
+    reference = freeverb.process(
+        x, **{k: v for k, v in params.items() if k != "pre_delay_ms"}
+    )
+    print(f"Relative error between grid points:  {relative_error(y, reference):.2e}")
+    y = nearest.process(x, **params)
+    print(f"  nearest grid point instead:        {relative_error(y, reference):.2e}")
+
+    times = {
+        "pedalboard": benchmark(
+            lambda: [pedalboard(item) for item in x], args.num_repeats
+        ),
+        "batched freeverb": benchmark(lambda: freeverb(x), args.num_repeats),
+        "IR convolution": benchmark(lambda: conv(x), args.num_repeats),
+    }
+    for name, seconds in times.items():
+        print(f"{name + ':':<18} {1000 * seconds / n:.1f} ms/example")
@@ -0,0 +1,63 @@
+import time
+import pytorch_lightning as pl
+import hydra
+from omegaconf import DictConfig
+import remfx.utils as utils
+
+log = utils.get_logger(__name__)
+
+
+def bench_loader(loader, num_batches: int, num_epochs: int):
+    """Time num_batches batches of each of num_epochs epochs. The first batch
+    of an epoch includes starting the workers, unless they persist.
+    """
+    results = []
+    for epoch in range(num_epochs):
+        start = time.perf_counter()
+        first = None
+        samples = 0
+        for i, batch in enumerate(loader):
+            if first is None:
+                first = time.perf_counter() - start
+            samples += len(batch[0])
+            if i + 1 >= num_batches:
+                break
+        total = time.perf_counter() - start
+        results.append((epoch, first or 0.0, samples, total))
+    return results
+
+
+@hydra.main(version_base=None, config_path="../cfg", config_name="config.yaml")
+def main(cfg: DictConfig):
+    """Iterate the data loaders of an experiment without a model and report
+    samples/sec per dataset, e.g.
+    python scripts/bench_loader.py +exp=5-5_full_cls_dynamic +bench_batches=20
+    """
+    if cfg.seed:
+        pl.seed_everything(cfg.seed)
+    num_batches = cfg.get("bench_batches", 50)
+    num_epochs = cfg.get("bench_epochs", 2)
+    log.info(f"Instantiating datamodule <{cfg.datamodule._target_}>.")
+    datamodule = hydra.utils.instantiate(cfg.datamodule, _convert_="partial")
+    loaders = {
+        "train": datamodule.train_dataloader,
+        "val": datamodule.val_dataloader,
+        "test": datamodule.test_dataloader,
+    }
+    print("split,dataset,epoch,first_batch_s,samples,samples_per_s")
+    for split, make_loader in loaders.items():
+        dataset = getattr(datamodule, f"{split}_dataset")
+        if dataset is None or isinstance(dataset, str):
+            continue
+        loader = make_loader()
+        for epoch, first, samples, total in bench_loader(
+            loader, num_batches, num_epochs
+        ):
+            print(
+                f"{split},{type(dataset).__name__},{epoch},{first:.3f},"
+                f"{samples},{samples / total:.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
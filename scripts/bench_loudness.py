@@ -0,0 +1,79 @@
+import time
+import argparse
+import torch
+import numpy as np
+import pyloudnorm as pyln
+from remfx.effects import integrated_loudness
+
+
+def make_signals(num_signals: int, chunk_size: int, seed: int = 0):
+    """Noise at random levels, some mono, some stereo, some partly silent."""
+    rng = np.random.default_rng(seed)
+    signals = []
+    for i in range(num_signals):
+        num_channels = 1 + i % 2
+        length = int(rng.integers(chunk_size // 4, chunk_size))
+        x = rng.standard_normal((num_channels, length)) * 10 ** rng.uniform(-4, 0)
+        if i % 3 == 0:
+            x[:, : length // 2] = 0
+        if i % 5 == 0:
+            x[:, length // 3 :] *= 1e-3
+        signals.append(torch.from_numpy(x.astype(np.float32)))
+    return signals
+
+
+def check_parity(signals, sample_rate: int) -> float:
+    meter = pyln.Meter(sample_rate)
+    max_diff = 0.0
+    for x in signals:
+        reference = meter.integrated_loudness(x.permute(1, 0).numpy())
+        measured = integrated_loudness(x, sample_rate).item()
+        if np.isinf(reference) or np.isinf(measured):
+            assert reference == measured, (reference, measured)
+            continue
+        max_diff = max(max_diff, abs(reference - measured))
+    return max_diff
+
+
+def benchmark(fn, num_repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(num_repeats):
+        fn()
+    return (time.perf_counter() - start) / num_repeats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare remfx.effects.integrated_loudness against pyloudnorm."
+    )
+    parser.add_argument("--sample_rate", type=int, default=48000)
+    parser.add_argument("--chunk_size", type=int, default=262144)
+    parser.add_argument("--num_signals", type=int, default=50)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--num_repeats", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=1e-4)
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+
+    signals = make_signals(args.num_signals, args.chunk_size)
+    max_diff = check_parity(signals, args.sample_rate)
+    print(f"Max difference to pyloudnorm: {max_diff:.2e} LU")
+    assert max_diff < args.tolerance, f"Exceeds tolerance of {args.tolerance} LU"
+
+    meter = pyln.Meter(args.sample_rate)
+    batch = 0.1 * torch.randn(args.batch_size, 1, args.chunk_size)
+    pyln_time = benchmark(
+        lambda: [meter.integrated_loudness(x.permute(1, 0).numpy()) for x in batch],
+        args.num_repeats,
+    )
+    loop_time = benchmark(
+        lambda: [integrated_loudness(x, args.sample_rate) for x in batch],
+        args.num_repeats,
+    )
+    batch_time = benchmark(
+        lambda: integrated_loudness(batch, args.sample_rate), args.num_repeats
+    )
+    n = args.batch_size
+    print(f"pyloudnorm:         {1000 * pyln_time / n:.2f} ms/chunk")
+    print(f"torch, per chunk:   {1000 * loop_time / n:.2f} ms/chunk")
+    print(f"torch, batched:     {1000 * batch_time / n:.2f} ms/chunk")
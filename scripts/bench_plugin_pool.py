@@ -0,0 +1,80 @@
+import time
+import argparse
+import torch
+import numpy as np
+from remfx import effects
+from pedalboard import (
+    Pedalboard,
+    Chorus,
+    Compressor,
+    Phaser,
+    Delay,
+    Distortion,
+    Limiter,
+)
+
+# The reverb is left out, as it is not pooled
+EFFECTS = {
+    "compressor": (effects.RandomPedalboardCompressor, Compressor),
+    "delay": (effects.RandomPedalboardDelay, Delay),
+    "chorus": (effects.RandomPedalboardChorus, Chorus),
+    "distortion": (effects.RandomPedalboardDistortion, Distortion),
+    "phaser": (effects.RandomPedalboardPhaser, Phaser),
+    "limiter": (effects.RandomPedalboardLimiter, Limiter),
+}
+
+
+def fresh_forward(effect, plugin_type, x: torch.Tensor) -> torch.Tensor:
+    """Previous implementation: a new Pedalboard and plugin on every call."""
+    params = effect.sample_params()
+    board = Pedalboard([plugin_type(**params)])
+    return torch.from_numpy(board(x.numpy(), effect.sample_rate))
+
+
+def seeded_outputs(fn, inputs, seed: int):
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    return [fn(x) for x in inputs]
+
+
+def calls_per_second(fn, x: torch.Tensor, num_calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(num_calls):
+        fn(x)
+    return num_calls / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare pooled Pedalboard plugins against per-call construction."
+    )
+    parser.add_argument("--sample_rate", type=int, default=48000)
+    parser.add_argument("--chunk_size", type=int, default=4096)
+    parser.add_argument("--num_calls", type=int, default=500)
+    parser.add_argument("--num_checks", type=int, default=20)
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+
+    inputs = [
+        0.1 * torch.randn(1, args.sample_rate) * 10 ** (i % 3 - 2)
+        for i in range(args.num_checks)
+    ]
+    x = 0.1 * torch.randn(1, args.chunk_size)
+    failed = []
+    print(f"Calls/sec on (1, {args.chunk_size}) chunks:")
+    print(f"{'effect':<11} {'exact':<6} {'new/call':>10} {'pooled':>10}")
+    for name, (effect_type, plugin_type) in EFFECTS.items():
+        effect = effect_type(args.sample_rate)
+        pooled = seeded_outputs(effect, inputs, seed=0)
+        fresh = seeded_outputs(
+            lambda x: fresh_forward(effect, plugin_type, x), inputs, seed=0
+        )
+        exact = all(torch.equal(a, b) for a, b in zip(pooled, fresh))
+        if not exact:
+            failed.append(name)
+        fresh_rate = calls_per_second(
+            lambda x: fresh_forward(effect, plugin_type, x), x, args.num_calls
+        )
+        pooled_rate = calls_per_second(effect, x, args.num_calls)
+        print(f"{name:<11} {str(exact):<6} {fresh_rate:10.0f} {pooled_rate:10.0f}")
+    assert not failed, f"Not bit-exact: {', '.join(failed)}"
@@ -0,0 +1,98 @@
+import time
+import argparse
+import tempfile
+import torch
+import torchaudio
+from pathlib import Path
+from remfx.storage import LAYOUT_FORMATS, open_store
+
+NUM_EFFECTS = 5
+
+
+def load_chunks(files, num_chunks: int, chunk_size: int, sample_rate: int):
+    """Consecutive mono chunks of files at sample_rate, looping over them."""
+    audio = []
+    for f in files:
+        x, sr = torchaudio.load(f)
+        x = torchaudio.functional.resample(x.sum(0, keepdim=True), sr, sample_rate)
+        audio.append(x)
+    audio = torch.cat(audio, dim=-1)
+    # Peak below full scale, where integer formats clip
+    audio = 0.5 * audio / audio.abs().max()
+    if audio.shape[-1] < chunk_size:
+        audio = audio.repeat(1, -(-chunk_size // audio.shape[-1]))
+    starts = range(0, audio.shape[-1] - chunk_size + 1, chunk_size)
+    chunks = [audio[:, s : s + chunk_size] for s in starts]
+    return [chunks[i % len(chunks)] for i in range(num_chunks)]
+
+
+def snr_db(x: torch.Tensor, y: torch.Tensor) -> float:
+    noise = (x - y).pow(2).sum().clamp_min(1e-20)
+    return float(10 * torch.log10(x.pow(2).sum() / noise))
+
+
+def bench_store(proc_root, layout, audio_format, chunks, sample_rate, chunk_size):
+    store = open_store(
+        proc_root,
+        sample_rate,
+        chunk_size,
+        NUM_EFFECTS,
+        layout=layout,
+        shard_size=len(chunks),
+        audio_format=audio_format,
+    )
+    store.allocate(len(chunks))
+    labels = torch.zeros(NUM_EFFECTS)
+    start = time.perf_counter()
+    for idx, chunk in enumerate(chunks):
+        # Target slightly differs from input, like a rendered pair
+        store.write(idx, chunk, 0.9 * chunk, labels, labels)
+    write_time = time.perf_counter() - start
+    # Count the allocated blocks, as packed shards are sparse files
+    size = sum(p.stat().st_blocks * 512 for p in Path(proc_root).rglob("*"))
+
+    start = time.perf_counter()
+    snr = float("inf")
+    for idx, chunk in enumerate(chunks):
+        input, target, _, _ = store.read(idx)
+        # Touch the samples, as reads from maps are lazy
+        snr = min(snr, snr_db(chunk, input.view_as(chunk)))
+    read_time = time.perf_counter() - start
+    return size / len(chunks), len(chunks) / write_time, len(chunks) / read_time, snr
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare disk use and throughput of the storage formats."
+    )
+    parser.add_argument("files", nargs="*", default=["example.wav"])
+    parser.add_argument("--num_chunks", type=int, default=64)
+    parser.add_argument("--sample_rate", type=int, default=48000)
+    parser.add_argument("--chunk_size", type=int, default=262144)
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+
+    chunks = load_chunks(args.files, args.num_chunks, args.chunk_size, args.sample_rate)
+    print(
+        f"{'layout':8}{'format':9}{'MB/chunk':>10}{'write/s':>10}"
+        f"{'read/s':>10}{'min SNR dB':>12}"
+    )
+    for layout, formats in LAYOUT_FORMATS.items():
+        for audio_format in formats:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                size, write_rate, read_rate, snr = bench_store(
+                    Path(tmp_dir) / "store",
+                    layout,
+                    audio_format,
+                    chunks,
+                    args.sample_rate,
+                    args.chunk_size,
+                )
+            print(
+                f"{layout:8}{audio_format:9}{size / 2**20:10.2f}{write_rate:10.1f}"
+                f"{read_rate:10.1f}{snr:12.1f}"
+            )
+    print(
+        "Reads are from the page cache. On I/O-bound machines, read rates "
+        "scale roughly inversely with MB/chunk."
+    )
@@ -0,0 +1,22 @@
+import argparse
+from remfx.datasets import locate_files
+from remfx.corpus import corpus_path, prepare_corpus
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Resample the starter datasets once into memory-mapped stores."
+    )
+    parser.add_argument("root", help="Dataset root (usually $DATASET_ROOT).")
+    parser.add_argument("--corpus_root", default="./data/corpus")
+    parser.add_argument("--sample_rate", type=int, default=48000)
+    parser.add_argument("--num_workers", type=int, default=None)
+    parser.add_argument(
+        "--modes", nargs="+", default=["train", "val", "test"], dest="modes"
+    )
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        file_list = locate_files(args.root, mode)
+        path = corpus_path(args.corpus_root, mode, args.sample_rate)
+        print(f"Preparing {mode} corpus at {path}...")
+        prepare_corpus(file_list, path, args.sample_rate, args.num_workers)
@@ -0,0 +1,75 @@
+import os
+import time
+import argparse
+from remfx.datasets import locate_files
+from remfx.cache import list_cache, remove_cache_entry, source_digest
+
+
+def is_stale(info: dict) -> bool:
+    """Whether the sources of a cached render changed since it was made."""
+    config = info["config"]
+    if not os.path.isdir(info["root"]):
+        return True
+    file_list = locate_files(info["root"], config["mode"])
+    return source_digest(file_list) != config["sources"]
+
+
+def describe(info: dict) -> str:
+    config = info["config"]
+    last_used = time.strftime("%Y-%m-%d %H:%M", time.localtime(info["last_used"]))
+    return (
+        f"{info['path']}\n"
+        f"    key={info['key'][:16]} mode={config['mode']} seed={config['seed']} "
+        f"chunks={info['num_completed']}/{info['total_chunks']} "
+        f"size={info['size'] / 1e9:.2f}GB last_used={last_used}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List or clean up cached renders.")
+    parser.add_argument("command", choices=["list", "gc"])
+    parser.add_argument("--render_root", default="./data")
+    parser.add_argument(
+        "--unused_days",
+        type=float,
+        default=None,
+        help="gc: remove renders not used for this many days.",
+    )
+    parser.add_argument(
+        "--incomplete",
+        action="store_true",
+        help="gc: remove renders with fewer chunks than last requested.",
+    )
+    parser.add_argument(
+        "--remove_stale",
+        action="store_true",
+        help="gc: remove renders whose source files changed.",
+    )
+    parser.add_argument("--dry_run", action="store_true")
+    args = parser.parse_args()
+
+    entries = list_cache(args.render_root)
+    if args.command == "list":
+        for info in entries:
+            print(describe(info))
+        total = sum(info["size"] for info in entries)
+        print(f"{len(entries)} cached renders, {total / 1e9:.2f}GB")
+    else:
+        now = time.time()
+        freed = 0
+        for info in entries:
+            reasons = []
+            if args.unused_days is not None:
+                if now - info["last_used"] > args.unused_days * 86400:
+                    reasons.append("unused")
+            if args.incomplete and info["num_completed"] < info["total_chunks"]:
+                reasons.append("incomplete")
+            if args.remove_stale and is_stale(info):
+                reasons.append("stale sources")
+            if not reasons:
+                continue
+            print(f"Removing ({', '.join(reasons)}): {describe(info)}")
+            freed += info["size"]
+            if not args.dry_run:
+                remove_cache_entry(info)
+        print(f"Freed {freed / 1e9:.2f}GB")